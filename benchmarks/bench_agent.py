@@ -0,0 +1,161 @@
+"""What ``start_xray`` costs an app: requests per second and latency per mode.
+
+The stand-in app (``standin.py``) runs under uvicorn in a subprocess for each
+mode, an X-Ray server receives its events. The load is generated by an httpx
+client with a fixed concurrency, which can itself be the bottleneck, so the
+modes are only meaningful compared to each other on the same machine.
+
+    python benchmarks/bench_agent.py --requests 5000 --concurrency 16
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Sequence
+
+import httpx
+from common import free_port, percentile, print_table, wait_for_port, write_results
+from standin import MODES
+
+from fastapi_xray.server import start_server
+from fastapi_xray.server.workers import WORKER_STATS
+
+STANDIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "standin.py")
+COLUMNS = ("mode", "requests", "rps", "p50_ms", "p99_ms", "errors", "events")
+
+
+class EventCounter:
+    """Runs an X-Ray server and counts the events it hands over to the UI."""
+
+    def __init__(self):
+        self.port = free_port()
+        self.queue = multiprocessing.Queue()
+        self.count = 0
+        self.process = multiprocessing.Process(
+            target=start_server,
+            args=(self.queue, "127.0.0.1", self.port, None, None, 0),
+            daemon=True,
+        )
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+
+    def start(self) -> None:
+        self.process.start()
+        wait_for_port(self.port)
+        self._thread.start()
+
+    def _drain(self) -> None:
+        while not self._stop.is_set():
+            try:
+                item = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item[0] != WORKER_STATS:
+                self.count += 1
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.process.terminate()
+        self.process.join()
+
+
+async def load(port: int, requests: int, concurrency: int) -> Dict:
+    latencies: List[float] = []
+    errors = 0
+    remaining = iter(range(requests))
+    payload = {"name": "item", "tags": ["a", "b", "c"], "price": 12.5}
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        nonlocal errors
+        for index in remaining:
+            started = time.perf_counter()
+            try:
+                response = await client.post(f"/items/{index}", json=payload)
+                if response.status_code != 200:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30
+    ) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        duration = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "rps": requests / duration,
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "errors": errors,
+    }
+
+
+def run_mode(mode: str, requests: int, concurrency: int, warmup: int) -> Dict:
+    counter = EventCounter()
+    counter.start()
+    port = free_port()
+    app = subprocess.Popen(
+        [
+            sys.executable,
+            STANDIN,
+            "--port",
+            str(port),
+            "--mode",
+            mode,
+            "--xray-port",
+            str(counter.port),
+        ]
+    )
+    try:
+        wait_for_port(port)
+        asyncio.run(load(port, warmup, concurrency))
+        # Lets the events of the warm up through before counting
+        time.sleep(1)
+        received = counter.count
+        result = asyncio.run(load(port, requests, concurrency))
+        time.sleep(1)
+        result["events"] = counter.count - received
+    finally:
+        app.terminate()
+        app.wait()
+        counter.stop()
+    return {"mode": mode, **result}
+
+
+def run(
+    requests: int = 5000,
+    concurrency: int = 16,
+    modes: Sequence[str] = MODES,
+    warmup: int = 500,
+) -> List[Dict]:
+    results = [run_mode(mode, requests, concurrency, warmup) for mode in modes]
+    print_table(results, COLUMNS)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    results = run(args.requests, args.concurrency, args.modes.split(","))
+    write_results({"agent": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Cost per event of shipping it from the agent to the UI.
+
+Compares the previous path (json.dumps, str through the queue, json.loads and
+validated model) with each installed codec and the trusted model construction.
+
+    python benchmarks/bench_codec.py
+"""
+import json
+import pickle
+import timeit
+
+from common import make_event
+
+from fastapi_xray.codec import available_codecs
+from fastapi_xray.schemas import APIRequest
+
+NUMBER = 2000
+
+
+def per_event(func) -> float:
+    """Microseconds per call."""
+    return min(timeit.repeat(func, number=NUMBER, repeat=5)) / NUMBER * 1e6
+
+
+def main():
+    event = make_event()
+
+    def legacy():
+        # What used to happen: agent, receiver, queue, UI
+        payload = json.dumps(event).encode("utf-8")
+        text = pickle.loads(pickle.dumps(payload.decode("utf-8")))
+        APIRequest(**json.loads(text))
+
+    print(
+        f"{'path':<28}{'size':>8}{'encode':>10}{'decode':>10}{'total':>10}  (µs/event)"
+    )
+    print(
+        f"{'legacy json + validation':<28}{'':>8}{'':>10}{'':>10}{per_event(legacy):>10.1f}"
+    )
+
+    for name, codec in available_codecs().items():
+        payload = codec.encode(event)
+        decoded = codec.decode(payload)
+        encode = per_event(lambda codec=codec: codec.encode(event))
+        decode = per_event(
+            lambda codec=codec, payload=payload: APIRequest.from_event(
+                codec.decode(pickle.loads(pickle.dumps(payload)))
+            )
+        )
+        print(
+            f"{name:<28}{len(payload):>8}{encode:>10.1f}{decode:>10.1f}{encode + decode:>10.1f}"
+        )
+
+    validated = per_event(lambda: APIRequest(**decoded))
+    trusted = per_event(lambda: APIRequest.from_event(decoded))
+    print(f"\nmodel: validated {validated:.1f} µs, trusted {trusted:.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
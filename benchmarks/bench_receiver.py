@@ -0,0 +1,131 @@
+"""How many events per second the X-Ray server absorbs.
+
+The server runs in a subprocess as ``fastapi_xray run`` starts it, without
+the reorder window. Sender processes push pre-encoded batches as fast as they
+can, the events are counted once they come out of the queue the UI reads.
+
+    python benchmarks/bench_receiver.py --events 50000
+"""
+import argparse
+import multiprocessing
+import socket
+import time
+from typing import Dict, List, Sequence
+
+from common import free_port, make_event, print_table, wait_for_port, write_results
+
+from fastapi_xray import protocol
+from fastapi_xray.codec import get_codec
+from fastapi_xray.server import start_server
+from fastapi_xray.server.workers import WORKER_STATS
+
+PAYLOAD_SIZES = (512, 4096, 32768)
+SENDERS = (1, 4, 16)
+BATCH_SIZE = 100
+COLUMNS = ("size", "payload_bytes", "senders", "events", "events_per_s", "mb_per_s")
+
+
+def sized_payload(size: int, codec) -> bytes:
+    """An encoded event of about ``size`` bytes."""
+    base = len(codec.encode(make_event(queries=2)))
+    return codec.encode(make_event(queries=2, padding=max(0, size - base)))
+
+
+def send(port: int, batch: bytes, batches: int, ready, go) -> None:
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sock.sendall(protocol.PREAMBLE)
+        ready.release()
+        go.wait()
+        for _ in range(batches):
+            sock.sendall(batch)
+
+
+def run_case(size: int, senders: int, events: int, codec) -> Dict:
+    port = free_port()
+    shared_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=start_server,
+        args=(shared_queue, "127.0.0.1", port, None, None, 0),
+        daemon=True,
+    )
+    server.start()
+    wait_for_port(port)
+
+    payload = sized_payload(size, codec)
+    # Tagged as the agents tag their batches
+    tag = codec.encode({"id": "bench", "seq": BATCH_SIZE, "sent_at": time.time()})
+    batch = protocol.encode_batch([payload] * BATCH_SIZE, codec.id, tag=tag)
+    batches = max(1, events // senders // BATCH_SIZE)
+    total = batches * senders * BATCH_SIZE
+
+    ready = multiprocessing.Semaphore(0)
+    go = multiprocessing.Event()
+    processes = [
+        multiprocessing.Process(target=send, args=(port, batch, batches, ready, go))
+        for _ in range(senders)
+    ]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.acquire()
+
+    received = 0
+    started = time.perf_counter()
+    go.set()
+    while received < total:
+        item = shared_queue.get(timeout=60)
+        if item[0] != WORKER_STATS:
+            received += 1
+    duration = time.perf_counter() - started
+
+    for process in processes:
+        process.join()
+    server.terminate()
+    server.join()
+    return {
+        "size": size,
+        "payload_bytes": len(payload),
+        "senders": senders,
+        "events": total,
+        "events_per_s": total / duration,
+        "mb_per_s": total * len(payload) / duration / 1024 / 1024,
+    }
+
+
+def run(
+    events: int = 50000,
+    sizes: Sequence[int] = PAYLOAD_SIZES,
+    senders: Sequence[int] = SENDERS,
+    codec: str = None,
+) -> List[Dict]:
+    codec = get_codec(codec)
+    results = []
+    for size in sizes:
+        # Large payloads are capped to about 256 MiB per case
+        count = min(events, 256 * 1024 * 1024 // size)
+        for sender_count in senders:
+            results.append(run_case(size, sender_count, count, codec))
+    print_table(results, COLUMNS)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=50000)
+    parser.add_argument("--sizes", default=",".join(map(str, PAYLOAD_SIZES)))
+    parser.add_argument("--senders", default=",".join(map(str, SENDERS)))
+    parser.add_argument("--codec", help="json, orjson or msgpack")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    results = run(
+        args.events,
+        [int(size) for size in args.sizes.split(",")],
+        [int(count) for count in args.senders.split(",")],
+        args.codec,
+    )
+    write_results({"receiver": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
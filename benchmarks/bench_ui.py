@@ -0,0 +1,72 @@
+"""How many events per second the UI ingests, headless.
+
+The queue is filled with encoded events before the UI starts, the time is
+taken until the UI has decoded, stored and listed all of them. Each codec
+runs in its own process.
+
+    python benchmarks/bench_ui.py --events 20000
+"""
+import argparse
+import asyncio
+import queue
+import time
+from typing import Dict, List, Sequence
+
+from common import make_event, print_table, run_isolated, write_results
+
+from fastapi_xray.codec import available_codecs
+from fastapi_xray.ui.app import MainApp
+from fastapi_xray.ui.store import RequestStore
+
+COLUMNS = ("codec", "events", "events_per_s", "us_per_event")
+
+
+async def ingest(shared_queue: queue.Queue, events: int) -> float:
+    app = MainApp(queue=shared_queue, store=RequestStore(max_requests=10000))
+    async with app.run_test(headless=True) as pilot:
+        started = time.perf_counter()
+        while app.store.total < events:
+            await app.ingest()
+            # Lets the list render, as it would between two refreshes
+            await pilot.pause(0)
+        return time.perf_counter() - started
+
+
+def run_codec(name: str, codec, events: int) -> Dict:
+    shared_queue = queue.Queue()
+    for _ in range(events):
+        shared_queue.put((time.time(), codec.id, codec.encode(make_event())))
+
+    duration = asyncio.run(ingest(shared_queue, events))
+    return {
+        "codec": name,
+        "events": events,
+        "events_per_s": events / duration,
+        "us_per_event": duration / events * 1e6,
+    }
+
+
+def run(events: int = 20000, codecs: Sequence[str] = ()) -> List[Dict]:
+    available = available_codecs()
+    results = [
+        run_isolated(run_codec, name, codec, events)
+        for name, codec in available.items()
+        if not codecs or name in codecs
+    ]
+    print_table(results, COLUMNS)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--codecs", default="", help="Comma separated, all by default.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    results = run(args.events, [name for name in args.codecs.split(",") if name])
+    write_results({"ui_ingest": results}, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Helpers shared by the benchmarks."""
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from typing import Dict, List, Optional, Sequence
+
+# The benchmarks measure the package of this checkout, installed or not
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from fastapi_xray.schemas import SCHEMA_VERSION  # noqa: E402
+
+
+def make_event(queries: int = 10, padding: int = 0) -> dict:
+    """A typical event, ``padding`` bytes of request body make it larger."""
+    return {
+        "schema_version": SCHEMA_VERSION,
+        "request_id": str(uuid.uuid4()),
+        "timestamp": time.time(),
+        "route": "/items/{item_id}",
+        "request": {
+            "base_url": "http://testserver/",
+            "query_params": {"page": "2", "size": "50"},
+            "path_params": {"item_id": "42"},
+            "path": "/items/42",
+            "status_code": 200,
+            "method": "POST",
+            "cookies": {"session": "x" * 32},
+            "headers": {
+                "host": "testserver",
+                "user-agent": "benchmark",
+                "accept": "*/*",
+                "content-type": "application/json",
+                "content-length": "120",
+            },
+            "body": {
+                "name": "item",
+                "tags": ["a", "b", "c"],
+                "price": 12.5,
+                "padding": "p" * padding,
+            },
+        },
+        "response": {
+            "headers": {"content-type": "application/json", "content-length": "64"},
+            "body": {"id": 42, "name": "item", "tags": ["a", "b", "c"]},
+            "size": 64,
+            "time_to_first_byte": 1.2345,
+        },
+        "sql": [
+            {
+                "statement": "SELECT items.id, items.name FROM items WHERE items.id = ?",
+                "fingerprint": "select items.id,items.name from items where items.id=?",
+                "parameters": [index],
+                "paramstyle": "qmark",
+                "dialect": "sqlite",
+                "executemany": False,
+                "execution_time": 0.1234,
+            }
+            for index in range(queries)
+        ],
+        "elapsed_time": 3.4567,
+    }
+
+
+def percentile(values: Sequence[float], quantile: float) -> float:
+    """The nearest-rank percentile of already sorted values."""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(quantile / 100 * len(values))) - 1))
+    return values[index]
+
+
+def run_isolated(func, *args):
+    """Calls ``func`` in a child process, so runs don't slow each other down,
+    e.g. with the garbage of the previous one. Returns what it returns."""
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_call_and_put, args=(results, func, args), daemon=True
+    )
+    process.start()
+    result = results.get()
+    process.join()
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+def _call_and_put(results, func, args) -> None:
+    try:
+        results.put(func(*args))
+    except Exception as e:
+        results.put(e)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"Nothing listens on port {port} after {timeout}s")
+
+
+def metadata() -> Dict:
+    """Describes what the results were measured on."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+
+    try:
+        from importlib.metadata import version
+
+        package_version = version("fastapi_xray")
+    except Exception:
+        package_version = None
+
+    return {
+        "version": package_version,
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def write_results(results: Dict, output: Optional[str]) -> None:
+    results = {"meta": metadata(), **results}
+    text = json.dumps(results, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+        print(f"Results written to {output}")
+    else:
+        print(text)
+
+
+def print_table(rows: List[Dict], columns: Sequence[str]) -> None:
+    widths = [max(len(column) + 2, 12) for column in columns]
+    print("".join(f"{column:>{width}}" for column, width in zip(columns, widths)))
+    for row in rows:
+        cells = []
+        for column, width in zip(columns, widths):
+            value = row.get(column)
+            text = f"{value:.2f}" if isinstance(value, float) else str(value)
+            cells.append(f"{text:>{width}}")
+        print("".join(cells))
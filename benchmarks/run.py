@@ -0,0 +1,111 @@
+"""Runs the benchmark suite and writes the results as JSON.
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --quick --compare results.json
+
+``--compare`` prints how each result moved against a previous run, and exits
+with status 1 when one of them got worse by more than ``--threshold`` percent.
+
+The benchmarks need a few more packages than X-Ray itself:
+
+    pip install -r benchmarks/requirements.txt
+"""
+import argparse
+import json
+import sys
+from typing import Dict, List
+
+try:
+    import bench_agent
+    import bench_receiver
+    import bench_ui
+    from common import write_results
+except ImportError as e:
+    sys.exit(
+        f"The benchmarks need {e.name}, which is not installed: "
+        "pip install -r benchmarks/requirements.txt"
+    )
+
+SUITES = ("agent", "receiver", "ui_ingest")
+
+# Fields identifying a result, and its metrics with whether higher is better
+KEYS = {
+    "agent": ("mode",),
+    "receiver": ("size", "senders"),
+    "ui_ingest": ("codec",),
+}
+METRICS = {
+    "agent": {"rps": True, "p50_ms": False, "p99_ms": False},
+    "receiver": {"events_per_s": True},
+    "ui_ingest": {"events_per_s": True},
+}
+
+
+def run_suites(suites: List[str], quick: bool) -> Dict:
+    results = {}
+    if "agent" in suites:
+        results["agent"] = bench_agent.run(
+            requests=1000 if quick else 5000, warmup=100 if quick else 500
+        )
+    if "receiver" in suites:
+        results["receiver"] = bench_receiver.run(
+            events=10000 if quick else 50000,
+            senders=(1, 4) if quick else bench_receiver.SENDERS,
+        )
+    if "ui_ingest" in suites:
+        results["ui_ingest"] = bench_ui.run(events=5000 if quick else 20000)
+    return results
+
+
+def compare(results: Dict, previous: Dict, threshold: float) -> bool:
+    """Prints the changes against ``previous``, returns whether one regressed."""
+    regressed = False
+    for suite, rows in results.items():
+        keys = KEYS[suite]
+        before = {
+            tuple(row[key] for key in keys): row for row in previous.get(suite, [])
+        }
+        for row in rows:
+            old = before.get(tuple(row[key] for key in keys))
+            if old is None:
+                continue
+            for metric, higher_is_better in METRICS[suite].items():
+                if not old.get(metric):
+                    continue
+                change = (row[metric] - old[metric]) / old[metric] * 100
+                worse = -change if higher_is_better else change
+                flag = ""
+                if worse > threshold:
+                    flag = "  REGRESSION"
+                    regressed = True
+                name = "/".join(str(row[key]) for key in keys)
+                print(
+                    f"{suite:<10} {name:<16} {metric:<13}"
+                    f"{old[metric]:>12.2f} -> {row[metric]:>12.2f} ({change:+.1f}%){flag}"
+                )
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--suites", default=",".join(SUITES))
+    parser.add_argument(
+        "--quick", action="store_true", help="Fewer events, for a smoke run."
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="JSON results of a previous run.")
+    parser.add_argument("--threshold", type=float, default=10.0)
+    args = parser.parse_args()
+
+    results = run_suites(args.suites.split(","), args.quick)
+    write_results(results, args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if compare(results, previous, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""A small FastAPI app backed by SQLite, served by uvicorn, to benchmark the agent.
+
+    python benchmarks/standin.py --port 8000 --mode on --xray-port 8989
+
+Modes:
+
+- ``off``: X-Ray is not started.
+- ``on``: every request is captured.
+- ``sampled``: 10% of the requests are captured, plus the failed ones.
+- ``errors``: only failed requests and requests slower than 500 ms are captured.
+"""
+import argparse
+import os
+import tempfile
+
+import uvicorn
+from common import ROOT  # noqa: F401, puts this checkout on the path
+from fastapi import FastAPI, HTTPException
+from sqlalchemy import create_engine, text
+
+from fastapi_xray import Sampler, start_xray
+
+MODES = ("off", "on", "sampled", "errors")
+
+SAMPLING = {
+    "on": None,
+    "sampled": Sampler(rate=0.1),
+    "errors": Sampler(rate=0.0, capture_errors=True, slow_threshold=500),
+}
+
+
+def create_app(mode: str, xray_port: int, database: str) -> FastAPI:
+    engine = create_engine(
+        f"sqlite:///{database}", connect_args={"check_same_thread": False}
+    )
+    with engine.begin() as connection:
+        connection.execute(
+            text("CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY, name TEXT)")
+        )
+        connection.execute(text("DELETE FROM items"))
+        connection.execute(
+            text("INSERT INTO items (id, name) VALUES (:id, :name)"),
+            [{"id": index, "name": f"item {index}"} for index in range(100)],
+        )
+
+    app = FastAPI()
+
+    @app.post("/items/{item_id}")
+    def update_item(item_id: int, payload: dict):
+        with engine.connect() as connection:
+            row = connection.execute(
+                text("SELECT id, name FROM items WHERE id = :id"), {"id": item_id % 100}
+            ).first()
+        if row is None:
+            raise HTTPException(status_code=404)
+        return {"id": row.id, "name": row.name, **payload}
+
+    if mode != "off":
+        start_xray(
+            app,
+            engine,
+            host="127.0.0.1",
+            port=xray_port,
+            sampling=SAMPLING[mode],
+        )
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--mode", choices=MODES, default="on")
+    parser.add_argument("--xray-port", type=int, default=8989)
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(prefix="xray-bench-"), "items.sqlite")
+    app = create_app(args.mode, args.xray_port, database)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
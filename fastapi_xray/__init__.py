@@ -1 +1,18 @@
-from .xray import start_xray  # noqa
+import importlib
+
+# The app side pulls in FastAPI, it is only imported once used, so the CLI starts fast
+_EXPORTS = {
+    "Sampler": "fastapi_xray.sampling",
+    "SamplingPolicy": "fastapi_xray.sampling",
+    "start_xray": "fastapi_xray.xray",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,300 @@
+"""Request and response body capture by teeing the ASGI message streams.
+
+The app reads and writes the bodies as usual while a bounded copy of them is
+kept on the side, so the bodies are never buffered twice and never parsed on
+the request path.
+"""
+import hashlib
+import json
+import re
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from starlette.types import Message, Receive
+
+_NOT_PARSED = object()
+
+_DISPOSITION_PARAM = re.compile(r';\s*(\w+)\*?="?([^";]*)"?')
+
+
+def parse_content_type(value: Optional[str]) -> Tuple[str, Dict[str, str]]:
+    """Splits a Content-Type header into its media type and parameters."""
+    if not value:
+        return "", {}
+
+    media_type, *params = value.split(";")
+    parsed = {}
+    for param in params:
+        key, _, param_value = param.partition("=")
+        parsed[key.strip().lower()] = param_value.strip().strip('"')
+    return media_type.strip().lower(), parsed
+
+
+def is_json(media_type: str) -> bool:
+    return media_type == "application/json" or media_type.endswith("+json")
+
+
+def is_text(media_type: str) -> bool:
+    return (
+        media_type.startswith("text/")
+        or is_json(media_type)
+        or media_type.endswith("+xml")
+        or media_type in ("application/xml", "application/x-www-form-urlencoded")
+    )
+
+
+class MultipartScanner:
+    """Collects the part headers and sizes of a streamed multipart body.
+
+    The content of the parts is counted and dropped, only a few bytes are held
+    back in between chunks in case a boundary is split across them.
+    """
+
+    MAX_PARTS = 100
+    MAX_HEADERS_SIZE = 16 * 1024
+
+    def __init__(self, boundary: str):
+        self.delimiter = b"\r\n--" + boundary.encode("latin-1")
+        self.parts: List[Dict[str, Any]] = []
+        self.complete = False
+        self.truncated = False
+        self._part: Optional[Dict[str, Any]] = None
+        self._state = "content"
+        # The first delimiter is not preceded by a line break
+        self._pending = bytearray(b"\r\n")
+
+    def feed(self, chunk: bytes) -> None:
+        if self.complete or self.truncated:
+            return
+        self._pending += chunk
+
+        while True:
+            pending = self._pending
+            if self._state == "content":
+                index = pending.find(self.delimiter)
+                if index == -1:
+                    consumed = max(0, len(pending) - len(self.delimiter) + 1)
+                    self._count(consumed)
+                    del pending[:consumed]
+                    return
+                self._count(index)
+                if self._part is not None:
+                    self.parts.append(self._part)
+                    self._part = None
+                del pending[: index + len(self.delimiter)]
+                self._state = "delimiter"
+            elif self._state == "delimiter":
+                if len(pending) < 2:
+                    return
+                if pending.startswith(b"--"):
+                    self.complete = True
+                    return
+                if len(self.parts) >= self.MAX_PARTS:
+                    self.truncated = True
+                    return
+                self._state = "headers"
+            else:
+                index = pending.find(b"\r\n\r\n")
+                if index == -1:
+                    self.truncated = len(pending) > self.MAX_HEADERS_SIZE
+                    return
+                headers = bytes(pending[:index]).decode("latin-1")
+                self._part = parse_part_headers(headers)
+                self._part["size"] = 0
+                del pending[: index + 4]
+                self._state = "content"
+
+    def _count(self, size: int) -> None:
+        if self._part is not None:
+            self._part["size"] += size
+
+
+def parse_part_headers(headers: str) -> Dict[str, Any]:
+    part: Dict[str, Any] = {"name": None, "filename": None, "content_type": None}
+    for line in headers.strip().split("\r\n"):
+        key, _, value = line.partition(":")
+        key = key.strip().lower()
+        if key == "content-disposition":
+            for param, param_value in _DISPOSITION_PARAM.findall(value):
+                if param.lower() in ("name", "filename"):
+                    part[param.lower()] = param_value
+        elif key == "content-type":
+            part["content_type"] = value.strip()
+    return part
+
+
+class BodyCapture:
+    """Wraps an ASGI ``receive`` callable and keeps a copy of the body.
+
+    At most ``max_bytes`` of text bodies are kept, the total size is always
+    counted. Binary bodies are hashed as they stream through and multipart
+    bodies are scanned for their part headers, neither is kept. The copy is
+    only parsed when ``body`` is first accessed.
+    """
+
+    def __init__(self, receive: Receive, content_type: Optional[str], max_bytes: int):
+        self.receive = receive
+        self.max_bytes = max_bytes
+        self.media_type, self.params = parse_content_type(content_type)
+
+        self.size = 0
+        self.truncated = False
+        self.buffer = bytearray()
+        self.hasher = None
+        self.multipart = None
+        if self.media_type.startswith("multipart/") and "boundary" in self.params:
+            self.multipart = MultipartScanner(self.params["boundary"])
+        elif not is_text(self.media_type):
+            self.hasher = hashlib.sha256()
+        self._body = _NOT_PARSED
+        # Time spent copying the body, in nanoseconds
+        self.elapsed_ns = 0
+
+    async def __call__(self) -> Message:
+        message = await self.receive()
+        if message["type"] == "http.request":
+            started = time.perf_counter_ns()
+            self.feed(message.get("body", b""))
+            self.elapsed_ns += time.perf_counter_ns() - started
+        return message
+
+    def feed(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        self.size += len(chunk)
+
+        if self.multipart is not None:
+            self.multipart.feed(chunk)
+            return
+        if self.hasher is not None:
+            self.hasher.update(chunk)
+            return
+
+        room = self.max_bytes - len(self.buffer)
+        if room <= 0:
+            self.truncated = True
+        elif len(chunk) > room:
+            self.buffer += chunk[:room]
+            self.truncated = True
+        else:
+            self.buffer += chunk
+
+    @property
+    def body(self) -> Any:
+        """The parsed body, computed once."""
+        if self._body is _NOT_PARSED:
+            self._body = self.parse() if self.size else None
+        return self._body
+
+    def parse(self) -> Any:
+        media_type = self.media_type
+
+        if self.multipart is not None:
+            return {
+                "size": self.size,
+                "parts": self.multipart.parts,
+                "truncated": self.multipart.truncated,
+            }
+
+        if self.hasher is not None:
+            return {
+                "content_type": media_type or None,
+                "size": self.size,
+                "sha256": self.hasher.hexdigest(),
+            }
+
+        text = bytes(self.buffer).decode(self.params.get("charset", "utf-8"), "replace")
+        if self.truncated:
+            return f"{text}… [truncated, {self.size} bytes in total]"
+
+        if is_json(media_type):
+            try:
+                return json.loads(text)
+            except ValueError:
+                return text
+        if media_type == "application/x-www-form-urlencoded":
+            return dict(parse_qsl(text, keep_blank_values=True))
+        return text
+
+
+class ResponseCapture:
+    """Keeps a copy of the first ``max_bytes`` of a response body.
+
+    Only textual bodies are kept, others are summarized by their content type
+    and size. Gzip encoded bodies are decompressed up to the cap. The copy is
+    only parsed when ``body`` is first accessed.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.media_type = ""
+        self.params: Dict[str, str] = {}
+
+        self.size = 0
+        self.truncated = False
+        self.buffer = bytearray()
+        self.keep = False
+        self.decompressor = None
+        # perf_counter() time of the last body chunk
+        self.finished_at: Optional[float] = None
+        self._body = _NOT_PARSED
+
+    def start(self, headers: Dict[str, str]) -> None:
+        """Called with the response headers, before the body is sent."""
+        self.media_type, self.params = parse_content_type(headers.get("content-type"))
+        self.keep = self.max_bytes > 0 and is_text(self.media_type)
+
+        encoding = headers.get("content-encoding", "").strip().lower()
+        if encoding == "gzip":
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding not in ("", "identity"):
+            # Can't be decoded, e.g. brotli
+            self.keep = False
+
+    def feed(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        self.size += len(chunk)
+        if not self.keep or self.truncated:
+            return
+
+        room = self.max_bytes - len(self.buffer)
+        if room <= 0:
+            self.truncated = True
+            return
+        if self.decompressor is not None:
+            try:
+                chunk = self.decompressor.decompress(chunk, room)
+            except zlib.error:
+                self.keep = False
+                return
+            if self.decompressor.unconsumed_tail:
+                self.truncated = True
+        elif len(chunk) > room:
+            chunk = chunk[:room]
+            self.truncated = True
+        self.buffer += chunk
+
+    @property
+    def body(self) -> Any:
+        """The parsed body, computed once."""
+        if self._body is _NOT_PARSED:
+            self._body = self.parse() if self.size else None
+        return self._body
+
+    def parse(self) -> Any:
+        if not self.keep:
+            return {"content_type": self.media_type or None, "size": self.size}
+
+        text = bytes(self.buffer).decode(self.params.get("charset", "utf-8"), "replace")
+        if self.truncated:
+            return f"{text}… [truncated, {self.size} bytes sent in total]"
+
+        if is_json(self.media_type):
+            try:
+                return json.loads(text)
+            except ValueError:
+                return text
+        return text
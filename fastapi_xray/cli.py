@@ -1,14 +1,43 @@
 import multiprocessing
+import shutil
+import sys
+import tempfile
 from multiprocessing import Process
+from pathlib import Path
+from typing import Optional
 
 import typer
-from typer import Argument
+from typer import Argument, Option
+from typer.core import TyperGroup
 
 from fastapi_xray.commons.logger import get_logger
-from fastapi_xray.server import start_server
-from fastapi_xray.ui.app import render_ui
+from fastapi_xray.export import (
+    FORMATS,
+    ExportError,
+    export_file,
+    guess_format,
+    import_file,
+)
+from fastapi_xray.server import start_headless, start_server
+from fastapi_xray.server.headless import SUMMARY_INTERVAL
+from fastapi_xray.server.workers import REORDER_WINDOW
 
-app = typer.Typer()
+
+class DefaultCommandGroup(TyperGroup):
+    """Runs the ``run`` command when no other command is named.
+
+    Keeps ``fastapi_xray [HOST] [PORT]`` working now that there are several commands.
+    """
+
+    def parse_args(self, ctx, args):
+        if not args or (
+            args[0] not in self.commands and args[0] not in ctx.help_option_names
+        ):
+            args = ["run", *args]
+        return super().parse_args(ctx, args)
+
+
+app = typer.Typer(cls=DefaultCommandGroup)
 
 logger = get_logger()
 
@@ -25,17 +54,161 @@ def run(
     disable_log: bool = Argument(  # noqa :B008
         True, help="Generate logs for debugging."
     ),
+    max_requests: int = Option(  # noqa :B008
+        10000, help="Max number of requests kept in the UI, 0 for no limit."
+    ),
+    max_memory_mb: int = Option(  # noqa :B008
+        512, help="Approximate max memory used by the kept requests, 0 for no limit."
+    ),
+    address: Optional[str] = Option(  # noqa :B008
+        None,
+        help="Listen on unix:///path/to/socket or on the shm://name shared memory ring "
+        "(and on HOST and PORT as a fallback) instead of HOST and PORT.",
+    ),
+    reorder_window: float = Option(  # noqa :B008
+        REORDER_WINDOW,
+        help="Seconds the requests are held back to be shown in order across workers, 0 to disable.",
+    ),
+    store: Optional[Path] = Option(  # noqa :B008
+        None,
+        help="Directory where the captured requests are recorded, see the open command.",
+        file_okay=False,
+    ),
+    store_max_mb: int = Option(  # noqa :B008
+        1024, help="Max disk space used by the recording, 0 for no limit."
+    ),
+    store_max_age_hours: float = Option(  # noqa :B008
+        0, help="Recorded requests older than this are dropped, 0 for no limit."
+    ),
+    headless: bool = Option(  # noqa :B008
+        False,
+        help="Only run the X-Ray server, writing the events to --output and printing "
+        "a summary line every --summary-interval seconds.",
+    ),
+    output: Optional[str] = Option(  # noqa :B008
+        None,
+        help="NDJSON file the events are appended to in --headless mode, - for stdout. "
+        "Defaults to stdout, or to nothing when --store is given.",
+    ),
+    summary_interval: float = Option(  # noqa :B008
+        SUMMARY_INTERVAL,
+        help="Seconds between two summary lines in --headless mode, 0 to disable.",
+    ),
 ):
     """Runs the UI server and X-Ray server."""
 
     logger.disabled = disable_log  # only for internal debugging
-    shared_queue = multiprocessing.Queue()
 
-    p1 = Process(target=start_server, args=(shared_queue, host, port))
+    store_options = None
+    if store is not None:
+        store_options = {
+            "directory": str(store),
+            "max_bytes": store_max_mb * 1024 * 1024 or None,
+            "max_age": store_max_age_hours * 3600 or None,
+        }
+
+    if headless:
+        if output is None and store is None:
+            output = "-"
+        start_headless(
+            host,
+            port,
+            output,
+            store_options,
+            address,
+            reorder_window,
+            summary_interval,
+        )
+        return
+
+    # Imported once needed, Textual alone takes longer to import than the rest of the CLI
+    from fastapi_xray.ui.app import render_ui
+
+    shared_queue = multiprocessing.Queue()
+    p1 = Process(
+        target=start_server,
+        args=(shared_queue, host, port, store_options, address, reorder_window),
+    )
     p1.daemon = True
     p1.start()
 
-    render_ui(shared_queue)
+    render_ui(
+        shared_queue,
+        max_requests=max_requests or None,
+        max_bytes=max_memory_mb * 1024 * 1024 or None,
+    )
+
+
+@app.command("open")
+def open_recording(
+    path: Path = Argument(  # noqa :B008
+        ...,
+        help="Directory of a session recorded with --store, or a .ndjson or .har export.",
+        exists=True,
+    ),
+    store: Optional[Path] = Option(  # noqa :B008
+        None,
+        help="Directory where an export is imported to, a temporary one by default.",
+        file_okay=False,
+    ),
+    disable_log: bool = Option(True, help="Generate logs for debugging."),  # noqa :B008
+):
+    """Browses a recorded session or an export, without starting the X-Ray server."""
+
+    logger.disabled = disable_log  # only for internal debugging
+    from fastapi_xray.ui.app import render_recording
+
+    if path.is_dir():
+        render_recording(str(path))
+        return
+
+    # Exports are imported to a recording first, which is browsed from disk
+    directory = str(store) if store else tempfile.mkdtemp(prefix="xray-import-")
+    try:
+        try:
+            count = import_file(str(path), directory)
+        except ExportError as e:
+            typer.echo(f"{path} could not be imported: {e}", err=True)
+            raise typer.Exit(1)
+        typer.echo(f"Imported {count} requests from {path}", err=True)
+        render_recording(directory)
+    finally:
+        if store is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+@app.command("export")
+def export(
+    source: Path = Argument(  # noqa :B008
+        ...,
+        help="Directory of a session recorded with --store, or an export to convert.",
+        exists=True,
+    ),
+    output: str = Argument(  # noqa :B008
+        "-", help="File the requests are written to, - for stdout."
+    ),
+    format: Optional[str] = Option(  # noqa :B008
+        None,
+        help=f"One of {', '.join(FORMATS)}, guessed from the output file name by default.",  # noqa :B008
+    ),
+):
+    """Exports recorded requests as NDJSON or HAR 1.2, without loading them in memory."""
+
+    format = format or guess_format(output)
+    if format not in FORMATS:
+        raise typer.BadParameter(
+            f"Use one of {', '.join(FORMATS)}", param_hint="--format"
+        )
+    try:
+        if output == "-":
+            count = export_file(str(source), sys.stdout, format)
+        else:
+            with open(output, "w", encoding="utf-8") as f:
+                count = export_file(str(source), f, format)
+    except ExportError as e:
+        typer.echo(f"{source} could not be exported: {e}", err=True)
+        raise typer.Exit(1)
+    typer.echo(f"Exported {count} requests", err=True)
 
 
 if __name__ == "__main__":
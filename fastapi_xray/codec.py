@@ -0,0 +1,109 @@
+"""Serialization of the events shipped by the agent.
+
+Every frame carries the id of the codec its events were encoded with. orjson
+produces plain JSON and shares the id of the stdlib json codec, so each end
+uses whichever of the two is installed. msgpack is only used when asked for,
+the receiving end needs it installed as well.
+"""
+import json
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+JSON = 1
+MSGPACK = 2
+
+
+class Codec:
+    id: int
+    name: str
+
+    def encode(self, obj: Any) -> bytes:
+        raise NotImplementedError()
+
+    def decode(self, data: bytes) -> Any:
+        raise NotImplementedError()
+
+
+class JSONCodec(Codec):
+    id = JSON
+    name = "json"
+
+    def encode(self, obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class ORJSONCodec(JSONCodec):
+    name = "orjson"
+
+    def encode(self, obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # e.g. integers above 64 bits, which the stdlib handles
+            return super().encode(obj)
+
+    def decode(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    id = MSGPACK
+    name = "msgpack"
+
+    def encode(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+@lru_cache(maxsize=None)
+def available_codecs() -> Dict[str, Codec]:
+    """The codecs which can be used with the installed packages, by name."""
+    codecs: Dict[str, Codec] = {"json": JSONCodec()}
+    if orjson is not None:
+        codecs["orjson"] = ORJSONCodec()
+    if msgpack is not None:
+        codecs["msgpack"] = MsgpackCodec()
+    return codecs
+
+
+def get_codec(name: Optional[str] = None) -> Codec:
+    """Returns the codec used to encode events.
+
+    Defaults to the fastest JSON codec installed.
+    """
+    if name is None:
+        name = "orjson" if orjson is not None else "json"
+
+    codecs = available_codecs()
+    if name not in codecs:
+        if name in ("orjson", "msgpack"):
+            raise ValueError(f"The {name} codec requires `pip install {name}`")
+        raise ValueError(f"Unknown codec {name!r}")
+    return codecs[name]
+
+
+@lru_cache(maxsize=None)
+def codec_for(codec_id: int) -> Codec:
+    """Returns the codec used to decode the events of a frame."""
+    if codec_id == JSON:
+        return ORJSONCodec() if orjson is not None else JSONCodec()
+    if codec_id == MSGPACK:
+        if msgpack is None:
+            raise ValueError("Received msgpack events, `pip install msgpack`")
+        return MsgpackCodec()
+    raise ValueError(f"Unknown codec id {codec_id}")
@@ -0,0 +1,425 @@
+"""Streaming export and import of captured events, as NDJSON or HAR 1.2.
+
+Both formats are written and read one event at a time, so a capture of any
+size takes the same memory. NDJSON holds the events as the agent sent them,
+one per line. HAR entries carry what HAR has room for, and the rest of the
+event in custom fields: ``_sql``, ``_timings`` and ``_xray``.
+
+An imported file is validated and written to a ``CaptureStore``, which the UI
+then browses without loading it in memory.
+"""
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from fastapi_xray.codec import JSON, codec_for, get_codec
+from fastapi_xray.commons.logger import get_logger
+from fastapi_xray.storage import CaptureStore
+
+logger = get_logger()
+
+FORMATS = ("ndjson", "har")
+
+HAR_VERSION = "1.2"
+# Key of the records the headless server writes for the events it could not
+# decode, they are skipped when the file is read
+ERROR_RECORD = "_xray_error"
+# Size of the chunks a HAR file is read by
+READ_SIZE = 64 * 1024
+# Characters a HAR entry can take, a larger one is an error rather than a buffer
+# growing with the file
+MAX_ENTRY_SIZE = 64 * 1024 * 1024
+# Imported events are indexed every this many events
+IMPORT_FLUSH = 1000
+
+_decoder = json.JSONDecoder()
+
+
+class ExportError(Exception):
+    pass
+
+
+def guess_format(path: str) -> str:
+    return "har" if path.lower().endswith(".har") else "ndjson"
+
+
+# Writing
+
+
+class NDJSONWriter:
+    """Writes the events one per line."""
+
+    def __init__(self, output: TextIO):
+        self.output = output
+        self.count = 0
+
+    def write(self, event: Dict) -> None:
+        self.output.write(_dumps(event))
+        self.output.write("\n")
+        self.count += 1
+
+    def close(self) -> None:
+        self.output.flush()
+
+
+class HARWriter(NDJSONWriter):
+    """Writes a HAR log, entry by entry, the closing brackets on ``close``."""
+
+    def __init__(self, output: TextIO):
+        super().__init__(output)
+        creator = {"name": "fastapi_xray", "version": _package_version()}
+        self.output.write(
+            f'{{"log": {{"version": "{HAR_VERSION}", "creator": {_dumps(creator)}, '
+            '"entries": [\n'
+        )
+
+    def write(self, event: Dict) -> None:
+        if self.count:
+            self.output.write(",\n")
+        self.output.write(_dumps(to_har_entry(event)))
+        self.count += 1
+
+    def close(self) -> None:
+        self.output.write("\n]}}\n")
+        self.output.flush()
+
+
+WRITERS = {"ndjson": NDJSONWriter, "har": HARWriter}
+
+
+def writer_for(output: TextIO, format: str) -> NDJSONWriter:
+    if format not in WRITERS:
+        raise ExportError(f"Unknown format {format!r}, use one of {FORMATS}")
+    return WRITERS[format](output)
+
+
+def export_events(events: Iterable[Dict], output: TextIO, format: str) -> int:
+    """Writes the events to ``output``, returns how many were written."""
+    writer = writer_for(output, format)
+    for event in events:
+        writer.write(event)
+    writer.close()
+    return writer.count
+
+
+def recorded_events(store: CaptureStore) -> Iterator[Dict]:
+    """The events of a recording, oldest first."""
+    for codec, payload in store.events():
+        try:
+            yield codec_for(codec).decode(payload)
+        except Exception as e:
+            logger.error(f"Recorded event not exported, it could not be decoded: {e}")
+
+
+def to_har_entry(event: Dict) -> Dict:
+    request = event["request"]
+    response = event.get("response") or {}
+    elapsed = event.get("elapsed_time") or 0
+    first_byte = response.get("time_to_first_byte")
+    if first_byte is None:
+        first_byte = elapsed
+    request_headers = request.get("headers") or {}
+    response_headers = response.get("headers") or {}
+
+    url = request.get("base_url", "").rstrip("/") + request.get("path", "")
+    query = request.get("query_params") or {}
+    if query:
+        url += "?" + urlencode(query)
+
+    entry = {
+        "startedDateTime": datetime.fromtimestamp(
+            event.get("timestamp") or 0, timezone.utc
+        ).isoformat(),
+        "time": elapsed,
+        "request": {
+            "method": request.get("method"),
+            "url": url,
+            "httpVersion": "HTTP/1.1",
+            "cookies": _pairs(request.get("cookies")),
+            "headers": _pairs(request_headers),
+            "queryString": _pairs(query),
+            "headersSize": -1,
+            "bodySize": -1,
+        },
+        "response": {
+            "status": request.get("status_code"),
+            "statusText": "",
+            "httpVersion": "HTTP/1.1",
+            "cookies": [],
+            "headers": _pairs(response_headers),
+            "content": {
+                "size": response.get("size") or 0,
+                "mimeType": _header(response_headers, "content-type"),
+                **_har_text(response.get("body")),
+            },
+            "redirectURL": _header(response_headers, "location"),
+            "headersSize": -1,
+            "bodySize": response.get("size") or -1,
+        },
+        "cache": {},
+        "timings": {
+            "send": 0,
+            "wait": first_byte,
+            "receive": max(elapsed - first_byte, 0),
+        },
+        "_sql": event.get("sql") or [],
+        "_timings": event.get("timings"),
+        "_xray": {
+            "requestId": event.get("request_id"),
+            "schemaVersion": event.get("schema_version"),
+            "timestamp": event.get("timestamp"),
+            "route": event.get("route"),
+            "pathParams": request.get("path_params") or {},
+            "worker": event.get("worker"),
+            "error": response.get("error"),
+        },
+    }
+    if request.get("body") is not None:
+        entry["request"]["postData"] = {
+            "mimeType": _header(request_headers, "content-type"),
+            **_har_text(request["body"]),
+        }
+    return entry
+
+
+def _pairs(values: Optional[Dict]) -> List[Dict]:
+    return [
+        {"name": name, "value": str(value)} for name, value in (values or {}).items()
+    ]
+
+
+def _header(headers: Dict[str, str], name: str) -> str:
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return ""
+
+
+def _har_text(body: Any) -> Dict:
+    """HAR only holds text, bodies parsed by X-Ray are written as JSON."""
+    if body is None:
+        return {}
+    if isinstance(body, str):
+        return {"text": body}
+    return {"text": _dumps(body), "_parsed": True}
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"), default=str)
+
+
+def _package_version() -> str:
+    try:
+        from importlib.metadata import version
+
+        return version("fastapi_xray")
+    except Exception:
+        return "unknown"
+
+
+# Reading
+
+
+def read_events(input: TextIO, format: str) -> Iterator[Dict]:
+    """The events of an exported file, one at a time."""
+    if format == "har":
+        for number, entry in enumerate(read_har_entries(input), 1):
+            try:
+                event = from_har_entry(entry)
+            except (KeyError, TypeError, AttributeError, ValueError) as e:
+                raise ExportError(f"Entry {number} is not a HAR entry: {e!r}") from None
+            yield event
+    elif format == "ndjson":
+        for number, line in enumerate(input, 1):
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError as e:
+                raise ExportError(f"Line {number} is not JSON: {e}") from None
+            if isinstance(event, dict) and ERROR_RECORD in event:
+                logger.warning(f"Line {number} is an event that could not be decoded")
+                continue
+            yield event
+    else:
+        raise ExportError(f"Unknown format {format!r}, use one of {FORMATS}")
+
+
+def read_har_entries(
+    input: TextIO, max_entry_size: int = MAX_ENTRY_SIZE
+) -> Iterator[Dict]:
+    """The entries of a HAR log, parsed one at a time while the file is read.
+
+    Only the ``entries`` array is parsed, anything else in the log is skipped.
+    An entry larger than ``max_entry_size`` characters raises ``ExportError``.
+    """
+    buffer = ""
+    position = 0
+    # Doubled while an entry doesn't fit, so large entries aren't parsed over and over
+    read_size = READ_SIZE
+
+    def fill() -> bool:
+        nonlocal buffer, position
+        chunk = input.read(read_size)
+        buffer = buffer[position:] + chunk
+        position = 0
+        return bool(chunk)
+
+    # Finds the start of the entries, the key is assumed to be unique in the log
+    while True:
+        start = buffer.find('"entries"', position)
+        if start >= 0:
+            bracket = buffer.find("[", start)
+            if bracket >= 0:
+                position = bracket + 1
+                break
+            position = start
+        else:
+            position = max(len(buffer) - len('"entries"'), 0)
+        if not fill():
+            raise ExportError("No entries in the HAR file")
+
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position == len(buffer):
+            if not fill():
+                raise ExportError("The HAR file ends in the middle of the entries")
+            continue
+        if buffer[position] == "]":
+            return
+        try:
+            entry, end = _decoder.raw_decode(buffer, position)
+        except ValueError:
+            # The entry goes on in the next chunk
+            if len(buffer) - position > max_entry_size:
+                raise ExportError(
+                    f"A HAR entry is larger than {max_entry_size} characters"
+                )
+            read_size = min(read_size * 2, max_entry_size)
+            if not fill():
+                raise ExportError("The HAR file ends in the middle of an entry")
+            continue
+        position = end
+        read_size = READ_SIZE
+        yield entry
+
+
+def from_har_entry(entry: Dict) -> Dict:
+    """Rebuilds an event from a HAR entry, ours or one of another tool.
+
+    Entries of other tools have no schema version, so their events are
+    validated when they are built.
+    """
+    har_request = entry["request"]
+    har_response = entry.get("response") or {}
+    xray = entry.get("_xray") or {}
+    content = har_response.get("content") or {}
+    url = urlsplit(har_request.get("url", ""))
+    timings = entry.get("timings") or {}
+    elapsed = entry.get("time") or 0
+
+    timestamp = xray.get("timestamp")
+    if timestamp is None and entry.get("startedDateTime"):
+        try:
+            timestamp = datetime.fromisoformat(
+                entry["startedDateTime"].replace("Z", "+00:00")
+            ).timestamp()
+        except ValueError:
+            timestamp = None
+
+    response = {
+        "headers": _from_pairs(har_response.get("headers")),
+        "body": _from_har_text(content),
+        "size": content.get("size"),
+        "time_to_first_byte": timings.get("wait"),
+    }
+    if xray.get("error") is not None:
+        response["error"] = xray["error"]
+
+    return {
+        "schema_version": xray.get("schemaVersion"),
+        "request_id": xray.get("requestId") or str(uuid.uuid4()),
+        "timestamp": timestamp,
+        "route": xray.get("route"),
+        "request": {
+            "base_url": f"{url.scheme}://{url.netloc}/" if url.netloc else "/",
+            "query_params": _from_pairs(har_request.get("queryString"))
+            or dict(parse_qsl(url.query)),
+            "path_params": xray.get("pathParams") or {},
+            "path": url.path or "/",
+            "status_code": har_response.get("status") or 0,
+            "method": har_request.get("method") or "GET",
+            "cookies": _from_pairs(har_request.get("cookies")),
+            "headers": _from_pairs(har_request.get("headers")),
+            "body": _from_har_text(har_request.get("postData") or {}),
+        },
+        "response": response,
+        "sql": entry.get("_sql") or [],
+        "elapsed_time": elapsed,
+        "worker": xray.get("worker"),
+        "timings": entry.get("_timings"),
+    }
+
+
+def _from_pairs(pairs: Optional[List[Dict]]) -> Dict[str, str]:
+    return {pair["name"]: pair.get("value", "") for pair in pairs or []}
+
+
+def _from_har_text(content: Dict) -> Any:
+    text = content.get("text")
+    if text is not None and content.get("_parsed"):
+        return json.loads(text)
+    return text
+
+
+def export_file(source: str, output: TextIO, format: str) -> int:
+    """Exports a recording directory, or converts an exported file, to ``output``."""
+    if os.path.isdir(source):
+        store = CaptureStore(source, readonly=True)
+        try:
+            return export_events(recorded_events(store), output, format)
+        finally:
+            store.close()
+
+    with open(source, encoding="utf-8") as input:
+        return export_events(read_events(input, guess_format(source)), output, format)
+
+
+def import_file(path: str, directory: str) -> int:
+    """Records the events of an exported file in ``directory``, to be browsed."""
+    store = CaptureStore(directory)
+    try:
+        with open(path, encoding="utf-8") as input:
+            return import_events(read_events(input, guess_format(path)), store)
+    finally:
+        store.close()
+
+
+def import_events(events: Iterable[Dict], store: CaptureStore) -> int:
+    """Records the events to ``store``, returns how many were recorded.
+
+    The events are validated whatever schema version they claim, a file may
+    have been edited or written by another tool. They are recorded as
+    validated and tagged with the current version, so the UI trusts them.
+    """
+    from fastapi_xray.schemas import SCHEMA_VERSION, APIRequest
+
+    codec = get_codec("json")
+    count = 0
+    for number, event in enumerate(events, 1):
+        try:
+            event = APIRequest.parse_obj(event).dict()
+        except (TypeError, ValueError) as e:
+            raise ExportError(f"Event {number} is not valid: {e}") from None
+        event["schema_version"] = SCHEMA_VERSION
+        received_at = event.get("timestamp") or 0.0
+        if store.append(received_at, JSON, codec.encode(event), event):
+            count += 1
+            if count % IMPORT_FLUSH == 0:
+                store.flush()
+    store.flush()
+    return count
@@ -0,0 +1,251 @@
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from fastapi_xray.capture import BodyCapture, ResponseCapture
+from fastapi_xray.commons.logger import get_logger
+from fastapi_xray.sampling import SamplingPolicy
+from fastapi_xray.schemas import SCHEMA_VERSION
+
+logger = get_logger()
+
+# SQL queries captured for the request being handled in the current context.
+# Tasks and thread pool workers started by the request inherit the same list,
+# anything running outside of a request sees None and is not captured.
+request_queries: ContextVar[Optional[List[Dict]]] = ContextVar(
+    "xray_request_queries", default=None
+)
+# Nanoseconds spent in each phase of the request being handled, see ``PHASES``
+request_timings: ContextVar[Optional[Dict[str, int]]] = ContextVar(
+    "xray_request_timings", default=None
+)
+
+# Phases of a request timed by X-Ray, in nanoseconds, sent along with ``sql_count``.
+# Only ``handler`` and ``sql`` are the app's own time, the others are the overhead
+# of X-Ray on the request.
+PHASES = (
+    "setup",  # wrapping the request and deciding whether it is sampled
+    "body",  # copying the request body
+    "handler",  # the app, without the time X-Ray spent inside of it
+    "sql",  # the SQL queries, included in handler
+    "sql_capture",  # capturing the SQL queries
+    "response",  # copying the response
+    "build",  # building the event, parsing the bodies
+)
+# Connection pool figures of the request, recorded by ``pool.PoolMonitor``
+POOL_TIMINGS = (
+    "pool_wait",
+    "pool_hold",
+    "pool_checkouts",
+    "pool_connects",
+    "pool_held",
+    "pool_peak",
+)
+
+
+class XRayMiddleware:
+    """Captures the requests handled by the app, as a plain ASGI middleware.
+
+    The request and response are observed by wrapping the ASGI ``receive`` and
+    ``send`` callables, the app's own exception handlers are left untouched.
+    The event is built and handed over to ``on_event`` once the app returns,
+    which is after the response was sent and its background tasks ran.
+
+    Args:
+        app (ASGIApp): The wrapped application.
+        on_event (Callable[[Dict], None]): Receives the captured events, must not block.
+        sampling (SamplingPolicy, optional): Decides which requests are captured. Defaults to None.
+        max_body_size (int, optional): Max number of request body bytes kept. Defaults to 64 KiB.
+        max_response_body_size (int, optional): Max number of response body bytes kept.
+            Defaults to 64 KiB.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        on_event: Callable[[Dict], None],
+        sampling: Optional[SamplingPolicy] = None,
+        max_body_size: int = 64 * 1024,
+        max_response_body_size: int = 64 * 1024,
+    ):
+        self.app = app
+        self.on_event = on_event
+        self.sampling = sampling
+        self.max_body_size = max_body_size
+        self.max_response_body_size = max_response_body_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        entered = time.perf_counter_ns()
+        timings = dict.fromkeys(PHASES + POOL_TIMINGS, 0)
+        request = Request(scope)
+        sampled = self.sampling is None or self.sampling.sample(request)
+
+        body_capture = None
+        if sampled:
+            # The body is copied as the app reads it and only parsed once shipped
+            body_capture = BodyCapture(
+                receive, request.headers.get("content-type"), self.max_body_size
+            )
+            receive = body_capture
+
+        # Unsampled requests don't get a buffer so their queries are not even formatted
+        queries = [] if sampled else None
+        response: Dict[str, Any] = {
+            "capture": None,
+            "status": None,
+            "headers": None,
+            # Of the responses which are not captured, in case they turn slow
+            "size": 0,
+            "finished_at": None,
+        }
+        start_time = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            started = time.perf_counter_ns()
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = Headers(raw=message.get("headers", []))
+                response["started_at"] = time.perf_counter()
+                elapsed_time = (response["started_at"] - start_time) * 1000
+                if self.keep(request, message["status"], elapsed_time, sampled):
+                    # The response body is copied as it is sent, within the size cap
+                    capture = ResponseCapture(self.max_response_body_size)
+                    capture.start(response["headers"])
+                    response["capture"] = capture
+            elif message["type"] == "http.response.body":
+                capture = response["capture"]
+                if capture is not None:
+                    capture.feed(message.get("body", b""))
+                    if not message.get("more_body", False):
+                        capture.finished_at = time.perf_counter()
+                else:
+                    response["size"] += len(message.get("body", b""))
+                    if not message.get("more_body", False):
+                        response["finished_at"] = time.perf_counter()
+            timings["response"] += time.perf_counter_ns() - started
+            await send(message)
+
+        token = request_queries.set(queries)
+        timings_token = request_timings.set(timings)
+        error = None
+        app_started = time.perf_counter_ns()
+        timings["setup"] = app_started - entered
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            request_queries.reset(token)
+            request_timings.reset(timings_token)
+            end_time = time.perf_counter()
+            if body_capture is not None:
+                timings["body"] = body_capture.elapsed_ns
+            timings["handler"] = (
+                time.perf_counter_ns()
+                - app_started
+                - timings["body"]
+                - timings["response"]
+                - timings["sql_capture"]
+            )
+
+            if response["status"] is None and error is not None:
+                # The error is turned into a response by the server error middleware
+                elapsed_time = (end_time - start_time) * 1000
+                if self.keep(request, 500, elapsed_time, sampled):
+                    response["status"] = 500
+                    response["started_at"] = end_time
+                    response["capture"] = ResponseCapture(0)
+            elif response["capture"] is None and response["status"] is not None:
+                # Only the time to the first byte was known when the response
+                # started, the request may have turned slow while it was sent
+                finished_at = response["finished_at"] or end_time
+                elapsed_time = (finished_at - start_time) * 1000
+                if self.keep(request, response["status"], elapsed_time, sampled):
+                    capture = ResponseCapture(0)
+                    capture.start(response["headers"])
+                    capture.size = response["size"]
+                    capture.finished_at = finished_at
+                    response["capture"] = capture
+
+            if response["capture"] is not None:
+                try:
+                    build_started = time.perf_counter_ns()
+                    event = self.build_event(
+                        request, body_capture, queries, response, error, start_time
+                    )
+                    timings["sql"] = int(
+                        sum(query["execution_time"] for query in queries or ()) * 1e6
+                    )
+                    timings["sql_count"] = len(queries or ())
+                    timings["build"] = time.perf_counter_ns() - build_started
+                    event["timings"] = timings
+                    self.on_event(event)
+                except Exception as e:
+                    logger.error(f"Exception: {e}")
+
+    def keep(
+        self, request: Request, status_code: int, elapsed_time: float, sampled: bool
+    ) -> bool:
+        if self.sampling is None:
+            return True
+        return self.sampling.keep(request, status_code, elapsed_time, sampled)
+
+    def build_event(
+        self,
+        request: Request,
+        body_capture: Optional[BodyCapture],
+        queries: Optional[List[Dict]],
+        response: Dict[str, Any],
+        error: Optional[Exception],
+        start_time: float,
+    ) -> Dict:
+        capture: ResponseCapture = response["capture"]
+        finished_at = capture.finished_at or response["started_at"]
+        headers = response["headers"]
+
+        request_body = {
+            "base_url": str(request.base_url),
+            "query_params": dict(request.query_params),
+            "path_params": dict(request.path_params),
+            "path": str(request.url.path),
+            "status_code": response["status"],
+            "method": request.method,
+            "cookies": dict(request.cookies),
+            "headers": dict(request.headers),
+            "body": body_capture.body if body_capture is not None else None,
+        }
+
+        response_body = {
+            "headers": dict(headers) if headers is not None else {},
+            "body": capture.body,
+            "size": capture.size,
+            "time_to_first_byte": round(
+                (response["started_at"] - start_time) * 1000, 4
+            ),
+        }
+        if error is not None:
+            response_body["error"] = {"message": f"{type(error).__name__}: {error}"}
+
+        return {
+            "schema_version": SCHEMA_VERSION,
+            "request_id": str(uuid.uuid4()),
+            # Wall clock time the request started at, to merge the workers' streams
+            "timestamp": time.time() - (time.perf_counter() - start_time),
+            # Template of the matched route, e.g. /items/{item_id}, set by the router
+            "route": getattr(request.scope.get("route"), "path", None),
+            "request": request_body,
+            "response": response_body,
+            # Copy, the events are serialized later on by the shipper thread
+            "sql": list(queries or []),
+            "elapsed_time": round((finished_at - start_time) * 1000, 4),
+        }
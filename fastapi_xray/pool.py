@@ -0,0 +1,161 @@
+"""Instrumentation of the SQLAlchemy connection pool.
+
+Pool exhaustion shows up as requests waiting for a connection rather than
+running queries. For each captured request the monitor records, in its
+timings:
+
+- ``pool_wait``: nanoseconds spent acquiring connections from the pool,
+  including opening new ones,
+- ``pool_hold``: nanoseconds the connections were checked out,
+- ``pool_checkouts`` and ``pool_connects``: connections checked out, and the
+  ones of them the pool had to open,
+- ``pool_held`` and ``pool_peak``: connections still checked out when the
+  request was built, and the most checked out at once.
+
+SQLAlchemy has no event before a checkout, so the wait is timed by wrapping
+the ``connect`` method of the pool. Every snapshot checks the wrapper is still
+in place, something else may replace the method, and logs when it is not. The
+state of the pool is sent by the worker along with its events, and on its
+own every second without them, see ``snapshot``.
+"""
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi_xray.commons.logger import get_logger
+from fastapi_xray.middleware import request_timings
+
+logger = get_logger()
+
+# Key of the connection record info holding the checkout time and its request
+CHECKOUT = "xray_checkout"
+# Attribute marking the ``connect`` wrappers of the monitor
+TIMED = "_xray_timed"
+
+
+def sync_engine(engine: Any) -> Any:
+    """The engine events are listened on, the sync engine of an ``AsyncEngine``."""
+    return getattr(engine, "sync_engine", engine)
+
+
+class PoolMonitor:
+    """Times the connections of the requests and tracks the state of the pool."""
+
+    def __init__(self, engine: Any):
+        self.engine = sync_engine(engine)
+        self.checked_out = 0
+        self.waiting = 0
+        self._lock = threading.Lock()
+        # Whether the pool still acquires its connections through the wrapper
+        self._timed = True
+
+    def install(self) -> "PoolMonitor":
+        from sqlalchemy import event
+
+        # Listeners of the engine carry over to the pools it recreates
+        event.listen(self.engine, "connect", self.on_connect)
+        event.listen(self.engine, "checkout", self.on_checkout)
+        event.listen(self.engine, "checkin", self.on_checkin)
+        event.listen(self.engine, "engine_disposed", self.on_disposed)
+        self.wrap(self.engine.pool)
+        return self
+
+    def wrap(self, pool: Any) -> None:
+        """Times the ``connect`` calls of ``pool``, the engine acquires connections with it."""
+        connect = pool.connect
+        if getattr(connect, TIMED, False):
+            return
+
+        def timed_connect():
+            started = time.perf_counter_ns()
+            with self._lock:
+                self.waiting += 1
+            try:
+                return connect()
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+                timings = request_timings.get()
+                if timings is not None:
+                    timings["pool_wait"] += time.perf_counter_ns() - started
+
+        setattr(timed_connect, TIMED, True)
+        pool.connect = timed_connect
+        self._timed = True
+
+    def on_disposed(self, engine: Any) -> None:
+        # The engine replaced its pool, the connections of the old one are
+        # still checked in as they are released.
+        self.wrap(engine.pool)
+
+    def on_connect(self, dbapi_connection: Any, connection_record: Any) -> None:
+        timings = request_timings.get()
+        if timings is not None:
+            timings["pool_connects"] += 1
+
+    def on_checkout(
+        self, dbapi_connection: Any, connection_record: Any, connection_proxy: Any
+    ) -> None:
+        timings = request_timings.get()
+        connection_record.info[CHECKOUT] = (time.perf_counter_ns(), timings)
+        with self._lock:
+            self.checked_out += 1
+        if timings is not None:
+            timings["pool_checkouts"] += 1
+            timings["pool_held"] += 1
+            timings["pool_peak"] = max(timings["pool_peak"], timings["pool_held"])
+
+    def on_checkin(self, dbapi_connection: Any, connection_record: Any) -> None:
+        checkout = connection_record.info.pop(CHECKOUT, None)
+        if checkout is None:
+            # Checked out before the monitor was installed
+            return
+        with self._lock:
+            self.checked_out -= 1
+        started, timings = checkout
+        # Only while the request that checked it out is running, its event is
+        # shipped once it is done.
+        if timings is not None and request_timings.get() is timings:
+            timings["pool_hold"] += time.perf_counter_ns() - started
+            timings["pool_held"] -= 1
+
+    def snapshot(self) -> Dict[str, Optional[int]]:
+        """The size of the pool, the connections in use and the callers waiting for one.
+
+        ``size`` is None for pools without one, ``max_overflow`` is -1 when the
+        overflow is not limited. ``timed`` is False when the waits are not timed.
+        """
+        pool = self.engine.pool
+        size = getattr(pool, "size", None)
+        return {
+            "size": size() if callable(size) else None,
+            "max_overflow": getattr(pool, "_max_overflow", None),
+            "checked_out": self.checked_out,
+            "waiting": self.waiting,
+            "timed": self.check(),
+        }
+
+    def check(self) -> bool:
+        """Whether the waits are still timed, logs when the wrapper went missing."""
+        timed = getattr(self.engine.pool.connect, TIMED, False)
+        if self._timed and not timed:
+            logger.error(
+                "The connect method of the connection pool was replaced, "
+                "the waits for a connection are no longer timed"
+            )
+        self._timed = timed
+        return timed
+
+
+def capacity(snapshot: Dict[str, Optional[int]]) -> Optional[int]:
+    """Max connections of the pool of a ``snapshot``, None when it is not limited."""
+    size, max_overflow = snapshot.get("size"), snapshot.get("max_overflow")
+    if size is None or max_overflow is None or max_overflow < 0:
+        return None
+    return size + max_overflow
+
+
+def pressure(snapshot: Dict[str, Optional[int]]) -> Tuple[int, float]:
+    """Sorts the pools closest to exhaustion last: callers waiting, then the share in use."""
+    limit = capacity(snapshot)
+    return snapshot["waiting"], snapshot["checked_out"] / limit if limit else 0.0
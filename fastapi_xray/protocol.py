@@ -0,0 +1,198 @@
+"""Wire protocol between the X-Ray agent and the receiver.
+
+A framed connection starts with the ``PREAMBLE`` and is followed by any number
+of frames. Each frame is a fixed size header followed by its payload::
+
+    +----------------+-------------+----------+-----------+------------------+
+    | length: uint32 | version: u8 | type: u8 | codec: u8 | payload (length) |
+    +----------------+-------------+----------+-----------+------------------+
+
+An ``EVENT`` frame carries a single encoded event. A ``BATCH`` frame carries a
+uint32 event count followed by that many ``uint32 length + event`` records.
+A ``TAGGED`` frame is a batch preceded by a ``uint32 length + tag`` record, the
+tag describes the worker which sent the batch (see ``server.workers``), so the
+receiver learns about the worker without decoding the events. Its batch may
+be empty, the frame then only carries the state of the worker.
+The events and tags are encoded with the codec identified by ``codec`` (see
+``codec``). Version 1 frames have no codec byte, their events are JSON.
+
+Connections that don't start with the preamble are treated as legacy clients
+which send JSON documents separated by newlines, or a single document
+terminated by closing the connection.
+"""
+import struct
+from typing import List, NamedTuple, Optional, Sequence
+
+from fastapi_xray.codec import JSON
+
+PREAMBLE = b"XRAY"
+VERSION = 2
+
+EVENT = 1
+BATCH = 2
+TAGGED = 3
+
+HEADER = struct.Struct("!IBBB")
+HEADER_V1 = struct.Struct("!IBB")
+LENGTH = struct.Struct("!I")
+
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class Batch(NamedTuple):
+    """Events received in one frame, with the tag of their worker if it was sent."""
+
+    codec: int
+    events: List[bytes]
+    tag: Optional[bytes] = None
+
+
+def encode_event(event: bytes, codec: int = JSON) -> bytes:
+    return HEADER.pack(len(event), VERSION, EVENT, codec) + event
+
+
+def encode_batch(
+    events: Sequence[bytes], codec: int = JSON, tag: Optional[bytes] = None
+) -> bytes:
+    """Frames the encoded events, in a ``TAGGED`` frame when ``tag`` is given."""
+    if tag is None and len(events) == 1:
+        return encode_event(events[0], codec)
+
+    parts = [] if tag is None else [LENGTH.pack(len(tag)), tag]
+    parts.append(LENGTH.pack(len(events)))
+    for event in events:
+        parts.append(LENGTH.pack(len(event)))
+        parts.append(event)
+    payload = b"".join(parts)
+    kind = BATCH if tag is None else TAGGED
+    return HEADER.pack(len(payload), VERSION, kind, codec) + payload
+
+
+def decode_tagged(payload: bytes, codec: int = JSON) -> Batch:
+    """Splits the payload of a ``TAGGED`` frame into its tag and events."""
+    view = memoryview(payload)
+    if len(view) < LENGTH.size:
+        raise ProtocolError("Truncated tagged frame")
+    (size,) = LENGTH.unpack_from(view, 0)
+    start = LENGTH.size
+    end = start + size
+    if end > len(view):
+        raise ProtocolError("Truncated tagged frame")
+    return Batch(codec, decode_batch(payload, end), bytes(view[start:end]))
+
+
+def decode_batch(payload: bytes, offset: int = 0) -> List[bytes]:
+    view = memoryview(payload)
+    if len(view) < offset + LENGTH.size:
+        raise ProtocolError("Truncated batch frame")
+
+    (count,) = LENGTH.unpack_from(view, offset)
+    offset += LENGTH.size
+    events = []
+    for _ in range(count):
+        if offset + LENGTH.size > len(view):
+            raise ProtocolError("Truncated batch frame")
+        (size,) = LENGTH.unpack_from(view, offset)
+        offset += LENGTH.size
+        end = offset + size
+        if end > len(view):
+            raise ProtocolError("Truncated batch frame")
+        events.append(bytes(view[offset:end]))
+        offset = end
+    return events
+
+
+class FrameDecoder:
+    """Incremental decoder for one connection.
+
+    Feed it the raw bytes as they are received, it returns the complete frames
+    found so far, as ``Batch`` tuples, and keeps any partial frame in its buffer
+    for the next call.
+    """
+
+    def __init__(self):
+        self.framed = None
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[Batch]:
+        # Anything buffered before is known to be free of newlines
+        scanned = len(self._buffer) if self.framed is False else 0
+        self._buffer += data
+
+        if self.framed is None:
+            if not self._detect():
+                return []
+
+        if self.framed:
+            return self._decode_frames()
+        return self._decode_lines(scanned)
+
+    def close(self) -> List[Batch]:
+        """Returns what is left once the peer has closed the connection."""
+        buffer, self._buffer = bytes(self._buffer), bytearray()
+        if not buffer.strip():
+            return []
+        if self.framed:
+            raise ProtocolError(f"Connection closed with {len(buffer)} pending bytes")
+        # A legacy one-shot client, the whole document is terminated by close
+        return [Batch(JSON, [buffer])]
+
+    def _detect(self) -> bool:
+        prefix = bytes(self._buffer[: len(PREAMBLE)])
+        if not PREAMBLE.startswith(prefix):
+            self.framed = False
+        elif len(prefix) == len(PREAMBLE):
+            self.framed = True
+            del self._buffer[: len(PREAMBLE)]
+        return self.framed is not None
+
+    def _decode_frames(self) -> List[Batch]:
+        batches = []
+        buffer = self._buffer
+        offset = 0
+        while len(buffer) - offset >= HEADER_V1.size:
+            size, version, kind = HEADER_V1.unpack_from(buffer, offset)
+            if version == 1:
+                header_size, codec = HEADER_V1.size, JSON
+            elif version == VERSION:
+                if len(buffer) - offset < HEADER.size:
+                    break
+                header_size, codec = HEADER.size, buffer[offset + HEADER_V1.size]
+            else:
+                raise ProtocolError(f"Unsupported protocol version {version}")
+            if size > MAX_FRAME_SIZE:
+                raise ProtocolError(f"Frame of {size} bytes exceeds the limit")
+
+            end = offset + header_size + size
+            if len(buffer) < end:
+                break
+
+            start = offset + header_size
+            payload = bytes(buffer[start:end])
+            if kind == EVENT:
+                batches.append(Batch(codec, [payload]))
+            elif kind == BATCH:
+                batches.append(Batch(codec, decode_batch(payload)))
+            elif kind == TAGGED:
+                batches.append(decode_tagged(payload, codec))
+            else:
+                raise ProtocolError(f"Unknown message type {kind}")
+            offset = end
+
+        # Compact once per call instead of once per frame
+        del buffer[:offset]
+        return batches
+
+    def _decode_lines(self, start: int) -> List[Batch]:
+        end = self._buffer.rfind(b"\n", start)
+        if end == -1:
+            return []
+
+        lines = bytes(self._buffer[:end]).split(b"\n")
+        del self._buffer[: end + 1]
+        events = [line for line in lines if line.strip()]
+        return [Batch(JSON, events)] if events else []
@@ -0,0 +1,168 @@
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from fastapi import FastAPI, Request
+from starlette.routing import Match
+
+
+class TokenBucket:
+    """Allows at most ``rate`` events per second, with bursts up to ``burst``."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self) -> bool:
+        with self._lock:
+            self._refill()
+            return self.tokens >= 1
+
+    def take(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RouteResolver:
+    """Finds the route template (e.g. ``/items/{item_id}``) a request will hit.
+
+    Routing happens after the middleware, so the app routes are matched here,
+    with the results of the recent paths cached.
+    """
+
+    def __init__(self, app: FastAPI, cache_size: int = 4096):
+        self.app = app
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[tuple, Optional[str]]" = OrderedDict()
+
+    def resolve(self, request: Request) -> Optional[str]:
+        key = (request.method, request.url.path)
+        try:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        except KeyError:
+            pass
+
+        template = None
+        for route in self.app.router.routes:
+            match, _ = route.matches(request.scope)
+            if match == Match.FULL:
+                template = getattr(route, "path", None)
+                break
+
+        self._cache[key] = template
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return template
+
+
+class SamplingPolicy(ABC):
+    """Decides which requests are captured and shipped to the UI.
+
+    ``sample`` is called before the request is handled. Requests it rejects
+    skip body extraction and SQL capture entirely. ``keep`` is called once the
+    response has started, with the time to its first byte, and makes the final
+    decision to ship the event, it can still keep a request that was not
+    sampled, e.g. because it failed. When it doesn't, it is called again once
+    the response is sent, with the time of the whole request, as a streamed
+    response may only turn slow then.
+    """
+
+    def bind(self, app: FastAPI) -> None:  # noqa :B027
+        """Called by ``start_xray`` with the app the policy is used for."""
+
+    @abstractmethod
+    def sample(self, request: Request) -> bool:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def keep(
+        self, request: Request, status_code: int, elapsed_time: float, sampled: bool
+    ) -> bool:
+        raise NotImplementedError()
+
+
+class Sampler(SamplingPolicy):
+    """The built-in sampling policy.
+
+    Args:
+        rate (float, optional): Fraction of the requests captured. Defaults to 1.0.
+        route_rates (Dict[str, float], optional): Per route template rates which
+            override ``rate``, e.g. ``{"/health": 0.0, "/items/{item_id}": 0.1}``.
+        capture_errors (bool, optional): Always ship requests that end with a
+            status >= 400. Defaults to True.
+        slow_threshold (float, optional): Always ship requests slower than this,
+            in milliseconds. Defaults to None.
+        max_events_per_second (float, optional): Caps the number of shipped events
+            with a token bucket. Failed and slow requests don't count against it.
+            Defaults to None.
+        max_exempt_per_second (float, optional): Caps the number of failed and slow
+            requests shipped regardless of the sampling, with their own token
+            bucket. Defaults to None.
+
+    Requests that are only kept because they failed or were slow are shipped
+    without their body and SQL queries, as those were not captured. Requests
+    only found slow once their response is sent are shipped without its body.
+    """
+
+    def __init__(
+        self,
+        rate: float = 1.0,
+        route_rates: Optional[Dict[str, float]] = None,
+        capture_errors: bool = True,
+        slow_threshold: Optional[float] = None,
+        max_events_per_second: Optional[float] = None,
+        max_exempt_per_second: Optional[float] = None,
+    ):
+        self.rate = rate
+        self.route_rates = route_rates or {}
+        self.capture_errors = capture_errors
+        self.slow_threshold = slow_threshold
+        self.bucket = (
+            TokenBucket(max_events_per_second) if max_events_per_second else None
+        )
+        self.exempt_bucket = (
+            TokenBucket(max_exempt_per_second) if max_exempt_per_second else None
+        )
+        self.resolver: Optional[RouteResolver] = None
+
+    def bind(self, app: FastAPI) -> None:
+        if self.route_rates:
+            self.resolver = RouteResolver(app)
+
+    def sample(self, request: Request) -> bool:
+        if self.bucket is not None and not self.bucket.available():
+            return False
+
+        rate = self.rate
+        if self.resolver is not None:
+            rate = self.route_rates.get(self.resolver.resolve(request), rate)
+
+        return rate >= 1 or random.random() < rate
+
+    def keep(
+        self, request: Request, status_code: int, elapsed_time: float, sampled: bool
+    ) -> bool:
+        exempt = (self.capture_errors and status_code >= 400) or (
+            self.slow_threshold is not None and elapsed_time >= self.slow_threshold
+        )
+        if exempt:
+            return self.exempt_bucket is None or self.exempt_bucket.take()
+        if sampled and self.bucket is not None:
+            return self.bucket.take()
+        return sampled
@@ -3,6 +3,12 @@ from typing import Any, Dict, List, Optional, Union
 
 from pydantic import BaseModel
 
+from fastapi_xray.sql import render_statement
+
+# Version of the event layout sent by the agent, bumped whenever it changes.
+# Events tagged with the current version are built without validation.
+SCHEMA_VERSION = 6
+
 
 class Request(BaseModel):
     base_url: str
@@ -17,7 +23,7 @@ class Request(BaseModel):
 
 
 class ResponseError(BaseModel):
-    message: Union[str, List[Dict[str, Any]]]
+    message: Union[str, List[Dict[str, Any]], Dict[str, Any]]
 
     @property
     def lexer_type(self):
@@ -34,12 +40,72 @@ class ResponseError(BaseModel):
 
 class Response(BaseModel):
     headers: Dict[str, str]
+    body: Optional[Any] = None
+    size: Optional[int] = None
+    time_to_first_byte: Optional[float] = None
+    # Sent by older agents, which only captured the body of failed requests
     error: Optional[ResponseError] = None
 
 
 class SQlQuery(BaseModel):
     statement: str
-    execution_time: str
+    execution_time: float
+    fingerprint: Optional[str] = None
+    parameters: Optional[Any] = None
+    row_count: Optional[int] = None
+    executemany: bool = False
+    paramstyle: Optional[str] = None
+    dialect: Optional[str] = None
+
+    @property
+    def rendered_statement(self) -> str:
+        """The statement with its parameters interpolated."""
+        parameters = self.parameters
+        if self.executemany and parameters:
+            parameters = parameters[0]
+        return render_statement(
+            self.statement, parameters, self.paramstyle, self.dialect
+        )
+
+
+class Worker(BaseModel):
+    """The agent process which captured the request."""
+
+    id: str
+    host: Optional[str] = None
+    pid: Optional[int] = None
+    seq: Optional[int] = None
+    # Only sent by older agents, the batches are tagged with it now
+    sent_at: Optional[float] = None
+    # Mean nanoseconds per event the worker spent queuing, encoding and sending
+    overhead: Optional[Dict[str, int]] = None
+
+
+class Timings(BaseModel):
+    """Nanoseconds spent in each phase of the request, see ``middleware.PHASES``.
+
+    The ``pool_`` fields are about the connection pool, see ``pool``.
+    """
+
+    setup: int = 0
+    body: int = 0
+    handler: int = 0
+    sql: int = 0
+    sql_count: int = 0
+    sql_capture: int = 0
+    response: int = 0
+    build: int = 0
+    pool_wait: int = 0
+    pool_hold: int = 0
+    pool_checkouts: int = 0
+    pool_connects: int = 0
+    pool_held: int = 0
+    pool_peak: int = 0
+
+    @property
+    def overhead(self) -> int:
+        """Nanoseconds X-Ray spent on the request path."""
+        return self.setup + self.body + self.sql_capture + self.response + self.build
 
 
 class APIRequest(BaseModel):
@@ -49,4 +115,39 @@ class APIRequest(BaseModel):
     request: Request
     response: Response
     sql: List[SQlQuery]
-    elapsed_time: str
+    elapsed_time: float
+    route: Optional[str] = None
+    schema_version: Optional[int] = None
+    timestamp: Optional[float] = None
+    worker: Optional[Worker] = None
+    timings: Optional[Timings] = None
+
+    @classmethod
+    def from_event(cls, event: Dict[str, Any]) -> "APIRequest":
+        """Builds the request from a decoded event.
+
+        Events tagged with the current ``SCHEMA_VERSION`` come from an agent of
+        the same version, they are trusted and built without validation. Others
+        are fully validated.
+        """
+        if event.get("schema_version") != SCHEMA_VERSION:
+            return cls(**event)
+
+        response = dict(event["response"])
+        if response.get("error") is not None:
+            response["error"] = ResponseError.construct(**response["error"])
+
+        worker = event.get("worker")
+        timings = event.get("timings")
+        return cls.construct(
+            request_id=event["request_id"],
+            request=Request.construct(**event["request"]),
+            response=Response.construct(**response),
+            sql=[SQlQuery.construct(**query) for query in event["sql"]],
+            elapsed_time=event["elapsed_time"],
+            route=event.get("route"),
+            schema_version=SCHEMA_VERSION,
+            timestamp=event.get("timestamp"),
+            worker=Worker.construct(**worker) if worker else None,
+            timings=Timings.construct(**timings) if timings else None,
+        )
@@ -1,16 +1,82 @@
+import signal
+import sys
 from multiprocessing import Queue
+from typing import Dict, Optional
 
 from fastapi_xray.commons.logger import get_logger
+from fastapi_xray.server.headless import SUMMARY_INTERVAL, HeadlessReceiver
 from fastapi_xray.server.receiver import Receiver
+from fastapi_xray.server.workers import REORDER_WINDOW
+from fastapi_xray.storage import CaptureStore
 
 logger = get_logger()
 
 
-def start_server(shared_queue: Queue, host: str, port: int):
-    rec = Receiver(host, port, shared_queue)
+def start_server(
+    shared_queue: Queue,
+    host: str,
+    port: int,
+    store_options: Optional[Dict] = None,
+    address: Optional[str] = None,
+    reorder_window: float = REORDER_WINDOW,
+):
+    # The store is opened here, in the server process, which is the only writer
+    store = CaptureStore(**store_options) if store_options else None
+    rec = Receiver(
+        host,
+        port,
+        shared_queue,
+        store=store,
+        address=address,
+        reorder_window=reorder_window,
+    )
+    # The UI terminates the server on exit, stop cleanly so the store is flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: rec.stop())
     try:
         logger.info("server started")
         rec.start()
     except Exception as e:
         rec.stop()
         logger.error(f"Server crashed: {e}")
+
+
+def start_headless(
+    host: str,
+    port: int,
+    output: Optional[str] = "-",
+    store_options: Optional[Dict] = None,
+    address: Optional[str] = None,
+    reorder_window: float = REORDER_WINDOW,
+    summary_interval: float = SUMMARY_INTERVAL,
+):
+    """Runs the server alone in this process, writing the events to ``output``.
+
+    ``output`` is the path of an NDJSON file the events are appended to, ``-``
+    for stdout, or None to only record them to the store.
+    """
+    store = CaptureStore(**store_options) if store_options else None
+    if output == "-":
+        stream = sys.stdout.buffer
+    elif output is not None:
+        stream = open(output, "ab")
+    else:
+        stream = None
+
+    rec = HeadlessReceiver(
+        host,
+        port,
+        stream,
+        store=store,
+        address=address,
+        reorder_window=reorder_window,
+        summary_interval=summary_interval,
+    )
+    signal.signal(signal.SIGTERM, lambda signum, frame: rec.stop())
+    try:
+        logger.info("headless server started")
+        rec.start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if stream is not None and stream is not sys.stdout.buffer:
+            stream.close()
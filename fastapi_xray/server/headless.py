@@ -0,0 +1,189 @@
+"""Runs the receiver without the UI, e.g. on a server box over SSH.
+
+The events are written as NDJSON, one event per line, and a summary line of
+the traffic is printed every few seconds. An event which can't be decoded is
+written as an error record holding its payload, see ``error_record``.
+"""
+import asyncio
+import base64
+import json
+import sys
+import time
+from typing import BinaryIO, Dict, List, Optional, TextIO
+
+from fastapi_xray.codec import JSON, codec_for
+from fastapi_xray.commons.logger import get_logger
+from fastapi_xray.export import ERROR_RECORD
+from fastapi_xray.server.receiver import Receiver
+from fastapi_xray.server.workers import REORDER_WINDOW
+from fastapi_xray.stats import Histogram
+from fastapi_xray.storage import CaptureStore
+
+logger = get_logger()
+
+# Seconds between two summary lines
+SUMMARY_INTERVAL = 10.0
+
+
+class Summary:
+    """Traffic since the last summary line: events, latency and errors."""
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.started = time.monotonic()
+        self.events = 0
+        self.errors = 0
+        self.lost = 0
+        self.undecodable = 0
+        # Events lost by the workers since the receiver started
+        self._lost_total = 0
+
+    def record(self, event: Dict) -> None:
+        self.events += 1
+        elapsed = event.get("elapsed_time")
+        if isinstance(elapsed, (int, float)):
+            self.latency.record(elapsed)
+        status = (event.get("request") or {}).get("status_code")
+        if isinstance(status, int) and status >= 500:
+            self.errors += 1
+
+    def update_lost(self, workers: List[Dict]) -> None:
+        total = sum(worker["lost"] for worker in workers)
+        self.lost += total - self._lost_total
+        self._lost_total = total
+
+    def line(self) -> str:
+        duration = max(time.monotonic() - self.started, 1e-9)
+        p50, p99 = self.latency.percentiles(50, 99)
+        return (
+            f"{time.strftime('%Y-%m-%d %H:%M:%S')} events {self.events} "
+            f"({self.events / duration:.1f}/s) p50 {p50:.1f} ms p99 {p99:.1f} ms "
+            f"errors {self.errors} lost {self.lost} undecodable {self.undecodable}"
+        )
+
+    def reset(self) -> None:
+        self.latency = Histogram()
+        self.started = time.monotonic()
+        self.events = 0
+        self.errors = 0
+        self.lost = 0
+        self.undecodable = 0
+
+
+class HeadlessReceiver(Receiver):
+    """A receiver writing the events to ``output`` instead of handing them to the UI.
+
+    Events shipped as JSON are written as received, the others are encoded
+    to JSON first. ``summary`` is where the summary lines go.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        output: Optional[BinaryIO] = None,
+        store: Optional[CaptureStore] = None,
+        address: Optional[str] = None,
+        reorder_window: float = REORDER_WINDOW,
+        summary_interval: float = SUMMARY_INTERVAL,
+        summary: TextIO = sys.stderr,
+    ):
+        super().__init__(
+            host,
+            port,
+            None,
+            store=store,
+            address=address,
+            reorder_window=reorder_window,
+        )
+        self.output = output
+        self.summary_interval = summary_interval
+        self.summary_output = summary
+        self.summary = Summary()
+
+    async def serve(self):
+        task = None
+        if self.summary_interval > 0:
+            task = asyncio.create_task(self.print_summaries())
+        try:
+            await super().serve()
+        finally:
+            if task is not None:
+                task.cancel()
+            self.flush_output()
+            if self.summary_interval > 0:
+                self.print_summary()
+
+    async def print_summaries(self):
+        while True:
+            await asyncio.sleep(self.summary_interval)
+            self.flush_output()
+            self.print_summary()
+
+    def print_summary(self) -> None:
+        self.summary_output.write(self.summary.line() + "\n")
+        self.summary_output.flush()
+        self.summary.reset()
+
+    def emit(self, received_at: float, codec: int, data: bytes):
+        # Decoded once for the summary, the recording and the output
+        try:
+            event = codec_for(codec).decode(data)
+        except Exception as e:
+            self.stats.decode_failures += 1
+            logger.error(f"Event could not be decoded: {e}")
+            event, error = None, e
+        if self.store is not None:
+            self.store.append(received_at, codec, data, event)
+        if event is None:
+            self.summary.undecodable += 1
+            if self.output is not None:
+                record = error_record(received_at, codec, data, error)
+                self.write(json.dumps(record).encode())
+            return
+
+        self.summary.record(event)
+        if self.output is None:
+            return
+        self.write(
+            data
+            if codec == JSON
+            else json.dumps(event, separators=(",", ":"), default=str).encode()
+        )
+
+    def write(self, line: bytes) -> None:
+        try:
+            self.output.write(line + b"\n")
+        except BrokenPipeError:
+            self.output_closed()
+
+    def flush_output(self) -> None:
+        if self.output is None:
+            return
+        try:
+            self.output.flush()
+        except BrokenPipeError:
+            self.output_closed()
+
+    def output_closed(self) -> None:
+        # e.g. piped to head, there is nothing left to write to
+        logger.info("The output was closed, stopping the server")
+        self.output = None
+        self.stop()
+
+    def report_workers(self, workers: List[Dict]) -> None:
+        self.summary.update_lost(workers)
+
+
+def error_record(received_at: float, codec: int, data: bytes, error: Exception) -> Dict:
+    """Stands for an event which could not be decoded in the output.
+
+    The payload is kept, base64 encoded, to be looked into. Reading the output
+    back skips these records.
+    """
+    return {
+        ERROR_RECORD: f"{type(error).__name__}: {error}",
+        "received_at": received_at,
+        "codec": codec,
+        "payload": base64.b64encode(data).decode("ascii"),
+    }
@@ -1,52 +1,286 @@
-import socket
+import asyncio
+import os
+import stat
+import time
 from multiprocessing import Queue
+from typing import Dict, List, Optional
 
+from fastapi_xray.codec import codec_for
 from fastapi_xray.commons.logger import get_logger
+from fastapi_xray.protocol import PREAMBLE, Batch, FrameDecoder, ProtocolError
+from fastapi_xray.server.workers import REORDER_WINDOW, WORKER_STATS, WorkerTracker
+from fastapi_xray.storage import CaptureStore
+from fastapi_xray.transport import (
+    SHM,
+    TCP,
+    UNIX,
+    Address,
+    SharedMemoryRing,
+    parse_address,
+)
 
 logger = get_logger()
 
+READ_SIZE = 64 * 1024
+
+# Seconds between two writes of the recorded events, and retention checks
+STORE_FLUSH_INTERVAL = 0.5
+STORE_RETENTION_INTERVAL = 60
+
+# Seconds between two polls of an idle shared memory ring, backing off up to the max
+RING_POLL_MIN = 0.001
+RING_POLL_MAX = 0.05
+
+# Seconds between two snapshots of the workers sent to the UI
+WORKER_STATS_INTERVAL = 1.0
+
+# Seconds the connections are given to hand over their last events on shutdown
+CLOSE_TIMEOUT = 1.0
+
+
+class ReceiverStats:
+    """Counters describing the traffic handled by the receiver."""
+
+    def __init__(self):
+        self.connections = 0
+        self.active_connections = 0
+        self.bytes_received = 0
+        self.events = 0
+        self.decode_failures = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(vars(self))
+
 
 class Receiver:
-    def __init__(self, host: str, port: int, shared_queue: Queue):
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        shared_queue: Queue,
+        store: Optional[CaptureStore] = None,
+        address: Optional[str] = None,
+        reorder_window: float = REORDER_WINDOW,
+    ):
         self.host = host
         self.port = port
-        self.sock = None
+        # TCP on host and port by default, shared memory rings also listen there
+        self.address = (
+            parse_address(address, port) if address else Address(TCP, host, port)
+        )
+        self.server = None
         self.shared_queue = shared_queue
+        self.store = store
+        self.stats = ReceiverStats()
+        self.workers = WorkerTracker(reorder_window)
+        self._loop = None
+        self._stopping: Optional[asyncio.Event] = None
+        # Open connections, to the tasks handling them
+        self._connections: Dict[asyncio.StreamWriter, asyncio.Task] = {}
 
     def start(self):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        logger.info(f"Started debug server on {self.host}:{self.port}")
-        # Bind the socket to a specific address and port
-        self.sock.bind((self.host, self.port))
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        """Accepts agents and serves all their connections concurrently."""
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        address = self.address
+        if address.scheme == UNIX:
+            remove_stale_socket(address.path)
+            self.server = await asyncio.start_unix_server(
+                self.handle, address.path, limit=READ_SIZE
+            )
+        else:
+            self.server = await asyncio.start_server(
+                self.handle, self.host, self.port, limit=READ_SIZE
+            )
+        logger.info(f"Started debug server on {address}")
+
+        tasks = [asyncio.create_task(self.merge_streams())]
+        ring = None
+        if address.scheme == SHM:
+            ring = SharedMemoryRing(address.path, create=True)
+            tasks.append(asyncio.create_task(self.read_ring(ring)))
+            logger.info(f"Agents can fall back to tcp://{self.host}:{self.port}")
+        if self.store is not None:
+            tasks.append(asyncio.create_task(self.flush_store()))
+
+        # The server serves once started, the connections are closed before it is
+        async with self.server:
+            try:
+                await self._stopping.wait()
+            except asyncio.CancelledError:
+                pass
+            finally:
+                for task in tasks:
+                    task.cancel()
+                if ring is not None:
+                    ring.close()
+                await self.close_connections()
+                for item in self.workers.drain():
+                    self.emit(*item)
+                if address.scheme == UNIX:
+                    remove_stale_socket(address.path)
+                if self.store is not None:
+                    self.store.close()
+        logger.info(f"Debug server stopped: {self.stats.as_dict()}")
+        for worker in self.workers.snapshot():
+            logger.info(f"Worker {worker['id']}: {worker}")
+
+    async def close_connections(self):
+        """Closes the connections of the agents and waits for their last events.
+
+        Closing the server waits for the connections from Python 3.12 on, the
+        agents would keep them open forever.
+        """
+        handlers = list(self._connections.values())
+        for writer in list(self._connections):
+            writer.close()
+        if handlers:
+            await asyncio.wait(handlers, timeout=CLOSE_TIMEOUT)
+
+    async def read_ring(self, ring: SharedMemoryRing):
+        """Reads the frames the local agents write to the shared memory ring."""
+        stats = self.stats
+        decoder = FrameDecoder()
+        decoder.feed(PREAMBLE)
+        idle = RING_POLL_MIN
+        while True:
+            data = ring.read()
+            if not data:
+                await asyncio.sleep(idle)
+                idle = min(idle * 2, RING_POLL_MAX)
+                continue
+
+            idle = RING_POLL_MIN
+            stats.bytes_received += len(data)
+            try:
+                for batch in decoder.feed(data):
+                    self.publish(batch)
+            except ProtocolError as e:
+                # Frames are written whole, what comes next starts a new one
+                stats.decode_failures += 1
+                logger.error(f"Invalid data in the shared memory ring: {e}")
+                ring.skip()
+                decoder = FrameDecoder()
+                decoder.feed(PREAMBLE)
+            # Let the socket connections through when the ring is busy
+            await asyncio.sleep(0)
+
+    async def merge_streams(self):
+        """Releases the events out of the reorder window and reports the workers."""
+        window = self.workers.reorder_window
+        interval = min(max(window / 4, 0.01), 0.1) if window > 0 else 0.1
+        last_report = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            for item in self.workers.pop_ready():
+                self.emit(*item)
+            if time.monotonic() - last_report >= WORKER_STATS_INTERVAL:
+                last_report = time.monotonic()
+                if self.workers.workers:
+                    self.report_workers(self.workers.snapshot())
 
+    async def flush_store(self):
+        """Periodically writes the recorded events and applies the retention."""
+        last_retention = time.monotonic()
         while True:
+            await asyncio.sleep(STORE_FLUSH_INTERVAL)
             try:
-                # Listen for incoming connections
-                self.sock.listen()
-
-                # Wait for a client to connect
-                conn, addr = self.sock.accept()
-                with conn:
-                    # Receive data from the client
-                    data = b""
-                    while True:
-                        chunk = conn.recv(1024)
-                        if chunk:
-                            data += chunk
-                        else:
-                            break
-                    # Process the data received from the client
-                    decoded_data = data.decode("utf-8")
-                    logger.info("Received data from client")
-                    self.shared_queue.put(decoded_data)
-                    logger.info("Data sent to the shared queue.")
+                self.store.flush()
+                if time.monotonic() - last_retention >= STORE_RETENTION_INTERVAL:
+                    last_retention = time.monotonic()
+                    self.store.enforce_retention()
+            except Exception as e:
+                logger.error(f"Failed to write the recorded events: {e}")
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Reads events from a client until it disconnects.
+
+        Errors only close the offending connection, the server keeps running.
+        """
+        stats = self.stats
+        stats.connections += 1
+        stats.active_connections += 1
+        peer = writer.get_extra_info("peername")
+        logger.info(f"Client connected: {peer}")
+        self._connections[writer] = asyncio.current_task()
 
+        decoder = FrameDecoder()
+        try:
+            while True:
+                chunk = await reader.read(READ_SIZE)
+                if not chunk:
+                    break
+                stats.bytes_received += len(chunk)
+                for batch in decoder.feed(chunk):
+                    self.publish(batch)
+            for batch in decoder.close():
+                self.publish(batch)
+        except ProtocolError as e:
+            stats.decode_failures += 1
+            logger.error(f"Invalid data received from {peer}: {e}")
+        except ConnectionError as e:
+            logger.info(f"Client {peer} went away: {e}")
+        except asyncio.CancelledError:
+            # The server is stopping, asyncio would report the cancelled task as an error
+            logger.info(f"Client {peer} disconnected, the server is stopping")
+        except Exception as e:
+            logger.error(
+                "An error occurred while handling the connection",
+            )
+            logger.exception(e)
+        finally:
+            stats.active_connections -= 1
+            self._connections.pop(writer, None)
+            writer.close()
+
+    def publish(self, batch: Batch):
+        """Hands the events of a batch over to the UI as is, once their turn comes.
+
+        Only the tag of the batch is decoded, the events are left to the UI.
+        """
+        self.stats.events += len(batch.events)
+        # Tag with the arrival time so the UI can tell how far behind it is
+        received_at = time.time()
+        worker = None
+        if batch.tag is not None:
+            try:
+                worker = codec_for(batch.codec).decode(batch.tag)
             except Exception as e:
-                self.stop()
-                logger.error(
-                    "An error occurred while handling the connection",
-                )
-                logger.exception(e)
+                self.stats.decode_failures += 1
+                logger.error(f"Batch tag could not be decoded: {e}")
+
+        sent_at = self.workers.observe(worker, len(batch.events), received_at)
+        for data in batch.events:
+            if self.workers.reorder_window > 0:
+                self.workers.push(sent_at, (received_at, batch.codec, data))
+            else:
+                self.emit(received_at, batch.codec, data)
+
+    def emit(self, received_at: float, codec: int, data: bytes):
+        if self.store is not None:
+            self.store.append(received_at, codec, data)
+        self.shared_queue.put((received_at, codec, data))
+
+    def report_workers(self, workers: List[Dict]):
+        self.shared_queue.put((WORKER_STATS, workers))
 
     def stop(self):
-        self.sock.close()
+        if self._stopping is None or self._loop is None:
+            return
+        if self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._stopping.set)
+
+
+def remove_stale_socket(path: str) -> None:
+    """Removes a Unix socket left behind, but never a regular file."""
+    try:
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
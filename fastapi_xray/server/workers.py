@@ -0,0 +1,160 @@
+"""Per-worker bookkeeping of the event streams sent by the agents.
+
+Every agent process, e.g. each of the uvicorn workers of a gunicorn server,
+numbers its events with a sequence number which grows by one per captured
+event, and sends them in batches tagged with its worker id, host and pid, the
+sequence number of the last event of the batch and the time the batch was
+sent (see ``protocol.TAGGED``). The receiver only decodes the tags, never the
+events.
+
+- Gaps in the sequence numbers are events lost on the way, dropped by a full
+  agent queue or by a broken connection.
+- ``received_at - sent_at`` is the clock offset of the worker plus the delay of
+  the transport, which is never negative. The minimum over the recent samples
+  estimates the offset, which maps the agent clock to the receiver clock.
+  Offsets within ``CLOCK_TOLERANCE`` can't be told apart from the delay, the
+  clocks are taken to agree, as they do for the workers of the same host.
+- With a ``reorder_window``, events are held for that many seconds and
+  released ordered by the corrected time their batch was sent, merging the
+  streams of all the workers. The events of a worker keep their sequence
+  order, the streams of different workers are merged batch by batch, to
+  within the ``flush_interval`` of the agents.
+"""
+import heapq
+import itertools
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# Seconds events are held back to be merged in order, 0 to release them as they arrive
+REORDER_WINDOW = 0.0
+# Number of recent samples the clock offset is the minimum of
+OFFSET_SAMPLES = 64
+# Seconds over which the event rate of a worker is measured
+RATE_WINDOW = 10.0
+# Seconds of clock offset below which no correction is applied
+CLOCK_TOLERANCE = 0.005
+# First item of the queue messages carrying a snapshot of the workers for the UI,
+# the other messages are the (received_at, codec, payload) of an event
+WORKER_STATS = "workers"
+
+
+class WorkerState:
+    """What the receiver knows about one agent process."""
+
+    def __init__(self, worker_id: str, host: Optional[str], pid: Optional[int]):
+        self.id = worker_id
+        self.host = host
+        self.pid = pid
+        self.events = 0
+        self.lost = 0
+        self.last_seq = 0
+        self.last_seen = 0.0
+        self.offset = 0.0
+        # State of the connection pool of the worker, when it has one
+        self.pool: Optional[Dict] = None
+        self._offsets: Deque[float] = deque(maxlen=OFFSET_SAMPLES)
+        # (received_at, events) of the recent batches
+        self._arrivals: Deque[Tuple[float, int]] = deque()
+        self._recent = 0
+
+    def observe(self, worker: Dict, count: int, received_at: float) -> None:
+        """Accounts for a batch of ``count`` events tagged with ``worker``."""
+        self.events += count
+        self.last_seen = received_at
+        if count:
+            self._arrivals.append((received_at, count))
+            self._recent += count
+
+        seq = worker.get("seq")
+        if seq is not None and count:
+            # Events sent before the receiver started are not counted as lost
+            if self.last_seq and seq > self.last_seq + count:
+                self.lost += seq - self.last_seq - count
+            self.last_seq = max(self.last_seq, seq)
+
+        if worker.get("pool") is not None:
+            self.pool = worker["pool"]
+
+        sent_at = worker.get("sent_at")
+        if sent_at is not None:
+            self._offsets.append(received_at - sent_at)
+            offset = min(self._offsets)
+            self.offset = offset if abs(offset) >= CLOCK_TOLERANCE else 0.0
+
+    def rate(self, now: float) -> float:
+        """Events per second over the last ``RATE_WINDOW`` seconds."""
+        arrivals = self._arrivals
+        while arrivals and arrivals[0][0] < now - RATE_WINDOW:
+            self._recent -= arrivals.popleft()[1]
+        return self._recent / RATE_WINDOW
+
+    def as_dict(self, now: float) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "host": self.host,
+            "pid": self.pid,
+            "events": self.events,
+            "lost": self.lost,
+            "rate": self.rate(now),
+            "offset": self.offset,
+            "last_seen": self.last_seen,
+            "pool": self.pool,
+        }
+
+
+class WorkerTracker:
+    """Tracks the workers and merges their streams within the reorder window."""
+
+    def __init__(self, reorder_window: float = REORDER_WINDOW):
+        self.reorder_window = reorder_window
+        self.workers: Dict[str, WorkerState] = {}
+        self._pending: List[Tuple[float, int, Any]] = []
+        self._order = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def observe(self, worker: Optional[Dict], count: int, received_at: float) -> float:
+        """Accounts for a batch, returns the time it was sent on the receiver clock.
+
+        Batches of agents that don't tag them, or whose tag could not be
+        decoded, are timed with their arrival.
+        """
+        if not isinstance(worker, dict) or "id" not in worker:
+            return received_at
+
+        state = self.workers.get(worker["id"])
+        if state is None:
+            state = WorkerState(worker["id"], worker.get("host"), worker.get("pid"))
+            self.workers[worker["id"]] = state
+        state.observe(worker, count, received_at)
+        if worker.get("sent_at") is None:
+            return received_at
+        return worker["sent_at"] + state.offset
+
+    def push(self, timestamp: float, item: Any) -> None:
+        """Holds ``item`` until ``timestamp`` goes out of the reorder window."""
+        heapq.heappush(self._pending, (timestamp, next(self._order), item))
+
+    def pop_ready(self, now: Optional[float] = None) -> List[Any]:
+        """The items whose corrected timestamp went out of the reorder window."""
+        now = time.time() if now is None else now
+        watermark = now - self.reorder_window
+        pending = self._pending
+        ready = []
+        while pending and pending[0][0] <= watermark:
+            ready.append(heapq.heappop(pending)[2])
+        return ready
+
+    def drain(self) -> List[Any]:
+        """All the held items, in order."""
+        ready = [item for _, _, item in sorted(self._pending)]
+        self._pending = []
+        return ready
+
+    def snapshot(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """The state of every worker, the busiest first."""
+        now = time.time() if now is None else now
+        workers = [state.as_dict(now) for state in self.workers.values()]
+        return sorted(workers, key=lambda worker: worker["rate"], reverse=True)
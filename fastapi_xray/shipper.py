@@ -0,0 +1,295 @@
+import itertools
+import os
+import queue
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi_xray import protocol
+from fastapi_xray.codec import get_codec
+from fastapi_xray.commons.logger import get_logger
+from fastapi_xray.transport import (
+    TCP,
+    Address,
+    RingFull,
+    Transport,
+    connect,
+    parse_address,
+)
+
+logger = get_logger()
+
+_STOP = object()
+
+# Seconds between two status frames sent while there are no events to send
+STATUS_INTERVAL = 1.0
+
+
+class Shipper:
+    """Ships debug events to the receiver from a background thread.
+
+    The request path only pays for a non-blocking ``put`` into a bounded queue.
+    A daemon worker keeps one persistent framed connection (see ``protocol``)
+    to the receiver at ``address`` (see ``transport``), by default TCP to ``host``
+    and ``port``, and flushes events in batches, either when ``batch_size`` events are pending or when
+    ``flush_interval`` seconds have passed since the first event of the batch.
+    When the queue is full, new events are dropped and counted in ``dropped``
+    so a slow or missing receiver never slows the app down. Events are encoded
+    on the worker with ``codec`` (see ``codec.get_codec``). Each process numbers
+    its events and tags its batches with its ``worker_id``, by default
+    ``hostname:pid``, see ``server.workers``. ``status`` returns more state of the
+    worker, e.g. of its connection pool, added to the tag of each batch. It is
+    also sent on its own every ``status_interval`` seconds without events, the
+    state matters most when the requests are stuck.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        max_queue_size: int = 10000,
+        batch_size: int = 100,
+        flush_interval: float = 0.2,
+        reconnect_delay: float = 1.0,
+        codec: Optional[str] = None,
+        address: Optional[str] = None,
+        worker_id: Optional[str] = None,
+        status: Optional[Callable[[], Dict[str, Any]]] = None,
+        status_interval: float = STATUS_INTERVAL,
+    ):
+        self.host = host
+        self.port = port
+        # TCP is also the fallback of shared memory rings that can't be found
+        self.fallback = Address(TCP, host=host, port=port)
+        self.address = parse_address(address, port) if address else self.fallback
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.reconnect_delay = reconnect_delay
+        self.codec = get_codec(codec)
+
+        self.sent = 0
+        self.dropped = 0
+        # Nanoseconds spent queuing, encoding and sending the events so far
+        self.submitted = 0
+        self.encoded = 0
+        self.enqueue_ns = 0
+        self.encode_ns = 0
+        self.send_ns = 0
+
+        self.worker_id = worker_id
+        self.status = status
+        self.status_interval = status_interval
+        self.hostname = socket.gethostname()
+        self._worker: Dict = {}
+        self._seq = itertools.count(1)
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._transport: Optional[Transport] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._next_connect = 0.0
+
+    def submit(self, event: Dict) -> bool:
+        """Queues an event without blocking. Returns False if it was dropped."""
+        started = time.perf_counter_ns()
+        self._ensure_started()
+        # Numbered before it's queued, the events dropped here show up as gaps
+        event["worker"] = dict(self._worker, seq=next(self._seq))
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        finally:
+            self.submitted += 1
+            self.enqueue_ns += time.perf_counter_ns() - started
+        return True
+
+    def overhead(self) -> Dict[str, int]:
+        """Mean nanoseconds spent per event queuing, encoding and sending it.
+
+        Only queuing is on the request path, the rest runs in the worker thread.
+        """
+        return {
+            "enqueue": self.enqueue_ns // max(self.submitted, 1),
+            "encode": self.encode_ns // max(self.encoded, 1),
+            "send": self.send_ns // max(self.sent, 1),
+        }
+
+    def start(self) -> None:
+        with self._lock:
+            self._start()
+
+    def stop(self, timeout: float = 2.0) -> None:
+        """Flushes pending events and stops the worker."""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        thread.join(timeout)
+
+    def _ensure_started(self) -> None:
+        # The worker thread does not survive a fork (e.g. gunicorn preloading
+        # the app), so restart it whenever we find ourselves in a new process.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._start()
+
+    def _start(self) -> None:
+        self._pid = os.getpid()
+        # Each process is a worker of its own, with its own sequence
+        self._worker = {
+            "id": self.worker_id or f"{self.hostname}:{self._pid}",
+            "host": self.hostname,
+            "pid": self._pid,
+        }
+        self._seq = itertools.count(1)
+        self._transport = None
+        self._thread = threading.Thread(
+            target=self._run, name="fastapi-xray-shipper", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                self._send_status()
+                continue
+            stop = batch and batch[-1] is _STOP
+            if stop:
+                batch.pop()
+            if batch:
+                self._send(batch)
+            if stop:
+                self._close()
+                return
+
+    def _next_batch(self) -> Optional[List]:
+        """The next events to send, None when it is time to send the status."""
+        timeout = self.status_interval if self.status is not None else None
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return None
+        if batch[0] is _STOP:
+            return batch
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                event = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(event)
+            if event is _STOP:
+                break
+        return batch
+
+    def _send(self, batch: List[Dict]) -> None:
+        # An event can't carry its own encoding time, the means so far are sent
+        overhead = self.overhead()
+        for event in batch:
+            event["worker"]["overhead"] = overhead
+        # The sent time lets the receiver estimate the offset between its clock and ours
+        tag = dict(
+            self._worker,
+            seq=batch[-1]["worker"]["seq"],
+            sent_at=time.time(),
+            **self._status(),
+        )
+        started = time.perf_counter_ns()
+        try:
+            payload = protocol.encode_batch(
+                [self.codec.encode(event) for event in batch],
+                self.codec.id,
+                tag=self.codec.encode(tag),
+            )
+        except (TypeError, ValueError) as e:
+            self.dropped += len(batch)
+            logger.error(f"Failed to serialize debug info: {e}")
+            return
+        self.encoded += len(batch)
+        self.encode_ns += time.perf_counter_ns() - started
+
+        started = time.perf_counter_ns()
+        if not self._write(payload):
+            self.dropped += len(batch)
+            return
+
+        self.sent += len(batch)
+        self.send_ns += time.perf_counter_ns() - started
+        logger.info(f"Sent {len(batch)} events to receiver")
+
+    def _send_status(self) -> None:
+        """Sends the status of the worker in a batch without events."""
+        tag = dict(self._worker, sent_at=time.time(), **self._status())
+        try:
+            payload = protocol.encode_batch(
+                [], self.codec.id, tag=self.codec.encode(tag)
+            )
+        except (TypeError, ValueError) as e:
+            logger.error(f"Failed to serialize the worker status: {e}")
+            return
+        self._write(payload)
+
+    def _write(self, payload: bytes) -> bool:
+        """Sends the frames, returns False if they were dropped."""
+        transport = self._connect()
+        if transport is None:
+            return False
+
+        try:
+            transport.send(payload)
+        except RingFull as e:
+            # Attached again on the next batch, in case the ring was replaced
+            self._close()
+            logger.error(f"Dropped debug info: {e}")
+            return False
+        except OSError as e:
+            self._close()
+            logger.error(f"Failed to send debug info: {e}")
+            return False
+        return True
+
+    def _status(self) -> Dict[str, Any]:
+        if self.status is None:
+            return {}
+        try:
+            return self.status()
+        except Exception as e:
+            logger.error(f"Failed to get the worker status: {e}")
+            return {}
+
+    def _connect(self) -> Optional[Transport]:
+        if self._transport is not None:
+            return self._transport
+
+        # Don't hammer a receiver that is down, just drop until the next attempt.
+        now = time.monotonic()
+        if now < self._next_connect:
+            return None
+
+        try:
+            self._transport = connect(self.address, self.fallback)
+        except OSError as e:
+            self._close()
+            self._next_connect = now + self.reconnect_delay
+            logger.error(f"Could not connect to receiver: {e}")
+            return None
+        return self._transport
+
+    def _close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
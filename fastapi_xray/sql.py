@@ -0,0 +1,220 @@
+"""Capture and rendering of SQL statements.
+
+The agent only captures the statement template and a truncated, JSON safe copy
+of its parameters. Interpolating the parameters into the statement is left to
+the UI, which does it when the statement is displayed.
+"""
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional
+
+MAX_STATEMENT_LENGTH = 20000
+MAX_PARAMETER_LENGTH = 200
+MAX_PARAMETERS = 100
+MAX_EXECUTEMANY_ROWS = 10
+
+TRUNCATED = "…"
+
+
+def _capture_value(value: Any) -> Any:
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, (list, tuple)):
+        return [_capture_value(item) for item in value[:MAX_PARAMETERS]]
+
+    value = str(value)
+    if len(value) > MAX_PARAMETER_LENGTH:
+        value = value[:MAX_PARAMETER_LENGTH] + TRUNCATED
+    return value
+
+
+def _capture_row(parameters: Any) -> Any:
+    if isinstance(parameters, dict):
+        items = list(parameters.items())[:MAX_PARAMETERS]
+        return {str(key): _capture_value(value) for key, value in items}
+    if isinstance(parameters, (list, tuple)):
+        return [_capture_value(value) for value in parameters[:MAX_PARAMETERS]]
+    return _capture_value(parameters)
+
+
+def capture_query(
+    statement: str,
+    parameters: Any,
+    executemany: bool,
+    paramstyle: Optional[str],
+    dialect: Optional[str],
+    capture_parameters: bool = True,
+) -> Dict[str, Any]:
+    """Builds the cheap, size capped representation of an executed query."""
+    if len(statement) > MAX_STATEMENT_LENGTH:
+        statement = statement[:MAX_STATEMENT_LENGTH] + TRUNCATED
+
+    query = {
+        "statement": statement,
+        "fingerprint": fingerprint(statement),
+        "paramstyle": paramstyle,
+        "dialect": dialect,
+        "executemany": executemany,
+    }
+
+    if parameters is None:
+        return query
+
+    if executemany:
+        rows = parameters if isinstance(parameters, (list, tuple)) else list(parameters)
+        query["row_count"] = len(rows)
+        if capture_parameters:
+            query["parameters"] = [
+                _capture_row(row) for row in rows[:MAX_EXECUTEMANY_ROWS]
+            ]
+    elif capture_parameters:
+        query["parameters"] = _capture_row(parameters)
+
+    return query
+
+
+# Quoted strings, quoted identifiers and comments are copied as is so that
+# placeholder-like text inside of them is not replaced.
+_SKIP = r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/"
+
+_PLACEHOLDERS = {
+    "qmark": r"\?",
+    "numeric": r"(?<!:):(\d+)",
+    "named": r"(?<!:):(\w+)",
+    "format": r"%%|%s",
+    "pyformat": r"%%|%\((\w+)\)s|%s",
+}
+
+
+def render_literal(value: Any, dialect: Optional[str] = None) -> str:
+    """Renders a captured parameter as a SQL literal for the given dialect."""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        if dialect in ("sqlite", "mysql", "mssql"):
+            return "1" if value else "0"
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, list):
+        return "(" + ", ".join(render_literal(item, dialect) for item in value) + ")"
+
+    value = str(value).replace("'", "''")
+    if dialect == "mysql":
+        value = value.replace("\\", "\\\\")
+    return f"'{value}'"
+
+
+def render_statement(
+    statement: str,
+    parameters: Any = None,
+    paramstyle: Optional[str] = None,
+    dialect: Optional[str] = None,
+) -> str:
+    """Interpolates the parameters into the statement, for display only."""
+    if parameters is None or paramstyle not in _PLACEHOLDERS:
+        return statement
+
+    pattern = re.compile(f"{_SKIP}|{_PLACEHOLDERS[paramstyle]}", re.DOTALL)
+    positional = iter(parameters) if isinstance(parameters, list) else iter(())
+
+    def replace(match: re.Match) -> str:
+        token = match.group(0)
+        if token[0] in "'\"" or token.startswith("--") or token.startswith("/*"):
+            # The driver unescapes %% in the whole statement, literals included
+            return (
+                token.replace("%%", "%")
+                if paramstyle in ("format", "pyformat")
+                else token
+            )
+        if token == "%%":
+            return "%"
+
+        name = match.group(1) if match.lastindex else None
+        try:
+            if name is None:
+                value = next(positional)
+            elif paramstyle == "numeric":
+                value = parameters[int(name) - 1]
+            else:
+                value = parameters[name]
+        except (StopIteration, LookupError, TypeError, ValueError):
+            return token
+        return render_literal(value, dialect)
+
+    return pattern.sub(replace, statement)
+
+
+_FINGERPRINT = re.compile(
+    r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<string>'(?:[^']|'')*')
+    | (?P<identifier>"(?:[^"]|"")*")
+    | (?P<number>(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b)
+    | (?P<placeholder>\?|%s|%\(\w+\)s|(?<!:):\w+)
+    """,
+    re.DOTALL | re.VERBOSE,
+)
+_WHITESPACE = re.compile(r"\s+")
+_PUNCTUATION = re.compile(r"\s*([=<>!,])\s*|(\()\s+|\s+(\))")
+_VALUES_LIST = re.compile(r"(\(\?(?:,\?)*\))(?:,\(\?(?:,\?)*\))+")
+_IN_LIST = re.compile(r"\(\?(?:,\?)+\)")
+
+
+def _normalize(match: re.Match) -> str:
+    if match.lastgroup == "comment":
+        return " "
+    if match.lastgroup == "identifier":
+        return match.group(0)
+    return "?"
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement: str) -> str:
+    """Normalizes a statement so that queries differing only by values match.
+
+    Literals and placeholders become ``?``, lists of them such as ``IN (1, 2, 3)``
+    or multi row ``VALUES`` collapse into a single item, comments are dropped and
+    whitespace and case are normalized.
+    """
+    normalized = _FINGERPRINT.sub(_normalize, statement)
+    normalized = _WHITESPACE.sub(" ", normalized).strip().lower()
+    normalized = _PUNCTUATION.sub(
+        lambda match: match.group(match.lastindex), normalized
+    )
+    normalized = _VALUES_LIST.sub(r"\1,...", normalized)
+    return _IN_LIST.sub("(?+)", normalized)
+
+
+class QueryGroup:
+    """Aggregate of the queries of a request sharing the same fingerprint."""
+
+    def __init__(self, fingerprint: str, statement: str):
+        self.fingerprint = fingerprint
+        self.statement = statement
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    @property
+    def mean_time(self) -> float:
+        return self.total_time / self.count if self.count else 0.0
+
+    def add(self, execution_time: float) -> None:
+        self.count += 1
+        self.total_time += execution_time
+        self.max_time = max(self.max_time, execution_time)
+
+
+def group_queries(queries: Iterable[Any]) -> List[QueryGroup]:
+    """Groups the queries by fingerprint, sorted by total time, slowest first."""
+    groups: Dict[str, QueryGroup] = {}
+    for query in queries:
+        key = query.fingerprint or fingerprint(query.statement)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = QueryGroup(key, query.statement)
+        group.add(query.execution_time)
+    return sorted(groups.values(), key=lambda group: group.total_time, reverse=True)
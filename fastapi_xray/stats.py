@@ -0,0 +1,244 @@
+"""Per-route latency statistics, updated incrementally as requests come in.
+
+Latencies are counted in log-bucketed histograms, in the spirit of
+HdrHistogram: the bucket bounds grow by a constant factor, so every recorded
+value is known within a fixed relative error and a histogram takes the same
+memory whatever the number of requests.
+"""
+import math
+import time
+from array import array
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    # Only for the annotations, so the headless server doesn't import pydantic
+    from fastapi_xray.schemas import APIRequest
+
+# Key of the requests which didn't match any route, e.g. 404s
+NO_ROUTE = "<no route>"
+# Seconds over which the request rate of a route is measured
+RATE_WINDOW = 60
+
+SORT_KEYS = ("total", "count", "rate", "p50", "p90", "p99", "max", "sql_time")
+
+
+class Histogram:
+    """Counts positive values in buckets spanning ``lowest`` to ``highest``.
+
+    Each bucket is ``1 + precision`` times wider than the previous one, the
+    percentiles are within ``precision`` of the recorded values. Values out of
+    the range are counted in the first or last bucket, ``min`` and ``max``
+    stay exact, and the percentiles falling in the last bucket are ``max``.
+    """
+
+    def __init__(
+        self,
+        lowest: float = 0.001,
+        highest: float = 3_600_000.0,
+        precision: float = 0.01,
+    ):
+        self.lowest = lowest
+        self.precision = precision
+        self._log_factor = math.log1p(precision)
+        size = int(math.log(highest / lowest) / self._log_factor) + 2
+        self.counts = array("L", bytes(size * array("L").itemsize))
+
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        # Bounds of the used buckets, so percentiles don't scan the empty ones
+        self._first = size
+        self._last = -1
+
+    def record(self, value: float) -> None:
+        if value <= self.lowest:
+            index = 0
+        else:
+            index = int(math.log(value / self.lowest) / self._log_factor) + 1
+            index = min(index, len(self.counts) - 1)
+
+        self.counts[index] += 1
+        self._first = min(self._first, index)
+        self._last = max(self._last, index)
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def bucket_value(self, index: int) -> float:
+        """The value a bucket stands for, the middle of its bounds."""
+        if index == 0:
+            return self.lowest
+        low = self.lowest * math.exp((index - 1) * self._log_factor)
+        return low * (1 + self.precision / 2)
+
+    def percentiles(self, *quantiles: float) -> List[float]:
+        """The values below which ``quantiles`` (from 0 to 100) of the values are."""
+        if not self.count:
+            return [0.0 for _ in quantiles]
+
+        targets = sorted(
+            (max(1, math.ceil(quantile / 100 * self.count)), position)
+            for position, quantile in enumerate(quantiles)
+        )
+        results = [0.0] * len(quantiles)
+        seen = 0
+        current = 0
+        overflow = len(self.counts) - 1
+        for index in range(self._first, self._last + 1):
+            seen += self.counts[index]
+            while current < len(targets) and seen >= targets[current][0]:
+                # The values above the range are only known by the largest
+                value = self.max if index == overflow else self.bucket_value(index)
+                results[targets[current][1]] = min(max(value, self.min), self.max)
+                current += 1
+            if current == len(targets):
+                break
+        return results
+
+    def percentile(self, quantile: float) -> float:
+        return self.percentiles(quantile)[0]
+
+
+class RateCounter:
+    """Counts the events of the last ``window`` seconds, one slot per second."""
+
+    def __init__(self, window: int = RATE_WINDOW):
+        self.window = window
+        self.slots = [0] * window
+        self.seconds = [0] * window
+
+    def add(self, now: float) -> None:
+        second = int(now)
+        slot = second % self.window
+        if self.seconds[slot] != second:
+            self.seconds[slot] = second
+            self.slots[slot] = 0
+        self.slots[slot] += 1
+
+    def rate(self, now: Optional[float] = None) -> float:
+        now = time.time() if now is None else now
+        oldest = int(now) - self.window
+        total = sum(
+            count for count, second in zip(self.slots, self.seconds) if second > oldest
+        )
+        return total / self.window
+
+
+class RouteStats:
+    """The statistics of the requests of one method and route template."""
+
+    def __init__(self, method: str, route: str):
+        self.method = method
+        self.route = route
+        self.latency = Histogram()
+        self.requests = RateCounter()
+        self.errors = 0
+        self.sql_count = 0
+        self.sql_time = 0.0
+
+    def record(self, request: "APIRequest", now: float) -> None:
+        self.latency.record(request.elapsed_time)
+        self.requests.add(now)
+        if request.request.status_code >= 500:
+            self.errors += 1
+        self.sql_count += len(request.sql)
+        self.sql_time += sum(query.execution_time for query in request.sql)
+
+    def summary(self, now: Optional[float] = None) -> Dict:
+        latency = self.latency
+        p50, p90, p99 = latency.percentiles(50, 90, 99)
+        return {
+            "method": self.method,
+            "route": self.route,
+            "count": latency.count,
+            "rate": self.requests.rate(now),
+            "errors": self.errors,
+            "total": latency.total,
+            "mean": latency.mean,
+            "p50": p50,
+            "p90": p90,
+            "p99": p99,
+            "max": latency.max,
+            "sql_count": self.sql_count,
+            "sql_time": self.sql_time,
+        }
+
+
+def route_key(request: "APIRequest") -> Tuple[str, str]:
+    """The method and route template of a request.
+
+    Agents send the route template since schema version 3, the requests of
+    older agents are keyed by path.
+    """
+    route = request.route
+    if route is None:
+        route = NO_ROUTE if (request.schema_version or 0) >= 3 else request.request.path
+    return request.request.method, route
+
+
+class StatsEngine:
+    """The statistics of every route, fed with each captured request."""
+
+    def __init__(self):
+        self.routes: Dict[Tuple[str, str], RouteStats] = {}
+        self.count = 0
+        # Requests which came with their timings, and what X-Ray cost them
+        self.timed = 0
+        self.timed_elapsed = 0.0
+        self.overhead_ns = 0
+
+    def record(self, request: "APIRequest", now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        key = route_key(request)
+        stats = self.routes.get(key)
+        if stats is None:
+            stats = self.routes[key] = RouteStats(*key)
+        stats.record(request, now)
+        self.count += 1
+
+        timings = request.timings
+        if timings is not None:
+            self.timed += 1
+            self.timed_elapsed += request.elapsed_time
+            self.overhead_ns += timings.overhead
+            worker = request.worker
+            if worker is not None and worker.overhead:
+                self.overhead_ns += worker.overhead.get("enqueue", 0)
+
+    def record_all(self, requests: Iterable["APIRequest"]) -> None:
+        now = time.time()
+        for request in requests:
+            self.record(request, now)
+
+    def overhead(self) -> Tuple[float, float]:
+        """Mean milliseconds X-Ray spent on the path of a request, and their
+        share of the request time."""
+        if not self.timed:
+            return 0.0, 0.0
+        mean = self.overhead_ns / 1e6 / self.timed
+        share = (
+            self.overhead_ns / 1e6 / self.timed_elapsed * 100
+            if self.timed_elapsed
+            else 0.0
+        )
+        return mean, share
+
+    def summaries(self, sort: str = "total", now: Optional[float] = None) -> List[Dict]:
+        """The summary of every route, sorted by ``sort``, largest first."""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key {sort!r}, use one of {SORT_KEYS}")
+        summaries = [stats.summary(now) for stats in self.routes.values()]
+        return sorted(summaries, key=lambda summary: summary[sort], reverse=True)
+
+    def clear(self) -> None:
+        self.routes.clear()
+        self.count = 0
+        self.timed = 0
+        self.timed_elapsed = 0.0
+        self.overhead_ns = 0
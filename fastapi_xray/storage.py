@@ -0,0 +1,299 @@
+"""On-disk store of the captured events.
+
+The encoded events are appended as is to segment files. Each record is a fixed
+size header followed by the payload::
+
+    +----------------+-----------+---------------------+------------------+
+    | length: uint32 | codec: u8 | received_at: double | payload (length) |
+    +----------------+-----------+---------------------+------------------+
+
+A SQLite index next to the segments locates every event by request id and
+indexes it by arrival time, route and status. The index is written in WAL
+mode, so a recording can be browsed while it is still being written. Retention
+drops whole segments, oldest first.
+"""
+import os
+import sqlite3
+import struct
+import time
+from collections import OrderedDict
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from fastapi_xray.codec import codec_for
+from fastapi_xray.commons.logger import get_logger
+
+logger = get_logger()
+
+RECORD = struct.Struct("!IBd")
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+SEGMENT_SUFFIX = ".seg"
+INDEX_NAME = "index.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY,
+    request_id TEXT NOT NULL,
+    received_at REAL NOT NULL,
+    method TEXT,
+    route TEXT,
+    status INTEGER,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    codec INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_request_id ON events (request_id);
+CREATE INDEX IF NOT EXISTS events_received_at ON events (received_at);
+CREATE INDEX IF NOT EXISTS events_route ON events (route);
+CREATE INDEX IF NOT EXISTS events_status ON events (status);
+CREATE INDEX IF NOT EXISTS events_segment ON events (segment);
+"""
+
+
+class CaptureStore:
+    """A directory of segment files and their index.
+
+    Args:
+        directory (str): Where the session is recorded, created if needed.
+        max_bytes (int, optional): Oldest segments are dropped once the segments
+            take more than this. Defaults to None.
+        max_age (float, optional): Segments whose newest event is older than this,
+            in seconds, are dropped. Defaults to None.
+        segment_size (int, optional): Size at which a new segment is started.
+        readonly (bool, optional): Open an existing recording for browsing only.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: Optional[int] = None,
+        max_age: Optional[float] = None,
+        segment_size: int = SEGMENT_SIZE,
+        readonly: bool = False,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.segment_size = segment_size
+        self.readonly = readonly
+
+        index_path = os.path.join(directory, INDEX_NAME)
+        if readonly:
+            if not os.path.exists(index_path):
+                raise FileNotFoundError(f"No recorded session in {directory}")
+            self.db = sqlite3.connect(
+                f"file:{index_path}?mode=ro", uri=True, check_same_thread=False
+            )
+        else:
+            os.makedirs(directory, exist_ok=True)
+            self.db = sqlite3.connect(index_path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(_SCHEMA)
+
+        self._pending: List[Tuple] = []
+        self._writer: Optional[BinaryIO] = None
+        self._segment = 0
+        self._segment_offset = 0
+        self._readers: "OrderedDict[int, BinaryIO]" = OrderedDict()
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:08d}{SEGMENT_SUFFIX}")
+
+    def segments(self) -> List[int]:
+        """The segment numbers on disk, oldest first."""
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SEGMENT_SUFFIX):
+                segments.append(int(name[: -len(SEGMENT_SUFFIX)]))
+        return sorted(segments)
+
+    # Writing
+
+    def append(
+        self,
+        received_at: float,
+        codec: int,
+        payload: bytes,
+        event: Optional[Dict] = None,
+    ) -> bool:
+        """Appends an encoded event, returns False if it could not be decoded.
+
+        The event is only decoded to extract the indexed fields, unless it is
+        given already decoded. The index rows are written by ``flush``.
+        """
+        try:
+            if event is None:
+                event = codec_for(codec).decode(payload)
+            request = event["request"]
+            row = (
+                event["request_id"],
+                received_at,
+                request.get("method"),
+                event.get("route") or request.get("path"),
+                request.get("status_code"),
+            )
+        except Exception as e:
+            logger.error(f"Event not recorded, it could not be decoded: {e}")
+            return False
+
+        writer = self._segment_writer()
+        writer.write(RECORD.pack(len(payload), codec, received_at))
+        writer.write(payload)
+        offset = self._segment_offset + RECORD.size
+        self._segment_offset = offset + len(payload)
+
+        self._pending.append(row + (self._segment, offset, len(payload), codec))
+        return True
+
+    def flush(self) -> None:
+        """Writes the pending events to disk and indexes them."""
+        if self._writer is not None:
+            self._writer.flush()
+        if not self._pending:
+            return
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO events (request_id, received_at, method, route, status,"
+                " segment, offset, length, codec) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self._pending,
+            )
+        self._pending = []
+
+    def _segment_writer(self) -> BinaryIO:
+        if self._writer is not None and self._segment_offset < self.segment_size:
+            return self._writer
+
+        if self._writer is not None:
+            self.flush()
+            self._writer.close()
+            self.enforce_retention()
+
+        segments = self.segments()
+        self._segment = segments[-1] + 1 if segments else 1
+        self._writer = open(self.segment_path(self._segment), "ab")
+        self._segment_offset = 0
+        return self._writer
+
+    def enforce_retention(self, now: Optional[float] = None) -> List[int]:
+        """Drops the oldest segments beyond the size or age limits.
+
+        The segment being written is never dropped. Returns the dropped segments.
+        """
+        if not self.max_bytes and not self.max_age:
+            return []
+        now = time.time() if now is None else now
+
+        segments = [s for s in self.segments() if s != self._segment]
+        sizes = {s: os.path.getsize(self.segment_path(s)) for s in segments}
+        total = sum(sizes.values()) + self._segment_offset
+
+        dropped = []
+        for segment in segments:
+            expired = False
+            if self.max_age:
+                (newest,) = self.db.execute(
+                    "SELECT MAX(received_at) FROM events WHERE segment = ?", (segment,)
+                ).fetchone()
+                expired = newest is None or newest < now - self.max_age
+            if not expired and not (self.max_bytes and total > self.max_bytes):
+                break
+            dropped.append(segment)
+            total -= sizes[segment]
+
+        for segment in dropped:
+            with self.db:
+                self.db.execute("DELETE FROM events WHERE segment = ?", (segment,))
+            reader = self._readers.pop(segment, None)
+            if reader is not None:
+                reader.close()
+            os.remove(self.segment_path(segment))
+
+        if dropped:
+            logger.info(f"Retention dropped segments {dropped}")
+        return dropped
+
+    # Reading
+
+    def count(self) -> int:
+        (count,) = self.db.execute("SELECT COUNT(*) FROM events").fetchone()
+        return count
+
+    def size_bytes(self) -> int:
+        return sum(os.path.getsize(self.segment_path(s)) for s in self.segments())
+
+    def page(self, offset: int, limit: int) -> List[Tuple[int, str]]:
+        """``(seq, request_id)`` of the events, newest first."""
+        return self.db.execute(
+            "SELECT seq, request_id FROM events ORDER BY seq DESC LIMIT ? OFFSET ?",
+            (limit, offset),
+        ).fetchall()
+
+    def position(self, request_id: str) -> Optional[int]:
+        """Index of the event in the newest first order."""
+        seq = self.seq(request_id)
+        if seq is None:
+            return None
+        (count,) = self.db.execute(
+            "SELECT COUNT(*) FROM events WHERE seq > ?", (seq,)
+        ).fetchone()
+        return count
+
+    def seq(self, request_id: str) -> Optional[int]:
+        row = self.db.execute(
+            "SELECT seq FROM events WHERE request_id = ?", (request_id,)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def read(self, request_id: str) -> Optional[Tuple[int, bytes]]:
+        """Returns the codec and payload of an event."""
+        row = self.db.execute(
+            "SELECT segment, offset, length, codec FROM events WHERE request_id = ?",
+            (request_id,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        segment, offset, length, codec = row
+        try:
+            reader = self._segment_reader(segment)
+        except FileNotFoundError:
+            # Dropped by the retention of the process writing the session
+            return None
+        reader.seek(offset)
+        return codec, reader.read(length)
+
+    def events(self) -> Iterator[Tuple[int, bytes]]:
+        """The codec and payload of every event, oldest first."""
+        rows = self.db.execute(
+            "SELECT segment, offset, length, codec FROM events ORDER BY seq"
+        )
+        for segment, offset, length, codec in rows:
+            try:
+                reader = self._segment_reader(segment)
+            except FileNotFoundError:
+                continue
+            reader.seek(offset)
+            yield codec, reader.read(length)
+
+    def _segment_reader(self, segment: int) -> BinaryIO:
+        reader = self._readers.get(segment)
+        if reader is None:
+            reader = self._readers[segment] = open(self.segment_path(segment), "rb")
+            if len(self._readers) > 8:
+                self._readers.popitem(last=False)[1].close()
+        else:
+            self._readers.move_to_end(segment)
+        return reader
+
+    def close(self) -> None:
+        if not self.readonly:
+            self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        for reader in self._readers.values():
+            reader.close()
+        self._readers.clear()
+        self.db.close()
@@ -0,0 +1,315 @@
+"""Transports carrying the protocol frames from the agents to the receiver.
+
+The receiver address selects the transport:
+
+- ``tcp://host:port``, the default, works across hosts.
+- ``unix:///path/to/socket``, a Unix domain socket, for agents on the same host.
+- ``shm://name``, a ring buffer in shared memory, the cheapest for agents on
+  the same host. The receiver creates the ring and listens on TCP as well,
+  agents which can't find the ring fall back to TCP.
+
+The ring is a fixed size header followed by the data area. The write and read
+positions only ever grow, the data is at their value modulo the capacity::
+
+    +-----------+---------------+-------------------+------------------+------------+------------+---------+
+    | magic: 4s | capacity: u64 | head: u64 (write) | tail: u64 (read) | epoch: u64 | owner: u64 | data... |
+    +-----------+---------------+-------------------+------------------+------------+------------+---------+
+
+Agents write whole frames under an exclusive ``flock``, so the frames of
+different processes never interleave, and publish them by moving the head.
+The receiver is the only reader and moves the tail.
+
+Agents stay attached to a ring after the receiver is gone. Each ring gets a
+new epoch when it is created, and the receiver sets it to 0 when it closes
+the ring or replaces a stale one. Writing to a ring whose epoch changed, or
+attaching to one whose owner process is gone, raises ``OSError`` so that the
+agent attaches to the new ring or falls back to TCP.
+"""
+import os
+import socket
+import struct
+import tempfile
+import time
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit
+
+from fastapi_xray import protocol
+from fastapi_xray.commons.logger import get_logger
+
+logger = get_logger()
+
+TCP = "tcp"
+UNIX = "unix"
+SHM = "shm"
+
+RING_MAGIC = b"XRN2"
+RING_HEADER = struct.Struct("!4sQQQQQ")
+RING_HEAD_OFFSET = 12
+RING_TAIL_OFFSET = 20
+RING_EPOCH_OFFSET = 28
+# Epoch of a ring closed by its receiver
+RING_RETIRED = 0
+POSITION = struct.Struct("!Q")
+RING_SIZE = 16 * 1024 * 1024
+
+
+class Address(NamedTuple):
+    scheme: str
+    host: Optional[str] = None
+    port: Optional[int] = None
+    path: Optional[str] = None
+
+    def __str__(self) -> str:
+        if self.scheme == TCP:
+            return f"tcp://{self.host}:{self.port}"
+        if self.scheme == UNIX:
+            return f"unix://{self.path}"
+        return f"shm://{self.path}"
+
+
+def parse_address(address: str, default_port: int = 8989) -> Address:
+    """Parses ``tcp://host:port``, ``unix:///path``, ``shm://name`` or ``host:port``."""
+    if "://" not in address:
+        address = f"tcp://{address}"
+
+    parts = urlsplit(address)
+    if parts.scheme == TCP:
+        return Address(
+            TCP, host=parts.hostname or "0.0.0.0", port=parts.port or default_port
+        )
+    if parts.scheme == UNIX:
+        if not parts.path:
+            raise ValueError(f"Missing socket path in {address!r}")
+        return Address(UNIX, path=parts.path)
+    if parts.scheme == SHM:
+        name = parts.netloc or parts.path.lstrip("/")
+        if not name:
+            raise ValueError(f"Missing shared memory name in {address!r}")
+        return Address(SHM, path=name)
+    raise ValueError(f"Unsupported address {address!r}, use tcp://, unix:// or shm://")
+
+
+class RingFull(BufferError):
+    """The receiver is not keeping up with the ring buffer."""
+
+
+class SharedMemoryRing:
+    """A ring buffer in a named shared memory block.
+
+    The receiver creates it with ``create=True``, the agents attach to it and
+    can only write to it while it has the epoch it had when they attached.
+    """
+
+    def __init__(self, name: str, create: bool = False, size: int = RING_SIZE):
+        from multiprocessing import shared_memory
+
+        self.name = name
+        self.created = create
+        if create:
+            try:
+                self.shm = shared_memory.SharedMemory(
+                    name, create=True, size=RING_HEADER.size + size
+                )
+            except FileExistsError:
+                # Left behind by a receiver which didn't exit cleanly, the
+                # agents still attached to it move on to the new one.
+                stale = shared_memory.SharedMemory(name)
+                if len(stale.buf) >= RING_HEADER.size:
+                    POSITION.pack_into(stale.buf, RING_EPOCH_OFFSET, RING_RETIRED)
+                stale.close()
+                stale.unlink()
+                self.shm = shared_memory.SharedMemory(
+                    name, create=True, size=RING_HEADER.size + size
+                )
+            RING_HEADER.pack_into(
+                self.shm.buf, 0, RING_MAGIC, size, 0, 0, time.time_ns(), os.getpid()
+            )
+        else:
+            self.shm = _attach(name)
+            magic = bytes(self.shm.buf[:4])
+            if magic != RING_MAGIC:
+                self.shm.close()
+                raise OSError(f"Shared memory {name} is not an X-Ray ring")
+
+        _, self.capacity, _, _, self.epoch, self.owner = RING_HEADER.unpack_from(
+            self.shm.buf, 0
+        )
+        if not create and not self.live:
+            self.shm.close()
+            raise OSError(f"Shared memory ring {name} has no receiver")
+        start = RING_HEADER.size
+        self.data = self.shm.buf[start:]
+        self._lock_file = None
+
+    @staticmethod
+    def lock_path(name: str) -> str:
+        return os.path.join(tempfile.gettempdir(), f"{name}.lock")
+
+    def _position(self, offset: int) -> int:
+        return POSITION.unpack_from(self.shm.buf, offset)[0]
+
+    @property
+    def live(self) -> bool:
+        """Whether the receiver which created the ring still reads it."""
+        if (
+            self._position(RING_EPOCH_OFFSET) != self.epoch
+            or self.epoch == RING_RETIRED
+        ):
+            return False
+        try:
+            os.kill(self.owner, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            # Owned by another user, but running
+            pass
+        return True
+
+    def write(self, payload: bytes) -> None:
+        """Appends the payload, raises ``RingFull`` if there is no room for it.
+
+        Raises ``OSError`` when the receiver closed or replaced the ring.
+        """
+        import fcntl
+
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path(self.name), "a")
+
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            if self._position(RING_EPOCH_OFFSET) != self.epoch:
+                raise OSError(
+                    f"Shared memory ring {self.name} was closed by the receiver"
+                )
+            head = self._position(RING_HEAD_OFFSET)
+            tail = self._position(RING_TAIL_OFFSET)
+            if len(payload) > self.capacity - (head - tail):
+                raise RingFull(f"{len(payload)} bytes don't fit in the ring")
+
+            start = head % self.capacity
+            first = min(len(payload), self.capacity - start)
+            end = start + first
+            self.data[start:end] = payload[:first]
+            if first < len(payload):
+                rest = len(payload) - first
+                self.data[:rest] = payload[first:]
+            # Published last, the reader never sees a partially written frame
+            POSITION.pack_into(self.shm.buf, RING_HEAD_OFFSET, head + len(payload))
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def read(self, max_size: int = 1024 * 1024) -> bytes:
+        """Takes up to ``max_size`` of the written bytes, only used by the receiver."""
+        head = self._position(RING_HEAD_OFFSET)
+        tail = self._position(RING_TAIL_OFFSET)
+        size = min(head - tail, max_size)
+        if size <= 0:
+            return b""
+
+        start = tail % self.capacity
+        first = min(size, self.capacity - start)
+        end = start + first
+        data = bytes(self.data[start:end])
+        if first < size:
+            data += bytes(self.data[: size - first])
+        POSITION.pack_into(self.shm.buf, RING_TAIL_OFFSET, tail + size)
+        return data
+
+    def skip(self) -> None:
+        """Drops everything written so far, after a corrupted frame."""
+        head = self._position(RING_HEAD_OFFSET)
+        POSITION.pack_into(self.shm.buf, RING_TAIL_OFFSET, head)
+
+    def close(self) -> None:
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        if self.created:
+            # Tells the agents still attached to the ring to move on
+            POSITION.pack_into(self.shm.buf, RING_EPOCH_OFFSET, RING_RETIRED)
+        self.data.release()
+        self.shm.close()
+        if self.created:
+            self.shm.unlink()
+
+
+def _attach(name: str):
+    """Attaches to an existing block without letting this process destroy it.
+
+    Before Python 3.13 the resource tracker unlinks every block a process used
+    when it exits, even the ones it didn't create.
+    """
+    from multiprocessing import resource_tracker, shared_memory
+
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class Transport:
+    """A connection to the receiver, ``send`` takes whole protocol frames."""
+
+    def send(self, payload: bytes) -> None:
+        raise NotImplementedError()
+
+    def close(self) -> None:
+        raise NotImplementedError()
+
+
+class SocketTransport(Transport):
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.sock.sendall(protocol.PREAMBLE)
+
+    def send(self, payload: bytes) -> None:
+        self.sock.sendall(payload)
+
+    def close(self) -> None:
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class SharedMemoryTransport(Transport):
+    def __init__(self, ring: SharedMemoryRing):
+        self.ring = ring
+
+    def send(self, payload: bytes) -> None:
+        self.ring.write(payload)
+
+    def close(self) -> None:
+        self.ring.close()
+
+
+def connect(
+    address: Address, fallback: Optional[Address] = None, timeout: float = 5
+) -> Transport:
+    """Opens a transport to the receiver, raises ``OSError`` if it can't.
+
+    ``shm://`` addresses fall back to the ``fallback`` TCP address when the
+    ring doesn't exist, e.g. because the receiver runs on another host.
+    """
+    if address.scheme == SHM:
+        try:
+            return SharedMemoryTransport(SharedMemoryRing(address.path))
+        except (OSError, ImportError) as e:
+            if fallback is None:
+                raise OSError(f"Shared memory ring {address.path} unavailable: {e}")
+            logger.info(f"Shared memory ring unavailable ({e}), using {fallback}")
+            address = fallback
+
+    if address.scheme == UNIX:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(address.path)
+        except OSError:
+            sock.close()
+            raise
+    else:
+        sock = socket.create_connection((address.host, address.port), timeout=timeout)
+    return SocketTransport(sock)
@@ -1,36 +1,75 @@
-import json
+import asyncio
 import os
+import queue
+import time
 from multiprocessing import Queue
+from typing import Dict, List, Optional, Tuple, Union
 
 from textual import work
 from textual.app import App, ComposeResult
+from textual.binding import Binding
 from textual.containers import Container
 from textual.reactive import reactive
-from textual.widgets import Footer, ListView
+from textual.widgets import Footer, Input, TabbedContent
 
+from fastapi_xray.codec import codec_for
 from fastapi_xray.commons.logger import get_logger
+from fastapi_xray.export import writer_for
+from fastapi_xray.pool import capacity, pressure
 from fastapi_xray.schemas import APIRequest
+from fastapi_xray.server.workers import WORKER_STATS
+from fastapi_xray.stats import StatsEngine
+from fastapi_xray.storage import CaptureStore
 from fastapi_xray.ui.components.panels import LeftPanel, RightPanel
-from fastapi_xray.ui.components.widgets.list import LabelItem
-from fastapi_xray.ui.components.widgets.text import TextBox
+from fastapi_xray.ui.components.widgets.list import RequestList
+from fastapi_xray.ui.components.widgets.stats import StatsView
+from fastapi_xray.ui.components.widgets.text import StatusBar, TextBox
+from fastapi_xray.ui.query import Query, QueryError
+from fastapi_xray.ui.store import RecordedRequestStore, RequestStore
 
 logger = get_logger()
 
+# Max number of events taken from the queue on each refresh
+INGEST_BUDGET = int(os.environ.get("XRAY_INGEST_BUDGET", 1000))
+# Number of requests exported between two frames
+EXPORT_BATCH = 500
+# Seconds after which the pool state shown is flagged as old
+POOL_STALE = 5.0
+
 
 class MainApp(App):
     """FastAPI debug app."""
 
     selected_request = reactive(None)
 
-    def __init__(self, queue: Queue, **kwargs):
+    def __init__(
+        self,
+        queue: Optional[Queue],
+        store: Optional[Union[RequestStore, RecordedRequestStore]] = None,
+        **kwargs,
+    ):
+        """Shows the requests received through ``queue``, or the recorded session
+        of a ``RecordedRequestStore`` when ``queue`` is None."""
         super().__init__(**kwargs)
         self.queue = queue
-        self.requests = {}
+        self.store = store if store is not None else RequestStore()
+        self.polling = False
+        # Statistics of the requests received since the UI started, by route
+        self.stats = StatsEngine()
+        # Latest snapshot of the workers sent by the receiver, busiest first
+        self.worker_stats: List[Dict] = []
 
     CSS_PATH = "main.css"
     BINDINGS = [
         ("r", "refresh", "Refresh"),
         ("c", "clear_all", "Clear All"),
+        ("p", "toggle_pin", "Pin"),
+        ("w", "cycle_worker", "Worker"),
+        ("s", "cycle_stats_sort", "Sort Stats"),
+        ("/", "focus_filter", "Filter"),
+        Binding("escape", "focus_list", "Requests", show=False),
+        ("e", "export('ndjson')", "Export NDJSON"),
+        ("h", "export('har')", "Export HAR"),
     ]
 
     def compose(self) -> ComposeResult:
@@ -39,72 +78,310 @@ class MainApp(App):
             TextBox("", "[b]✘ FastAPI X-Ray ✘[/]", False, "center"),
             id="app_title",
         )
-        yield LeftPanel()
-        yield RightPanel()
+        yield LeftPanel(self.store)
+        yield RightPanel(self.stats)
 
-        yield Footer()
+        yield Container(
+            StatusBar(id="status_bar"),
+            Footer(),
+            id="bottom_bar",
+        )
 
     def on_mount(self) -> None:
+        # The single key bindings would be typed into the filter bar otherwise
+        self.query_one(RequestList).focus()
+        self.list_requests()
+        self.show_store_status()
+        if self.queue is None:
+            return
         self.set_interval(
-            interval=os.environ.get("REFRESH_INTERVAL", 1), callback=self.action_refresh
+            interval=float(os.environ.get("REFRESH_INTERVAL", 1)),
+            callback=self.action_refresh,
         )
 
     async def action_refresh(self):
-        self.poll()
+        if self.queue is None:
+            # Picks up what was recorded since, if the session is still running
+            self.store.reload()
+            self.list_requests()
+            self.show_store_status()
+            return
+
+        # A slow frame must not be cancelled by the next tick, it would lose events
+        if not self.polling:
+            self.polling = True
+            self.poll()
 
     async def action_clear_all(self):
         """An action to clear all requests."""
-        await self.query_one("#left_panel_list_view").clear()
+        if isinstance(self.store, RecordedRequestStore):
+            self.query_one(StatusBar).set_section(
+                "ingest", "Recorded sessions are read only"
+            )
+            return
         self.query_one(RightPanel).selected_request = None
-        self.requests = {}
+        self.store.clear()
+        self.stats.clear()
+        self.list_requests()
+        self.refresh_stats()
+        self.show_overhead()
+        self.show_store_status()
+
+    def action_toggle_pin(self):
+        """An action to pin the highlighted request so it is never evicted."""
+        request_list = self.query_one(RequestList)
+        if request_list.highlighted_id is None:
+            return
+        self.store.toggle_pin(request_list.highlighted_id)
+        request_list.refresh()
+        self.show_store_status()
+
+    def action_cycle_worker(self):
+        """An action to only list the requests of the next worker, then of all."""
+        workers = self.store.workers()
+        if not workers:
+            self.query_one(StatusBar).set_section("workers", "No worker to filter on")
+            return
 
-    def on_list_view_selected(self, event: ListView.Selected):
-        request = self.requests.get(event.item.value)
+        choices = [None, *workers]
+        current = (
+            choices.index(self.store.worker) if self.store.worker in choices else 0
+        )
+        self.store.worker = choices[(current + 1) % len(choices)]
+        self.list_requests()
+        self.show_workers()
+
+    def action_focus_filter(self):
+        """An action to type a filter, see ``fastapi_xray.ui.query`` for the syntax."""
+        self.query_one("#filter_bar", Input).focus()
+
+    def action_focus_list(self):
+        """An action to leave the filter bar for the list of requests."""
+        self.query_one(RequestList).focus()
+
+    def on_input_submitted(self, event: Input.Submitted):
+        if event.input.id != "filter_bar":
+            return
+        if isinstance(self.store, RecordedRequestStore):
+            self.query_one(StatusBar).set_section(
+                "filter", "Recorded sessions can't be filtered"
+            )
+            return
+        try:
+            self.store.query = Query.parse(event.value)
+        except QueryError as e:
+            self.query_one(StatusBar).set_section("filter", f"Invalid filter: {e}")
+            return
+        self.list_requests()
+        self.query_one(RequestList).focus()
+
+    def list_requests(self):
+        """Lists the requests of the store matching the filters."""
+        rows = self.store.rows()
+        self.query_one(RequestList).set_rows(rows)
+        text = ""
+        if self.store.query:
+            text = f"Filter: {len(rows)} of {len(self.store)} requests"
+        self.query_one(StatusBar).set_section("filter", text)
+
+    def action_export(self, format: str):
+        """An action to export the listed requests, oldest first, to the current directory."""
+        path = f"xray-{time.strftime('%Y%m%d-%H%M%S')}.{format}"
+        self.export(self.store.rows(), path, format)
+
+    @work(exclusive=True, group="export")
+    async def export(self, rows, path: str, format: str):
+        """Writes the requests a batch per frame, so the UI stays responsive."""
+        status = self.query_one(StatusBar)
+        try:
+            with open(path, "w", encoding="utf-8") as output:
+                writer = writer_for(output, format)
+                for index in range(len(rows) - 1, -1, -1):
+                    event = self.store.event(rows[index])
+                    if event is not None:
+                        writer.write(event)
+                    if writer.count % EXPORT_BATCH == 0:
+                        status.set_section(
+                            "export", f"Exporting: {writer.count}/{len(rows)}"
+                        )
+                        await asyncio.sleep(0)
+                writer.close()
+        except Exception as e:
+            logger.error(f"Export to {path} failed: {e}")
+            status.set_section("export", f"Export failed: {e}")
+            return
+        status.set_section("export", f"Exported {writer.count} requests to {path}")
+
+    def action_cycle_stats_sort(self):
+        """An action to sort the STATS tab by the next column."""
+        sort = self.query_one(StatsView).cycle_sort()
+        self.query_one(StatusBar).set_section("stats", f"Stats sorted by {sort}")
+
+    def refresh_stats(self):
+        # Only rendered when visible, the table is built from every route
+        if self.query_one(TabbedContent).active == "stats":
+            self.query_one(StatsView).refresh_stats()
+
+    def on_request_list_selected(self, event: RequestList.Selected):
+        request = self.store.get(event.request_id)
+        if request is None:
+            return
         self.query_one(RightPanel).selected_request = request
         logger.info(
             f"Selected request: <{request.request_id}> {request.request.method} {request.request.path}"
         )
 
-    async def add_new_request(self, new_request: APIRequest):
-        widget = self.query_one("#left_panel_list_view")
-        request = new_request.request
-        logger.info(
-            f"New request added: <{new_request.request_id}> {request.method} {request.path}"
-        )
-        widget.prepend(
-            LabelItem(
-                label=f"{len(self.requests) + 1}. [b][{request.method}][/] {request.path}",
-                value=str(new_request.request_id),
-                classes="request_item",
-            )
-        )
+    async def add_new_requests(self, new_requests: List[Tuple[APIRequest, int]]):
+        """Adds the requests to the store and refreshes the list once.
 
-        self.requests[new_request.request_id] = new_request
+        Requests evicted from the store to make room disappear from the list.
+        """
+        evicted = 0
+        for new_request, size in new_requests:
+            evicted += len(self.store.add(new_request, size))
+        self.stats.record_all(new_request for new_request, _ in new_requests)
+        self.refresh_stats()
+        self.show_overhead()
+
+        logger.info(f"{len(new_requests)} new requests added, {evicted} evicted")
+        self.list_requests()
+        self.show_store_status()
 
     @work(exclusive=True)
     async def poll(self):
-        import queue
+        """Drains the queue, up to INGEST_BUDGET events per refresh."""
+        try:
+            backlog = await self.ingest()
+        finally:
+            self.polling = False
+
+        if backlog:
+            # Catch up without waiting for the next tick, but let input through
+            self.set_timer(0.05, self.action_refresh)
+
+    async def ingest(self) -> bool:
+        """Ingests one frame worth of events, returns whether the budget ran out."""
+        new_requests = []
+        taken = 0
+        oldest = None
+
+        for _ in range(INGEST_BUDGET):
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if item[0] == WORKER_STATS:
+                self.worker_stats = item[1]
+                self.show_workers()
+                self.show_pool()
+                continue
+            received_at, codec_id, payload = item
+
+            taken += 1
+            if oldest is None:
+                oldest = received_at
+
+            try:
+                event = codec_for(codec_id).decode(payload)
+            except Exception as e:
+                logger.error(f"Received data could not be decoded: {e}")
+                continue
+
+            try:
+                api_request = APIRequest.from_event(event)
+            except Exception as e:
+                # handle any other exceptions
+                logger.error(f"Error while polling queue: {e}")
+                continue
+
+            new_requests.append((api_request, len(payload)))
+
+        self.show_ingest_lag(oldest)
+
+        if new_requests:
+            await self.add_new_requests(new_requests)
+
+        return taken == INGEST_BUDGET
 
+    def show_ingest_lag(self, oldest: float = None):
+        """Shows how far the UI is behind the receiver."""
         try:
-            result = self.queue.get_nowait()
-            if not result:
-                return
-
-            result = json.loads(result)
-            api_request = APIRequest(**result)
-            await self.add_new_request(api_request)
-
-        except queue.Empty:
-            # handle case where the queue is empty
-            pass
-        except json.JSONDecodeError:
-            # handle case where the received data is not valid JSON
-            logger.error("Received data is not valid JSON")
-        except Exception as e:
-            # handle any other exceptions
-            logger.error(f"Error while polling queue: {e}")
+            depth = self.queue.qsize()
+        except NotImplementedError:
+            # qsize is not available on macOS
+            depth = "?"
+
+        lag = time.time() - oldest if oldest is not None else 0.0
+        self.query_one(StatusBar).set_section(
+            "ingest", f"Ingest lag: {depth} queued, oldest {lag:.1f}s"
+        )
+
+    def show_overhead(self):
+        """Shows what X-Ray costs the requests it captures, on average."""
+        text = ""
+        if self.stats.timed:
+            mean, share = self.stats.overhead()
+            text = f"X-Ray overhead: {mean:.3f} ms/request ({share:.1f}%)"
+        self.query_one(StatusBar).set_section("overhead", text)
+
+    def show_workers(self):
+        """Shows how many workers send requests and which one is the busiest."""
+        text = ""
+        if self.worker_stats:
+            hot = self.worker_stats[0]
+            lost = sum(worker["lost"] for worker in self.worker_stats)
+            text = (
+                f"Workers: {len(self.worker_stats)}, hot {hot['id']} {hot['rate']:.1f}/s, "
+                f"{lost} lost"
+            )
+        if self.store.worker is not None:
+            text += f"{', ' if text else ''}showing {self.store.worker}"
+        self.query_one(StatusBar).set_section("workers", text)
+
+    def show_pool(self):
+        """Shows the connection pool closest to exhaustion, of all the workers."""
+        workers = [worker for worker in self.worker_stats if worker.get("pool")]
+        text = ""
+        if workers:
+            worker = max(workers, key=lambda worker: pressure(worker["pool"]))
+            pool = worker["pool"]
+            limit = capacity(pool)
+            in_use = f"{pool['checked_out']}/{limit}" if limit else pool["checked_out"]
+            text = f"Pool: {in_use} in use"
+            if pool["waiting"]:
+                text += f", {pool['waiting']} waiting"
+            if pool.get("timed") is False:
+                text += ", waits not timed"
+            if len(self.worker_stats) > 1:
+                text += f" ({worker['id']})"
+            age = time.time() - worker["last_seen"]
+            if age >= POOL_STALE:
+                # The worker sends its state every second, it may be gone
+                text += f", {age:.0f}s ago"
+        self.query_one(StatusBar).set_section("pool", text)
+
+    def show_store_status(self):
+        store = self.store
+        self.query_one(StatusBar).set_section(
+            "store",
+            f"Stored: {len(store)} requests, {store.size_bytes / 1024 / 1024:.1f} MB, "
+            f"{len(store.pinned)} pinned, {store.evictions} evicted",
+        )
+
+
+def render_ui(
+    shared_queue: Queue,
+    max_requests: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+):
+    store = RequestStore(max_requests=max_requests, max_bytes=max_bytes)
+    app = MainApp(watch_css=True, queue=shared_queue, store=store)
+    app.run()
 
 
-def render_ui(shared_queue: Queue):
-    app = MainApp(watch_css=True, queue=shared_queue)
+def render_recording(directory: str):
+    """Browses a session recorded with ``fastapi_xray run --store``."""
+    store = RecordedRequestStore(CaptureStore(directory, readonly=True))
+    app = MainApp(watch_css=True, queue=None, store=store)
     app.run()
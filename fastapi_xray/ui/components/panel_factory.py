@@ -1,14 +1,30 @@
 import json
+import os
 from abc import ABC, abstractmethod
+from typing import List
 
 from rich.align import Align
+from rich.console import Group
 from rich.layout import Layout
 from rich.panel import Panel
 from rich.syntax import Syntax
+from rich.table import Table
+from rich.text import Text
 
-from fastapi_xray.schemas import APIRequest
+from fastapi_xray.schemas import APIRequest, SQlQuery, Timings
+from fastapi_xray.sql import group_queries
 from fastapi_xray.ui.components.widgets.panels import SyntaxPanel
 
+# Number of times the same query must run in a request to be flagged as N+1
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("XRAY_N_PLUS_ONE_THRESHOLD", 10))
+
+# Width of the bars of the timings waterfall
+WATERFALL_WIDTH = 40
+APP_STYLE = "#a3be8c"
+XRAY_STYLE = "#d08770"
+# Time spent waiting for a connection of the pool
+POOL_STYLE = "#bf616a"
+
 
 class PanelFactory(ABC):
     @abstractmethod
@@ -53,12 +69,14 @@ class RequestDetailsPanelFactory(PanelFactory):
             Layout(name="right", ratio=1),
         )
 
+        worker = selected_request.worker
         layout["left"].update(
             f"[b]{request.status_code}[/]\t[b]{request.method}[/]\t"
             f"[b]{request.path}[/]"
+            + (f"\t[dim]{worker.id}[/]" if worker is not None else "")
         )
         layout["right"].update(
-            Align.right(f"[b] ⏱️ {selected_request.elapsed_time} ms[/]")
+            Align.right(f"[b] ⏱️ {selected_request.elapsed_time:.4f} ms[/]")
         )
 
         return layout
@@ -78,6 +96,95 @@ class RequestDetailsPanelFactory(PanelFactory):
         )
 
 
+class TimingsPanelFactory(PanelFactory):
+    """A waterfall of the phases of the request, X-Ray's own ones included."""
+
+    def parse_data(self, selected_request: APIRequest) -> List[tuple]:
+        """``(label, start, duration, style)`` of the phases, in nanoseconds."""
+        timings = selected_request.timings
+        phases = []
+        start = 0
+        for label, duration, style in (
+            ("setup", timings.setup, XRAY_STYLE),
+            ("request body", timings.body, XRAY_STYLE),
+            ("handler", timings.handler, APP_STYLE),
+            ("sql capture", timings.sql_capture, XRAY_STYLE),
+            ("response", timings.response, XRAY_STYLE),
+            ("build event", timings.build, XRAY_STYLE),
+        ):
+            phases.append((label, start, duration, style))
+            if label == "handler" and timings.sql_count:
+                # Ran within the handler, from its start for lack of a better guess
+                queries = f"└ sql ({timings.sql_count} queries)"
+                phases.append((queries, start, timings.sql, APP_STYLE))
+            if label == "handler" and timings.pool_checkouts:
+                checkouts = f"└ pool wait ({timings.pool_checkouts} checkouts)"
+                phases.append((checkouts, start, timings.pool_wait, POOL_STYLE))
+            start += duration
+
+        worker = selected_request.worker
+        if worker is not None and worker.overhead:
+            # Means of the worker, the last two run in its shipper thread
+            overhead = worker.overhead
+            for label in ("enqueue", "encode", "send"):
+                phases.append((f"{label} (mean)", start, overhead[label], XRAY_STYLE))
+                start += overhead[label]
+        return phases
+
+    def create_panel(self, selected_request: APIRequest):
+        if not selected_request or selected_request.timings is None:
+            return Panel(
+                Align.center("No timings, the agent predates them"),
+                title="Timings",
+                title_align="left",
+                border_style="white",
+            )
+
+        phases = self.parse_data(selected_request)
+        span = max(start + duration for _, start, duration, _ in phases) or 1
+        scale = WATERFALL_WIDTH / span
+
+        table = Table(box=None, show_header=False, expand=True, padding=(0, 1))
+        table.add_column("phase", no_wrap=True)
+        table.add_column("bar", width=WATERFALL_WIDTH, no_wrap=True)
+        table.add_column("ms", justify="right", no_wrap=True)
+        for label, start, duration, style in phases:
+            offset = min(int(start * scale), WATERFALL_WIDTH - 1)
+            length = max(1, round(duration * scale)) if duration else 0
+            bar = Text(" " * offset)
+            bar.append("█" * min(length, WATERFALL_WIDTH - offset), style=style)
+            table.add_row(label, bar, f"{duration / 1e6:.3f}")
+
+        timings = selected_request.timings
+        content = table
+        if timings.pool_checkouts:
+            content = Group(table, Text(self.pool_summary(timings), style="dim"))
+        overhead = timings.overhead / 1e6
+        share = (
+            overhead / selected_request.elapsed_time * 100
+            if selected_request.elapsed_time
+            else 0
+        )
+        return Panel(
+            content,
+            title=f"Timings, X-Ray overhead {overhead:.3f} ms ({share:.1f}% of the request)",
+            title_align="left",
+            border_style="white",
+        )
+
+    @staticmethod
+    def pool_summary(timings: Timings) -> str:
+        """How the request used the connection pool."""
+        summary = (
+            f"Connections: {timings.pool_checkouts} checked out, "
+            f"{timings.pool_connects} opened, held {timings.pool_hold / 1e6:.3f} ms, "
+            f"at most {timings.pool_peak} at once"
+        )
+        if timings.pool_held:
+            summary += f", {timings.pool_held} not returned by the end of the request"
+        return summary
+
+
 class RequestBodyPanelFactory(PanelFactory):
     def parse_data(self, selected_request: APIRequest):
         if not selected_request or selected_request.request.body is None:
@@ -114,27 +221,48 @@ class CookiesPanelFactory(PanelFactory):
         )
 
 
-class ResponseErrorPanelFactory(PanelFactory):
-    _lexer_type = "txt"
+class ResponseBodyPanelFactory(PanelFactory):
+    _lexer_type = "json"
+    _title = "Body"
 
     def parse_data(self, selected_request: APIRequest):
-        if not selected_request or selected_request.response.error is None:
+        self._lexer_type = "json"
+        self._title = "Body"
+        if not selected_request:
             return ""
 
         response = selected_request.response
-        error_msg = response.error.message
-        self._lexer_type = response.error.lexer_type
+        if selected_request.request.status_code >= 400:
+            self._title = "Error"
+
+        body = response.body
+        if body is None and response.error is not None:
+            body = response.error.message
+        if body is None:
+            return ""
 
-        if isinstance(error_msg, dict) or isinstance(error_msg, list):
-            return json.dumps(error_msg, indent=2)
+        if response.size is not None:
+            self._title += f" ({response.size} bytes"
+            if response.time_to_first_byte is not None:
+                self._title += (
+                    f", first byte after {response.time_to_first_byte:.4f} ms"
+                )
+            self._title += ")"
 
-        return error_msg
+        if not isinstance(body, str):
+            return json.dumps(body, indent=2)
+
+        try:
+            json.loads(body)
+        except ValueError:
+            self._lexer_type = "txt"
+        return body
 
     def create_panel(self, selected_request: APIRequest):
         return SyntaxPanel(
             code=self.parse_data(selected_request),
             lexer=self._lexer_type,
-            title="Error",
+            title=self._title,
         )
 
 
@@ -146,14 +274,40 @@ class SQLPanelFactory(PanelFactory):
         sql_queries = selected_request.sql
 
         statements = f"-- Total {len(sql_queries)} SQL queries ran \n\n"
+        statements += self.parse_groups(sql_queries)
         for idx, sql in enumerate(sql_queries, 1):
-            statements += f"-- [{idx}] Took {sql.execution_time} ms\n"
-            statements += f"{sql.statement}"
+            statements += f"-- [{idx}] Took {sql.execution_time:.4f} ms\n"
+            if sql.executemany:
+                statements += (
+                    f"-- executemany over {sql.row_count} rows, first one shown\n"
+                )
+            statements += f"{sql.rendered_statement}"
 
             if idx < len(sql_queries):
                 statements += "\n\n"
 
         return statements
 
+    def parse_groups(self, sql_queries: List[SQlQuery]) -> str:
+        """The queries grouped by fingerprint, slowest first, with N+1 warnings."""
+        groups = group_queries(sql_queries)
+
+        lines = []
+        for group in groups:
+            if group.count >= N_PLUS_ONE_THRESHOLD:
+                lines.append(f"-- ⚠ Likely N+1: {group.count} x {group.fingerprint}")
+        if lines:
+            lines.append("--")
+
+        lines.append(
+            f"-- {'count':>7} {'total ms':>10} {'mean ms':>10} {'max ms':>10}  statement"
+        )
+        for group in groups:
+            lines.append(
+                f"-- {group.count:>7} {group.total_time:>10.3f} {group.mean_time:>10.3f} "
+                f"{group.max_time:>10.3f}  {group.fingerprint}"
+            )
+        return "\n".join(lines) + "\n\n"
+
     def create_panel(self, selected_request):
         return Syntax(self.parse_data(selected_request), "sql", padding=2)
@@ -1,11 +1,15 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
 from rich.console import RenderableType
 from textual.app import ComposeResult
 from textual.containers import Container
 from textual.reactive import Reactive
 from textual.widget import Widget
-from textual.widgets import TabbedContent, TabPane
+from textual.widgets import Input, TabbedContent, TabPane
 
 from fastapi_xray.schemas import APIRequest
+from fastapi_xray.stats import StatsEngine
 from fastapi_xray.ui.components.panel_factory import (
     CookiesPanelFactory,
     HeadersPanelFactory,
@@ -13,54 +17,46 @@ from fastapi_xray.ui.components.panel_factory import (
     QueryParamsPanelFactory,
     RequestBodyPanelFactory,
     RequestDetailsPanelFactory,
-    ResponseErrorPanelFactory,
+    ResponseBodyPanelFactory,
     ResponseHeadersPanelFactory,
     SQLPanelFactory,
+    TimingsPanelFactory,
 )
 from fastapi_xray.ui.components.widgets import WrapperWidget
-from fastapi_xray.ui.components.widgets.list import ListItems
+from fastapi_xray.ui.components.widgets.list import RequestList
+from fastapi_xray.ui.components.widgets.stats import StatsView
+from fastapi_xray.ui.store import RequestStore
 
+# Number of rendered tabs kept around, so revisiting a request is instant
+PANEL_CACHE_SIZE = 32
 
-class LeftPanel(Widget):
-    DEFAULT_CSS = """
-        ListItem {
-            color: $text;
-            height: auto;
-            background: #5f6062;
-            overflow: hidden hidden;
-        }
-        ListItem > Widget :hover {
-            background: #5f6062;
-        }
-        ListView > ListItem.--highlight {
-            background: #7b7263 50%;
-        }
-        ListView:focus > ListItem.--highlight {
-            background: #7b7263;
-        }
-        ListItem > Widget {
-            height: auto;
-        }
-        """
 
-    def __init__(self, **kwargs):
+class LeftPanel(Widget):
+    def __init__(self, store: RequestStore, **kwargs):
         super().__init__(**kwargs)
+        self.store = store
 
     def compose(self) -> ComposeResult:
         with Container(id="left_panel"):
-            yield ListItems()
+            yield Input(
+                placeholder="/ to filter: GET status:5xx elapsed:>100",
+                id="filter_bar",
+            )
+            yield RequestList(self.store)
 
 
 class RightPanel(Widget):
     selected_request: Reactive[RenderableType] = Reactive(None)
 
-    def __init__(self, **kwargs):
+    def __init__(self, stats: StatsEngine, **kwargs):
         super().__init__(**kwargs)
+        self.stats = stats
 
         # initialize the factories
         self.tabs = {
             "request": [
                 RequestDetailsPanelFactory(),
+                TimingsPanelFactory(),
                 RequestBodyPanelFactory(),
                 QueryParamsPanelFactory(),
                 HeadersPanelFactory(),
@@ -68,30 +64,70 @@ class RightPanel(Widget):
             ],
             "response": [
                 ResponseHeadersPanelFactory(),
-                ResponseErrorPanelFactory(),
+                ResponseBodyPanelFactory(),
             ],
             "sql": [
                 SQLPanelFactory(),
             ],
         }
 
+        # Panels are only rendered for the active tab, and cached per request
+        self.cache: "OrderedDict[Tuple[str, str], List[RenderableType]]" = OrderedDict()
+        # The request each tab currently displays
+        self.rendered: Dict[str, Optional[str]] = {}
+
     def create_panel(self, data: APIRequest, factory: PanelFactory) -> RenderableType:
         return factory.create_panel(data)
 
+    def render_panels(self, tab_name: str) -> List[RenderableType]:
+        selected_request = self.selected_request
+        factories = self.tabs[tab_name]
+        if selected_request is None:
+            return [self.create_panel(None, factory) for factory in factories]
+
+        key = (selected_request.request_id, tab_name)
+        panels = self.cache.get(key)
+        if panels is None:
+            panels = [
+                self.create_panel(selected_request, factory) for factory in factories
+            ]
+            self.cache[key] = panels
+            if len(self.cache) > PANEL_CACHE_SIZE:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(key)
+        return panels
+
+    def show_tab(self, tab_name: str) -> None:
+        if tab_name == "stats":
+            # Not about the selected request, refreshed as requests come in
+            self.query_one(StatsView).refresh_stats()
+            return
+
+        request_id = getattr(self.selected_request, "request_id", None)
+        if tab_name in self.rendered and self.rendered[tab_name] == request_id:
+            return
+
+        panels = self.render_panels(tab_name)
+        for factory, panel in zip(self.tabs[tab_name], panels):
+            self.query_one(f"#{factory.id}").update(panel)
+        self.rendered[tab_name] = request_id
+
     def watch_selected_request(self, selected_request: APIRequest) -> None:
-        for _, factories in self.tabs.items():
-            for factory in factories:
-                self.query_one(f"#{factory.id}").update(
-                    self.create_panel(selected_request, factory)
-                )
+        self.show_tab(self.query_one(TabbedContent).active)
+
+    def on_tabbed_content_tab_activated(self, event: TabbedContent.TabActivated):
+        self.show_tab(event.tab.id)
 
     def compose(self) -> ComposeResult:
         with Container(id="right_panel"):
             with TabbedContent():
                 for tab_name, factories in self.tabs.items():
-                    with TabPane(tab_name.upper()):
+                    with TabPane(tab_name.upper(), id=tab_name):
                         for factory in factories:
                             yield WrapperWidget(
                                 self.create_panel(self.selected_request, factory),
                                 id=f"{factory.id}",
                             )
+                with TabPane("STATS", id="stats"):
+                    yield StatsView(self.stats, id="stats_view")
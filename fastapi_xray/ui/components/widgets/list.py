@@ -1,57 +1,189 @@
-from textual.app import ComposeResult
-from textual.widget import AwaitMount
-from textual.widgets import Label, ListItem, ListView
+from typing import Iterable, Optional, Sequence
+
+from rich.markup import escape
+from rich.text import Text
+from textual.binding import Binding
+from textual.events import Click
+from textual.geometry import Size
+from textual.message import Message
+from textual.reactive import reactive
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
 
 from fastapi_xray.commons.logger import get_logger
+from fastapi_xray.ui.store import RequestStore
 
 logger = get_logger()
 
 
-class LabelItem(ListItem):
+class RequestList(ScrollView, can_focus=True):
+    """A virtualized list of the captured requests, newest first.
+
+    Only the visible rows are rendered, straight from the request store, so the
+    cost of a refresh doesn't depend on how many requests are captured.
+    """
+
     DEFAULT_CSS = """
-        ListItem {
+        RequestList {
+            background: #555358;
             color: $text;
-            height: auto;
-            background: #68625d;
-            overflow: hidden hidden;
-        }
-        ListItem > Widget :hover {
-            background: $boost;
+            scrollbar-size: 1 1;
+            scrollbar-color: #d08770;
+            scrollbar-color-active: #d08770;
+            scrollbar-color-hover: #d08770;
         }
-        ListView > ListItem.--highlight {
+        RequestList > .request-list--highlight {
             background: #7b7263 50%;
         }
-        ListView:focus > ListItem.--highlight {
-            background: #5f6062;
-        }
-        ListItem > Widget {
-            height: auto;
+        RequestList:focus > .request-list--highlight {
+            background: #7b7263;
         }
         """
 
-    def __init__(self, label: str, value: str, **kwargs) -> None:
-        super().__init__(**kwargs)
-        self.label = label
-        self.value = value
+    COMPONENT_CLASSES = {"request-list--highlight"}
+
+    BINDINGS = [
+        Binding("enter", "select_cursor", "Select", show=False),
+        Binding("up", "cursor_up", "Cursor Up", show=False),
+        Binding("down", "cursor_down", "Cursor Down", show=False),
+        Binding("pageup", "page_up", "Page Up", show=False),
+        Binding("pagedown", "page_down", "Page Down", show=False),
+        Binding("home", "first", "First", show=False),
+        Binding("end", "last", "Last", show=False),
+    ]
+
+    index = reactive[Optional[int]](None, always_update=True)
 
-    def compose(self) -> ComposeResult:
-        yield Label(self.label, classes="left_panel_label")
+    class Selected(Message, bubble=True):
+        """Posted when a request is selected with the enter key or a click."""
 
+        def __init__(self, request_id: str) -> None:
+            super().__init__()
+            self.request_id = request_id
 
-class ListItems(ListView):
-    def __init__(self, **kwargs):
+    def __init__(self, store: RequestStore, **kwargs):
         super().__init__(id="left_panel_list_view", **kwargs)
+        self.store = store
+        self.rows: Sequence[str] = []
 
-    def prepend(self, item: ListItem) -> AwaitMount:
-        """Prepend a new ListItem to the start of the ListView.
+    @property
+    def highlighted_id(self) -> Optional[str]:
+        if self.index is None or not 0 <= self.index < len(self.rows):
+            return None
+        return self.rows[self.index]
 
-        Args:
-            item: The ListItem to prepend.
+    def set_rows(self, rows: Iterable[str]) -> None:
+        """Replaces the displayed request ids.
 
-        Returns:
-            An awaitable that yields control to the event loop
-                until the DOM has been updated with the new child item.
+        The highlighted request and the first visible row stay the same when new
+        rows arrive at the top. When the first row is highlighted, the list
+        follows the newest request instead.
         """
-        await_mount = self.mount(item, before=0)
-        # self.index = 0
-        return await_mount
+        follow = not self.index and self.scroll_offset.y == 0
+        highlighted = None if follow else self.highlighted_id
+        first_visible = None
+        if self.scroll_offset.y > 0 and self.scroll_offset.y < len(self.rows):
+            first_visible = self.rows[self.scroll_offset.y]
+
+        # The stores give views of their rows, which must not be copied
+        self.rows = rows if isinstance(rows, Sequence) else list(rows)
+        self.virtual_size = Size(self.size.width, len(self.rows))
+
+        if highlighted is not None:
+            self.index = self._find(highlighted, self.index)
+        elif self.index is None and self.rows:
+            self.index = 0
+
+        if first_visible is not None:
+            top = self._find(first_visible, self.scroll_offset.y)
+            if top is not None:
+                self.scroll_to(y=top, animate=False)
+
+        self.refresh()
+
+    def _find(self, request_id: str, default: Optional[int]) -> Optional[int]:
+        """The index of the row of a request, the views of the stores find it without a scan."""
+        try:
+            return self.rows.index(request_id)
+        except ValueError:
+            if default is None or not self.rows:
+                return None
+            return min(default, len(self.rows) - 1)
+
+    def render_line(self, y: int) -> Strip:
+        scroll_x, scroll_y = self.scroll_offset
+        index = scroll_y + y
+        width = self.size.width
+
+        style = self.rich_style
+        if index == self.index:
+            style += self.get_component_rich_style("request-list--highlight")
+
+        if index >= len(self.rows):
+            return Strip.blank(width, style)
+
+        text = Text.from_markup(self.label(self.rows[index]), style=style)
+        text.truncate(width + scroll_x)
+        segments = list(text.render(self.app.console))
+        strip = Strip(segments).crop(scroll_x, scroll_x + width)
+        return strip.adjust_cell_length(width, style)
+
+    def label(self, request_id: str) -> str:
+        api_request = self.store.get(request_id)
+        if api_request is None:
+            return ""
+        request = api_request.request
+        pin = "📌 " if request_id in self.store.pinned else ""
+        number = self.store.number(request_id)
+        return f" {pin}{number}. [b]\\[{request.method}][/] {escape(request.path)}"
+
+    def validate_index(self, index: Optional[int]) -> Optional[int]:
+        if index is None or not self.rows:
+            return None
+        return max(0, min(index, len(self.rows) - 1))
+
+    def watch_index(self, old_index: Optional[int], new_index: Optional[int]) -> None:
+        if new_index is not None:
+            self.scroll_to_index(new_index)
+        self.refresh()
+
+    def scroll_to_index(self, index: int) -> None:
+        top = self.scroll_offset.y
+        height = self.scrollable_content_region.height
+        if index < top:
+            self.scroll_to(y=index, animate=False)
+        elif height and index >= top + height:
+            self.scroll_to(y=index - height + 1, animate=False)
+
+    def action_select_cursor(self) -> None:
+        request_id = self.highlighted_id
+        if request_id is not None:
+            self.post_message(self.Selected(request_id))
+
+    def action_cursor_up(self) -> None:
+        if self.index is not None:
+            self.index -= 1
+
+    def action_cursor_down(self) -> None:
+        if self.index is not None:
+            self.index += 1
+
+    def action_page_up(self) -> None:
+        if self.index is not None:
+            self.index -= max(self.scrollable_content_region.height, 1)
+
+    def action_page_down(self) -> None:
+        if self.index is not None:
+            self.index += max(self.scrollable_content_region.height, 1)
+
+    def action_first(self) -> None:
+        self.index = 0
+
+    def action_last(self) -> None:
+        self.index = len(self.rows) - 1
+
+    def on_click(self, event: Click) -> None:
+        index = self.scroll_offset.y + event.y
+        if 0 <= index < len(self.rows):
+            self.index = index
+            self.action_select_cursor()
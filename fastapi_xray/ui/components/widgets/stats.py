@@ -0,0 +1,61 @@
+from rich.markup import escape
+from rich.table import Table
+from textual.widgets import Static
+
+from fastapi_xray.stats import SORT_KEYS, StatsEngine
+
+# Max number of routes listed, the largest ones by the sort key
+MAX_ROUTES = 200
+
+# Sort key, header and format of the columns after the method and route
+COLUMNS = (
+    ("count", "Count", "{:d}"),
+    ("rate", "Req/s", "{:.2f}"),
+    ("errors", "5xx", "{:d}"),
+    ("total", "Total ms", "{:.1f}"),
+    ("mean", "Mean ms", "{:.2f}"),
+    ("p50", "p50 ms", "{:.2f}"),
+    ("p90", "p90 ms", "{:.2f}"),
+    ("p99", "p99 ms", "{:.2f}"),
+    ("max", "Max ms", "{:.2f}"),
+    ("sql_count", "SQL", "{:d}"),
+    ("sql_time", "SQL ms", "{:.1f}"),
+)
+
+
+class StatsView(Static):
+    """The latency statistics of every route, largest first by ``sort``."""
+
+    def __init__(self, stats: StatsEngine, **kwargs) -> None:
+        super().__init__("", **kwargs)
+        self.stats = stats
+        self.sort = "total"
+
+    def cycle_sort(self) -> str:
+        self.sort = SORT_KEYS[(SORT_KEYS.index(self.sort) + 1) % len(SORT_KEYS)]
+        self.refresh_stats()
+        return self.sort
+
+    def refresh_stats(self) -> None:
+        self.update(self.render_table())
+
+    def render_table(self) -> Table:
+        table = Table(
+            title=f"{self.stats.count} requests over {len(self.stats.routes)} routes",
+            caption="Press s to change the sort order",
+            expand=True,
+        )
+        table.add_column("Method")
+        table.add_column("Route", ratio=1, overflow="fold")
+        for key, header, _ in COLUMNS:
+            if key == self.sort:
+                header = f"[b]{header} ▼[/]"
+            table.add_column(header, justify="right")
+
+        for summary in self.stats.summaries(self.sort)[:MAX_ROUTES]:
+            table.add_row(
+                summary["method"],
+                escape(summary["route"]),
+                *(fmt.format(summary[key]) for key, _, fmt in COLUMNS),
+            )
+        return table
@@ -2,6 +2,7 @@ from rich import box
 from rich.align import Align
 from rich.panel import Panel
 from textual.widget import Widget
+from textual.widgets import Static
 
 
 class TextBox(Widget):
@@ -34,3 +35,17 @@ class TextBox(Widget):
             box=box.ROUNDED,
             height=self.height,
         )
+
+
+class StatusBar(Static):
+    """A one line bar showing named sections of status information."""
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__("", **kwargs)
+        self.sections = {}
+
+    def set_section(self, name: str, text: str) -> None:
+        if self.sections.get(name) == text:
+            return
+        self.sections[name] = text
+        self.update("  │  ".join(text for text in self.sections.values() if text))
@@ -0,0 +1,224 @@
+"""The query language of the filter bar.
+
+A query is a list of terms separated by spaces, a request must match all of
+them::
+
+    GET path:/items/* status:5xx elapsed:>200 sql:>=3 header:x-tenant body:"out of stock"
+
+- ``GET``, ``method:GET,POST``: the request method.
+- ``path:/items/*``: a glob on the request path, ``/items`` alone as well.
+  Other bare words are searched in the path.
+- ``route:/items/{item_id}``: a glob on the route template.
+- ``status:404``, ``status:4xx``, ``status:400-499``, ``status:>=500``.
+- ``elapsed:200`` or ``elapsed:>=200``: the request time in milliseconds,
+  ``elapsed:<10`` and ``elapsed:10-50`` work as well.
+- ``sql:3`` or ``sql:>=3``: the number of SQL queries, with the same forms.
+- ``header:text``: text in the name or value of a request or response header.
+- ``body:text``: text in the request or response body.
+
+Values with spaces are quoted. Text searches ignore the case.
+"""
+import json
+import math
+import re
+import shlex
+from fnmatch import fnmatchcase
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+from fastapi_xray.stats import route_key
+
+if TYPE_CHECKING:
+    from fastapi_xray.schemas import APIRequest
+
+METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS", "TRACE"}
+
+# Inclusive bounds of a numeric term
+Range = Tuple[float, float]
+
+# Strict bounds are moved by this much, the times are rounded to 0.1 µs
+EPSILON = 1e-6
+
+_COMPARISON = re.compile(r"^(>=|<=|>|<)?\s*(\d+(?:\.\d+)?)$")
+_RANGE = re.compile(r"^(\d+(?:\.\d+)?)\s*-\s*(\d+(?:\.\d+)?)$")
+_STATUS_CLASS = re.compile(r"^([1-5])xx$", re.IGNORECASE)
+
+
+class QueryError(Exception):
+    pass
+
+
+class Query:
+    """A parsed filter, see the module documentation for the syntax.
+
+    The method, status, route, path and elapsed terms can be answered by the
+    indexes of the request store, the others need the requests to be scanned.
+    """
+
+    def __init__(self, text: str = ""):
+        self.text = text
+        self.methods: Set[str] = set()
+        self.routes: List[str] = []
+        self.paths: List[str] = []
+        self.status: Optional[Range] = None
+        self.elapsed: Optional[Range] = None
+        self.sql: Optional[Range] = None
+        self.headers: List[str] = []
+        self.bodies: List[str] = []
+
+    @classmethod
+    def parse(cls, text: str) -> "Query":
+        query = cls(text.strip())
+        try:
+            terms = shlex.split(text)
+        except ValueError as e:
+            raise QueryError(str(e)) from None
+
+        for term in terms:
+            key, sep, value = term.partition(":")
+            key = key.lower()
+            if not sep or key not in _TERMS:
+                if term.upper() in METHODS:
+                    query.methods.add(term.upper())
+                else:
+                    query.paths.append(_glob(term))
+                continue
+            if not value:
+                raise QueryError(f"{key}: needs a value")
+            _TERMS[key](query, value)
+        return query
+
+    def __bool__(self) -> bool:
+        return bool(self.text)
+
+    @property
+    def needs_scan(self) -> bool:
+        """Whether some terms are not answered by the indexes."""
+        return bool(self.sql or self.headers or self.bodies)
+
+    def matches(self, request: "APIRequest") -> bool:
+        details = request.request
+        if self.methods and details.method not in self.methods:
+            return False
+        if self.status and not _within(details.status_code, self.status):
+            return False
+        if self.elapsed and not _within(request.elapsed_time, self.elapsed):
+            return False
+        if self.sql and not _within(len(request.sql), self.sql):
+            return False
+        route = route_key(request)[1]
+        if not all(fnmatchcase(route, pattern) for pattern in self.routes):
+            return False
+        if not all(fnmatchcase(details.path, path) for path in self.paths):
+            return False
+        if self.headers:
+            headers = _headers_text(details.headers, request.response.headers)
+            if not all(header in headers for header in self.headers):
+                return False
+        if self.bodies:
+            bodies = _text(details.body, request.response.body)
+            if not all(body in bodies for body in self.bodies):
+                return False
+        return True
+
+
+def _within(value: float, bounds: Range) -> bool:
+    return bounds[0] <= value <= bounds[1]
+
+
+def _glob(value: str) -> str:
+    if any(char in value for char in "*?["):
+        return value
+    if value.startswith("/"):
+        # A path prefix, /items matches /items and /items/1
+        return f"{value.rstrip('/')}*"
+    return f"*{value}*"
+
+
+def _headers_text(*headers: Dict[str, str]) -> str:
+    return "\n".join(
+        f"{name}: {value}" for items in headers for name, value in items.items()
+    ).lower()
+
+
+def _text(*values) -> str:
+    """The values as one lowercase string, to search text in."""
+    parts = []
+    for value in values:
+        if value is None:
+            continue
+        if not isinstance(value, str):
+            value = json.dumps(value, default=str)
+        parts.append(value)
+    return "\n".join(parts).lower()
+
+
+def parse_range(value: str, at_least: bool = True) -> Range:
+    """Bounds of a numeric term: ``N``, ``>N``, ``>=N``, ``<N``, ``<=N`` or ``N-M``.
+
+    A bare number is a minimum when ``at_least`` is set, an exact value otherwise.
+    """
+    match = _RANGE.match(value)
+    if match:
+        low, high = float(match.group(1)), float(match.group(2))
+        if low > high:
+            raise QueryError(f"Empty range {value!r}")
+        return low, high
+
+    match = _COMPARISON.match(value)
+    if match is None:
+        raise QueryError(f"Invalid number {value!r}")
+    operator, number = match.group(1), float(match.group(2))
+    if operator == ">":
+        return number + EPSILON, math.inf
+    if operator == "<":
+        return -math.inf, number - EPSILON
+    if operator == ">=" or (operator is None and at_least):
+        return number, math.inf
+    if operator == "<=":
+        return -math.inf, number
+    return number, number
+
+
+def _intersect(current: Optional[Range], bounds: Range) -> Range:
+    if current is None:
+        return bounds
+    return max(current[0], bounds[0]), min(current[1], bounds[1])
+
+
+def _method(query: Query, value: str) -> None:
+    for method in value.upper().split(","):
+        if method not in METHODS:
+            raise QueryError(f"Unknown method {method!r}")
+        query.methods.add(method)
+
+
+def _status(query: Query, value: str) -> None:
+    match = _STATUS_CLASS.match(value)
+    if match:
+        low = int(match.group(1)) * 100
+        bounds = (low, low + 99)
+    else:
+        bounds = parse_range(value, at_least=False)
+    query.status = _intersect(query.status, bounds)
+
+
+def _elapsed(query: Query, value: str) -> None:
+    if value.endswith("ms"):
+        value = value[:-2]
+    query.elapsed = _intersect(query.elapsed, parse_range(value))
+
+
+def _sql(query: Query, value: str) -> None:
+    query.sql = _intersect(query.sql, parse_range(value))
+
+
+_TERMS = {
+    "method": _method,
+    "path": lambda query, value: query.paths.append(_glob(value)),
+    "route": lambda query, value: query.routes.append(value),
+    "status": _status,
+    "elapsed": _elapsed,
+    "sql": _sql,
+    "header": lambda query, value: query.headers.append(value.lower()),
+    "body": lambda query, value: query.bodies.append(value.lower()),
+}
@@ -0,0 +1,566 @@
+import math
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from fastapi_xray.codec import codec_for
+from fastapi_xray.schemas import APIRequest
+from fastapi_xray.stats import route_key
+from fastapi_xray.storage import CaptureStore
+from fastapi_xray.ui.query import Query
+
+# Bounds of the elapsed time buckets grow by 10%, from 1 µs
+LATENCY_LOWEST = 0.001
+LATENCY_FACTOR = math.log1p(0.1)
+# Margin keeping the rounding errors of the bucket bounds out of the matches
+LATENCY_MARGIN = 1e-9
+
+
+class RequestStore:
+    """Captured requests kept in arrival order with a bounded size.
+
+    Once the number of requests goes above ``max_requests`` or their approximate
+    size goes above ``max_bytes``, the oldest requests are evicted first.
+    Pinned requests are never evicted and don't count towards the limits.
+    Setting ``worker`` only lists the requests captured by that worker, and
+    setting ``query`` only the requests matching it.
+
+    The requests are indexed by method, status, route, path, worker and
+    elapsed time, so most filters don't have to look at every request.
+    The listed requests are kept up to date as requests are added and evicted,
+    a filter is only evaluated over all the requests when it changes.
+    """
+
+    def __init__(
+        self, max_requests: Optional[int] = None, max_bytes: Optional[int] = None
+    ):
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+
+        self.size_bytes = 0
+        self.evictions = 0
+        self.total = 0
+        self.pinned: Set[str] = set()
+        self.worker: Optional[str] = None
+        self.query = Query()
+
+        self._requests: "OrderedDict[str, APIRequest]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._numbers: Dict[str, int] = {}
+        # Secondary indexes, value to the ids of the requests
+        self._by_method: Dict[str, Set[str]] = {}
+        self._by_status: Dict[int, Set[str]] = {}
+        self._by_route: Dict[str, Set[str]] = {}
+        self._by_path: Dict[str, Set[str]] = {}
+        self._by_worker: Dict[Optional[str], Set[str]] = {}
+        # Log-scaled buckets of elapsed time, see latency_bucket
+        self._by_latency: Dict[int, Set[str]] = {}
+        # Ids of all the requests and of the ones matching the filter it was
+        # computed for, in order
+        self._all = ListedRequests()
+        self._listed: Optional[ListedRequests] = None
+        self._listed_filter: Optional[Tuple[Optional[str], Query]] = None
+
+    def __len__(self) -> int:
+        return len(self._requests)
+
+    def __contains__(self, request_id: str) -> bool:
+        return request_id in self._requests
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._requests)
+
+    def __reversed__(self) -> Iterator[str]:
+        return reversed(self._requests)
+
+    def get(self, request_id: str) -> Optional[APIRequest]:
+        return self._requests.get(request_id)
+
+    def event(self, request_id: str) -> Optional[Dict]:
+        """The request as the event it was built from, e.g. to export it."""
+        request = self._requests.get(request_id)
+        return request.dict() if request is not None else None
+
+    def rows(self) -> Sequence[str]:
+        """The ids of the listed requests, newest first, as they are now."""
+        if self.worker is None and not self.query:
+            self._listed = self._listed_filter = None
+            return self._all.view()
+
+        if self._listed_filter != (self.worker, self.query):
+            self._listed = ListedRequests(reversed(self._search()))
+            self._listed_filter = (self.worker, self.query)
+        return self._listed.view()
+
+    def _listed_matches(self, request: APIRequest) -> bool:
+        if self._listed_filter != (self.worker, self.query):
+            return False
+        if self.worker is not None and worker_id(request) != self.worker:
+            return False
+        return self.query.matches(request)
+
+    def _search(self) -> List[str]:
+        """The ids of the requests matching the filters, newest first."""
+        query = self.query
+        candidates = self._candidates()
+        if candidates is None:
+            request_ids: Iterable[str] = reversed(self._requests)
+        elif len(candidates) * 8 > len(self._requests):
+            # Cheaper to walk the requests in order than to sort most of them
+            request_ids = (
+                request_id
+                for request_id in reversed(self._requests)
+                if request_id in candidates
+            )
+        else:
+            request_ids = sorted(
+                candidates, key=self._numbers.__getitem__, reverse=True
+            )
+
+        if query.needs_scan:
+            requests = self._requests
+            return [
+                request_id
+                for request_id in request_ids
+                if query.matches(requests[request_id])
+            ]
+        return list(request_ids)
+
+    def _candidates(self) -> Optional[Set[str]]:
+        """The ids matching the indexed filters, None when none is set."""
+        query = self.query
+        matches: List[Set[str]] = []
+        if self.worker is not None:
+            matches.append(self._by_worker.get(self.worker, set()))
+        if query.methods:
+            matches.append(_union(self._by_method, query.methods.__contains__))
+        if query.status:
+            low, high = query.status
+            matches.append(
+                _union(self._by_status, lambda status: low <= status <= high)
+            )
+        if query.routes:
+            matches.append(_union(self._by_route, _glob_matcher(query.routes)))
+        if query.paths:
+            matches.append(_union(self._by_path, _glob_matcher(query.paths)))
+        if query.elapsed:
+            matches.append(self._elapsed_between(*query.elapsed))
+
+        if not matches:
+            return None
+        matches.sort(key=len)
+        return matches[0].intersection(*matches[1:])
+
+    def _elapsed_between(self, low: float, high: float) -> Set[str]:
+        """The ids of the requests which took from ``low`` to ``high`` ms.
+
+        Buckets within the range are taken whole, only the requests of the
+        buckets across its bounds are looked at.
+        """
+        matches: Set[str] = set()
+        for bucket, ids in self._by_latency.items():
+            bucket_low, bucket_high = latency_bounds(bucket)
+            if bucket_high < low or bucket_low > high:
+                continue
+            if (
+                low <= bucket_low * (1 - LATENCY_MARGIN)
+                and bucket_high * (1 + LATENCY_MARGIN) <= high
+            ):
+                matches |= ids
+                continue
+            requests = self._requests
+            matches.update(
+                request_id
+                for request_id in ids
+                if low <= requests[request_id].elapsed_time <= high
+            )
+        return matches
+
+    def workers(self) -> List[str]:
+        """The ids of the workers which captured the stored requests."""
+        return sorted(worker for worker in self._by_worker if worker is not None)
+
+    def number(self, request_id: str) -> int:
+        """The position of the request in the capture, starting at 1."""
+        return self._numbers.get(request_id, 0)
+
+    def add(self, request: APIRequest, size: int) -> List[str]:
+        """Stores the request and returns the ids of the evicted requests."""
+        self._requests[request.request_id] = request
+        self._sizes[request.request_id] = size
+        self.size_bytes += size
+        self.total += 1
+        self._numbers[request.request_id] = self.total
+        self._index(request)
+        self._all.append(request.request_id)
+        if self._listed is not None and self._listed_matches(request):
+            self._listed.append(request.request_id)
+        return self._evict()
+
+    def toggle_pin(self, request_id: str) -> bool:
+        """Pins or unpins a request, returns whether it is now pinned."""
+        if request_id not in self._requests:
+            return False
+
+        if request_id in self.pinned:
+            self.pinned.discard(request_id)
+            self.size_bytes += self._sizes[request_id]
+            return False
+
+        self.pinned.add(request_id)
+        self.size_bytes -= self._sizes[request_id]
+        return True
+
+    def clear(self) -> None:
+        self._requests.clear()
+        self._sizes.clear()
+        self._numbers.clear()
+        self._by_method.clear()
+        self._by_status.clear()
+        self._by_route.clear()
+        self._by_path.clear()
+        self._by_worker.clear()
+        self._by_latency.clear()
+        self._all = ListedRequests()
+        self._listed = self._listed_filter = None
+        self.pinned.clear()
+        self.size_bytes = 0
+
+    def _over_budget(self, count: int, size: int) -> bool:
+        if self.max_requests and count > self.max_requests:
+            return True
+        return bool(self.max_bytes) and size > self.max_bytes
+
+    def _evict(self) -> List[str]:
+        count = len(self._requests) - len(self.pinned)
+        size = self.size_bytes
+
+        evicted = []
+        for request_id in self._requests:
+            if not self._over_budget(count, size):
+                break
+            if request_id in self.pinned:
+                continue
+            evicted.append(request_id)
+            count -= 1
+            size -= self._sizes[request_id]
+
+        for request_id in evicted:
+            self._unindex(self._requests[request_id])
+            self._all.remove(request_id)
+            if self._listed is not None:
+                self._listed.remove(request_id)
+            del self._requests[request_id]
+            del self._sizes[request_id]
+            del self._numbers[request_id]
+
+        self.size_bytes = size
+        self.evictions += len(evicted)
+        return evicted
+
+    def _index_keys(self, request: APIRequest):
+        return (
+            (self._by_method, request.request.method),
+            (self._by_status, request.request.status_code),
+            (self._by_route, route_key(request)[1]),
+            (self._by_path, request.request.path),
+            (self._by_worker, worker_id(request)),
+            (self._by_latency, latency_bucket(request.elapsed_time)),
+        )
+
+    def _index(self, request: APIRequest) -> None:
+        request_id = request.request_id
+        for index, key in self._index_keys(request):
+            index.setdefault(key, set()).add(request_id)
+
+    def _unindex(self, request: APIRequest) -> None:
+        """Removes the request from the indexes, before it is deleted."""
+        request_id = request.request_id
+        for index, key in self._index_keys(request):
+            ids = index[key]
+            ids.discard(request_id)
+            if not ids:
+                del index[key]
+
+
+def latency_bucket(elapsed: float) -> int:
+    if elapsed <= LATENCY_LOWEST:
+        return 0
+    return int(math.log(elapsed / LATENCY_LOWEST) / LATENCY_FACTOR) + 1
+
+
+def latency_bounds(bucket: int) -> Tuple[float, float]:
+    """The range of elapsed times a bucket holds."""
+    if bucket == 0:
+        return -math.inf, LATENCY_LOWEST
+    low = LATENCY_LOWEST * math.exp((bucket - 1) * LATENCY_FACTOR)
+    return low, low * math.exp(LATENCY_FACTOR)
+
+
+def _glob_matcher(patterns: List[str]):
+    """Accepts the values matching all the glob patterns."""
+    return lambda value: all(fnmatchcase(value, pattern) for pattern in patterns)
+
+
+def _union(index: Dict, accept) -> Set[str]:
+    """The ids of the index entries whose value is accepted."""
+    matches = [ids for value, ids in index.items() if accept(value)]
+    if len(matches) == 1:
+        return matches[0]
+    return set().union(*matches)
+
+
+def worker_id(request: APIRequest) -> Optional[str]:
+    return request.worker.id if request.worker is not None else None
+
+
+class ListedRequests:
+    """Request ids in arrival order, which are mostly removed oldest first.
+
+    Requests are evicted oldest first, skipping the pinned ones. The ids are
+    appended to a list and the evicted ones are dropped by moving its start,
+    the pinned ones left behind are set aside. ``view`` gives the ids newest
+    first, by their index, without copying them.
+    """
+
+    def __init__(self, request_ids: Iterable[str] = ()):
+        self._ids: List[str] = []
+        # Position of the first id of the list, they only go up
+        self._base = 0
+        # Index of the first listed id in the list
+        self._start = 0
+        # Ids older than the start which are still listed
+        self._kept: List[str] = []
+        self._positions: Dict[str, int] = {}
+        for request_id in request_ids:
+            self.append(request_id)
+
+    def __len__(self) -> int:
+        return len(self._ids) - self._start + len(self._kept)
+
+    def __contains__(self, request_id: str) -> bool:
+        return request_id in self._positions
+
+    def append(self, request_id: str) -> None:
+        self._positions[request_id] = self._base + len(self._ids)
+        self._ids.append(request_id)
+
+    def remove(self, request_id: str) -> None:
+        position = self._positions.pop(request_id, None)
+        if position is None:
+            return
+        index = position - self._base
+        if index < self._start:
+            self._kept.remove(request_id)
+            return
+
+        start = self._start
+        self._kept.extend(self._ids[start:index])
+        start = self._start = index + 1
+        if start * 2 > len(self._ids):
+            # A new list, the views keep the old one
+            self._ids = self._ids[start:]
+            self._base += start
+            self._start = 0
+
+    def view(self) -> "ListedRows":
+        return ListedRows(
+            self._ids,
+            self._base,
+            self._start,
+            len(self._ids),
+            tuple(self._kept),
+            self._positions,
+        )
+
+
+class ListedRows(Sequence):
+    """The ids of ``ListedRequests`` as they were when it was taken, newest first."""
+
+    def __init__(
+        self,
+        ids: List[str],
+        base: int,
+        start: int,
+        stop: int,
+        kept: Tuple[str, ...],
+        positions: Dict[str, int],
+    ):
+        self._ids = ids
+        self._base = base
+        self._start = start
+        self._stop = stop
+        self._kept = kept
+        self._positions = positions
+        self.count = stop - start + len(kept)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+
+        listed = self._stop - self._start
+        if index < listed:
+            return self._ids[self._stop - 1 - index]
+        return self._kept[len(self._kept) - 1 - (index - listed)]
+
+    def index(self, request_id: str, start: int = 0, stop: Optional[int] = None) -> int:
+        position = self._positions.get(request_id)
+        if position is not None:
+            index = position - self._base
+            if self._start <= index < self._stop and self._ids[index] == request_id:
+                return self._stop - 1 - index
+        if request_id in self._kept:
+            listed = self._stop - self._start
+            return listed + len(self._kept) - 1 - self._kept.index(request_id)
+        raise ValueError(f"{request_id} is not listed")
+
+
+class RecordedRows(Sequence):
+    """The request ids of a recorded session, newest first, read page by page."""
+
+    PAGE_SIZE = 500
+    MAX_PAGES = 20
+
+    def __init__(self, store: "RecordedRequestStore"):
+        self.store = store
+        self.count = store.capture_store.count()
+        # Page number to the ids of the page and their position in the recording
+        self._pages: "OrderedDict[int, Tuple[List[str], Dict[str, int]]]" = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+
+        number, offset = divmod(index, self.PAGE_SIZE)
+        page = self._pages.get(number)
+        if page is None:
+            rows = self.store.capture_store.page(
+                number * self.PAGE_SIZE, self.PAGE_SIZE
+            )
+            page = self._pages[number] = (
+                [request_id for _, request_id in rows],
+                {request_id: seq for seq, request_id in rows},
+            )
+            if len(self._pages) > self.MAX_PAGES:
+                self._pages.popitem(last=False)
+        else:
+            self._pages.move_to_end(number)
+
+        request_ids = page[0]
+        if offset >= len(request_ids):
+            raise IndexError(index)
+        return request_ids[offset]
+
+    def number(self, request_id: str) -> Optional[int]:
+        """The position of the request in the recording, if its page is loaded."""
+        for _, numbers in self._pages.values():
+            if request_id in numbers:
+                return numbers[request_id]
+        return None
+
+    def index(self, request_id: str, start: int = 0, stop: Optional[int] = None) -> int:
+        position = self.store.capture_store.position(request_id)
+        if position is None or position >= self.count:
+            raise ValueError(f"{request_id} is not recorded")
+        return position
+
+
+class RecordedRequestStore:
+    """A recorded session, browsed without loading it in memory.
+
+    It has the same interface as ``RequestStore``, the requests are read from
+    the ``CaptureStore`` when displayed and the most recent ones are cached.
+    Nothing is ever evicted or deleted.
+    """
+
+    def __init__(self, capture_store: CaptureStore, cache_size: int = 256):
+        self.capture_store = capture_store
+        self.cache_size = cache_size
+        self.evictions = 0
+        self.pinned: Set[str] = set()
+        # The recording is not indexed, it can't be filtered on
+        self.worker: Optional[str] = None
+        self.query = Query()
+        self._cache: "OrderedDict[str, APIRequest]" = OrderedDict()
+        self._rows = RecordedRows(self)
+
+    @property
+    def total(self) -> int:
+        return len(self._rows)
+
+    @property
+    def size_bytes(self) -> int:
+        return self.capture_store.size_bytes()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, request_id: str) -> bool:
+        return self.get(request_id) is not None
+
+    def get(self, request_id: str) -> Optional[APIRequest]:
+        request = self._cache.get(request_id)
+        if request is not None:
+            self._cache.move_to_end(request_id)
+            return request
+
+        record = self.capture_store.read(request_id)
+        if record is None:
+            return None
+        codec, payload = record
+        request = APIRequest.from_event(codec_for(codec).decode(payload))
+
+        self._cache[request_id] = request
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return request
+
+    def event(self, request_id: str) -> Optional[Dict]:
+        record = self.capture_store.read(request_id)
+        if record is None:
+            return None
+        codec, payload = record
+        return codec_for(codec).decode(payload)
+
+    def number(self, request_id: str) -> int:
+        number = self._rows.number(request_id)
+        if number is None:
+            number = self.capture_store.seq(request_id) or 0
+        return number
+
+    def rows(self) -> Sequence[str]:
+        return self._rows
+
+    def workers(self) -> List[str]:
+        return []
+
+    def reload(self) -> None:
+        """Picks up the requests recorded since the session was opened."""
+        self._rows = RecordedRows(self)
+
+    def toggle_pin(self, request_id: str) -> bool:
+        if request_id in self.pinned:
+            self.pinned.discard(request_id)
+            return False
+        self.pinned.add(request_id)
+        return True
+
+    def clear(self) -> None:
+        # The recording is read only, only what was cached is dropped
+        self._cache.clear()
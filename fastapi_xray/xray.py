@@ -1,15 +1,15 @@
-import json
 import os
-import socket
 import time
-import uuid
-from typing import Callable, Dict, Union
+from typing import Dict, Optional, Union
 
-from fastapi import FastAPI, HTTPException, Request, Response
-from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI
 
 from fastapi_xray.commons.logger import get_logger
+from fastapi_xray.middleware import XRayMiddleware, request_queries, request_timings
+from fastapi_xray.pool import PoolMonitor, sync_engine
+from fastapi_xray.sampling import SamplingPolicy
+from fastapi_xray.shipper import Shipper
+from fastapi_xray.sql import capture_query
 
 logger = get_logger()
 
@@ -18,39 +18,94 @@ OUT_PORT = int(
     os.environ.get("XRAY_PORT", 8989)
 )  # The port used by the server to receive data for display
 
+_shipper = None
+
 
 def start_xray(
     app: FastAPI,
-    sqlalchemy_engine: "Engine" = None,  # noqa :F821
+    sqlalchemy_engine: Union["Engine", "AsyncEngine"] = None,  # noqa :F821
     host: str = "0.0.0.0",
     port: int = 8989,
+    max_queue_size: int = 10000,
+    batch_size: int = 100,
+    flush_interval: float = 0.2,
+    sampling: Optional[SamplingPolicy] = None,
+    capture_sql_parameters: bool = True,
+    max_body_size: int = 64 * 1024,
+    max_response_body_size: int = 64 * 1024,
+    codec: Optional[str] = None,
+    address: Optional[str] = None,
+    worker_id: Optional[str] = None,
 ) -> None:
     """Starts X-Ray integration for FastAPI.
 
     Args:
         app (FastAPI): The FastAPI application instance.
-        sqlalchemy_engine (Engine, optional): The SQLAlchemy engine instance. Defaults to None.
+        sqlalchemy_engine (Engine | AsyncEngine, optional): The SQLAlchemy engine instance, its
+            queries and connection pool are instrumented. Defaults to None.
         host (str, optional): The UI host listener address where data will be sent. Defaults to "0.0.0.0".
         port (int, optional): The UI port listener address where data will be sent. Defaults to 8899.
+        max_queue_size (int, optional): Max number of events waiting to be shipped. Events captured
+            while the queue is full are dropped. Defaults to 10000.
+        batch_size (int, optional): Max number of events sent to the receiver at once. Defaults to 100.
+        flush_interval (float, optional): Max seconds an event waits for its batch to fill up. Defaults to 0.2.
+        sampling (SamplingPolicy, optional): Decides which requests are captured, e.g.
+            `Sampler(rate=0.1, slow_threshold=500)`. Defaults to None, capturing every request.
+        capture_sql_parameters (bool, optional): Capture the SQL query parameters along with the
+            statements. Disable it to keep sensitive values out of X-Ray. Defaults to True.
+        max_body_size (int, optional): Max number of request body bytes kept, larger bodies are
+            truncated. Binary bodies are only summarized by their size and SHA-256. Defaults to 64 KiB.
+        max_response_body_size (int, optional): Max number of response body bytes kept, after gzip
+            decoding. Only textual bodies are kept, others are summarized by their size. Set it to 0
+            to only capture the size. Defaults to 64 KiB.
+        codec (str, optional): How the events are serialized, "json", "orjson" or "msgpack".
+            msgpack must be installed on the UI side as well. Defaults to None, using orjson
+            when it is installed and json otherwise.
+        address (str, optional): Where the receiver listens when it is not `host` and `port`,
+            "unix:///path/to/socket" or "shm://name" for a shared memory ring. Rings fall back to
+            `host` and `port` when they can't be found, e.g. when the receiver is on another host.
+            Defaults to None.
+        worker_id (str, optional): Names this process in the UI, which tells the workers of a
+            multi-process server apart. Defaults to None, using "hostname:pid".
 
     Returns:
         None
 
     This function sets up the necessary configurations and middleware to integrate X-Ray
     for FastAPI applications. It tracks and logs SQL queries along with their execution times.
-    If the `sqlalchemy_engine` is provided, it sets up event listeners for tracking SQLAlchemy queries.
+    If the `sqlalchemy_engine` is provided, it sets up event listeners for tracking SQLAlchemy queries,
+    and the time the requests wait for a connection of its pool, see `pool.PoolMonitor`. The events
+    of an `AsyncEngine` are listened on its `sync_engine`.
 
-    Additionally, it includes exception handlers for capturing HTTP exceptions and request validation errors,
-    ensuring they can be caught and handled by the middleware.
+    The requests are captured by `XRayMiddleware`, a plain ASGI middleware which observes the
+    responses without changing how the app handles its errors.
     """
     global HOST
     global OUT_PORT
+    global _shipper
 
     HOST = host
     OUT_PORT = port
 
-    app.state.queries = []
-    app.state.error = None
+    if sampling is not None:
+        sampling.bind(app)
+
+    monitor = None
+    if sqlalchemy_engine:
+        monitor = PoolMonitor(sqlalchemy_engine).install()
+
+    _shipper = Shipper(
+        host,
+        port,
+        max_queue_size=max_queue_size,
+        batch_size=batch_size,
+        flush_interval=flush_interval,
+        codec=codec,
+        address=address,
+        worker_id=worker_id,
+        status=(lambda: {"pool": monitor.snapshot()}) if monitor else None,
+    )
+    app.add_event_handler("shutdown", _shipper.stop)
 
     def set_query_start_timer(
         conn, cursor, statement, parameters, context, executemany
@@ -58,150 +113,49 @@ def start_xray(
         conn.info["query_start"] = time.perf_counter()
 
     def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
-        formatted_query = statement.replace("?", "{}").format(*parameters)
-        elapsed_time = (time.perf_counter() - conn.info["query_start"]) * 1000
-        sql_data = {
-            "statement": formatted_query,
-            "execution_time": f"{elapsed_time:.4f}",
-        }
-        # Maintain the queries state so that it can be accessed in the middleware
-        app.state.queries.append(sql_data)
+        queries = request_queries.get()
+        if queries is None:
+            return
+
+        finished = time.perf_counter()
+        elapsed_time = (finished - conn.info["query_start"]) * 1000
+        # The parameters are only interpolated by the UI, when the query is displayed
+        sql_data = capture_query(
+            statement,
+            parameters,
+            executemany,
+            conn.dialect.paramstyle,
+            conn.dialect.name,
+            capture_sql_parameters,
+        )
+        sql_data["execution_time"] = round(elapsed_time, 4)
+        queries.append(sql_data)
+
+        timings = request_timings.get()
+        if timings is not None:
+            timings["sql_capture"] += int((time.perf_counter() - finished) * 1e9)
 
     if sqlalchemy_engine:
         from sqlalchemy import event
 
-        event.listen(sqlalchemy_engine, "before_cursor_execute", set_query_start_timer)
-        event.listen(sqlalchemy_engine, "after_cursor_execute", after_cursor_execute)
-
-    @app.exception_handler(HTTPException)
-    @app.exception_handler(RequestValidationError)
-    async def __exception_handler(
-        request: Request, exc: Union[HTTPException, RequestValidationError]
-    ) -> None:
-        """This is just workaround to capture HTTPException, RequestValidationError.
-        These exceptions basically handled error which means FastAPI handles specially.
-        it inside the http middleware, so re-raise error from so that
-        it can be caught in the middleware
-        """
-        raise exc
-
-    @app.middleware("http")
-    async def inspector_wrapper(request: Request, call_next: Callable) -> Response:
-        request.state.queries = app.state.queries
-        return await inspector(request, call_next)
-
-
-def build_debug_info(request: Request, response: Response) -> Dict:
-    debug_info = {
-        "request_id": str(uuid.uuid4()),
-    }
-
-    request_body = {
-        "base_url": str(request.base_url),
-        "query_params": dict(request.query_params),
-        "path_params": dict(request.path_params),
-        "path": str(request.url.path),
-        "status_code": response.status_code,
-        "method": request.method,
-        "cookies": dict(request.cookies),
-        "headers": dict(request.headers),
-    }
-
-    response_body = {
-        "headers": dict(response.headers) if hasattr(response, "headers") else None,
-    }
-
-    if response.status_code >= 400:
-        err = response.body.decode("utf-8") if hasattr(response, "body") else ""
-
-        try:
-            err = json.loads(err)
-        except json.JSONDecodeError:
-            pass
-
-        response_body["error"] = {
-            "message": err,
-        }
-
-    sql_queries = request.state.queries
-
-    debug_info["request"] = request_body
-    debug_info["response"] = response_body
-    debug_info["sql"] = sql_queries
-
-    return debug_info
-
-
-async def set_body(request: Request, body: bytes):
-    async def receive():
-        return {"type": "http.request", "body": body}
-
-    request._receive = receive
-
-
-async def get_body(request: Request) -> bytes:
-    body = await request.body()
-    await set_body(request, body)
-    return body
-
-
-async def inspector(request: Request, call_next: Callable) -> Response:
-    body = None
-    body = await extract_body(body, request)
-
-    start_time = time.perf_counter()
-    try:
-        response = await call_next(request)
-    except HTTPException as htex:
-        response = JSONResponse(status_code=htex.status_code, content=htex.detail)
-    except RequestValidationError as re:
-        response = JSONResponse(status_code=422, content=re.errors())
-    except Exception as e:
-        response = JSONResponse(status_code=500, content=str(e))
-    finally:
-        end_time = time.perf_counter()
-        elapsed_time = (end_time - start_time) * 1000
-        elapsed_time = f"{elapsed_time:.4f}"
-
-    debug_info = build_debug_info(request, response)
-
-    debug_info["elapsed_time"] = elapsed_time
-
-    debug_info["request"]["body"] = body
-
-    try:
-        send_debug_info(debug_info)
-    except Exception as e:
-        logger.error(f"Exception: {e}")
-    finally:
-        request.state.queries.clear()
-
-    return response
-
-
-async def extract_body(body: bytes, request: Request) -> bytes:
-    if request.headers.get("Content-Type") == "application/json":
-        # This is workaround to get request body in the middleware
-        # https://stackoverflow.com/a/74778485/6832201
-        await set_body(request, await request.body())
-        body = await request.json()
-    elif request.headers.get("Content-Type") == "application/x-www-form-urlencoded":
-        await set_body(request, await request.body())
-        form_data = await form_to_json(request)
-        return form_data
-    return body
+        engine = sync_engine(sqlalchemy_engine)
+        event.listen(engine, "before_cursor_execute", set_query_start_timer)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
 
-async def form_to_json(request: Request):
-        form_data = await request.form()
-        form_items = form_data.items()
-        form_body = {}
-        for item in form_items:
-            form_body[item[0]] = item[1]
-        return form_body
+    app.add_middleware(
+        XRayMiddleware,
+        on_event=send_debug_info,
+        sampling=sampling,
+        max_body_size=max_body_size,
+        max_response_body_size=max_response_body_size,
+    )
 
 
 def send_debug_info(debug_info: Dict):
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as out_sock:
-        out_sock.connect((HOST, OUT_PORT))
-        out_sock.sendall(json.dumps(debug_info).encode("utf-8"))
-        logger.info("Sent data to receiver")
+    """Hands the debug info over to the background shipper, never blocks."""
+    global _shipper
+
+    if _shipper is None:
+        _shipper = Shipper(HOST, OUT_PORT)
+
+    _shipper.submit(debug_info)
@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import json
+
+import pytest
+
+from fastapi_xray.capture import BodyCapture, MultipartScanner
+
+BOUNDARY = "XyZ"
+# Looks like the start of a boundary, or a boundary without its line break
+CONTENT = b"\r\n--Xy" + bytes(range(256)) + b"a--XyZ\r\n-"
+MULTIPART = (
+    b"--XyZ\r\n"
+    b'Content-Disposition: form-data; name="field"\r\n'
+    b"\r\n"
+    b"value\r\n"
+    b"--XyZ\r\n"
+    b'Content-Disposition: form-data; name="upload"; filename="a.bin"\r\n'
+    b"Content-Type: application/octet-stream\r\n"
+    b"\r\n" + CONTENT + b"\r\n"
+    b"--XyZ--\r\n"
+)
+PARTS = [
+    {"name": "field", "filename": None, "content_type": None, "size": 5},
+    {
+        "name": "upload",
+        "filename": "a.bin",
+        "content_type": "application/octet-stream",
+        "size": len(CONTENT),
+    },
+]
+
+
+def scan(chunks):
+    scanner = MultipartScanner(BOUNDARY)
+    for chunk in chunks:
+        scanner.feed(chunk)
+    return scanner
+
+
+def test_multipart():
+    scanner = scan([MULTIPART])
+    assert scanner.parts == PARTS
+    assert scanner.complete
+    assert not scanner.truncated
+
+
+@pytest.mark.parametrize("split", range(len(MULTIPART) + 1))
+def test_multipart_split(split):
+    scanner = scan([MULTIPART[:split], MULTIPART[split:]])
+    assert scanner.parts == PARTS
+    assert scanner.complete
+
+
+def test_multipart_byte_by_byte():
+    scanner = scan(MULTIPART[i : i + 1] for i in range(len(MULTIPART)))
+    assert scanner.parts == PARTS
+    assert scanner.complete
+
+
+def test_multipart_too_many_parts():
+    part = b'--XyZ\r\nContent-Disposition: form-data; name="f"\r\n\r\nv\r\n'
+    scanner = scan([part * (MultipartScanner.MAX_PARTS + 1) + b"--XyZ--\r\n"])
+    assert len(scanner.parts) == MultipartScanner.MAX_PARTS
+    assert scanner.truncated
+
+
+def test_multipart_headers_too_large():
+    scanner = scan([b"--XyZ\r\nX-Big: " + b"a" * (MultipartScanner.MAX_HEADERS_SIZE)])
+    assert scanner.parts == []
+    assert scanner.truncated
+
+
+def capture(content_type, chunks, max_bytes=1024):
+    """Feeds the chunks through the capture as the app reads them."""
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks)
+    ]
+
+    async def receive():
+        return messages.pop(0)
+
+    async def read_all(body_capture):
+        received = []
+        for _ in range(len(chunks)):
+            received.append((await body_capture())["body"])
+        return received
+
+    body_capture = BodyCapture(receive, content_type, max_bytes)
+    assert asyncio.run(read_all(body_capture)) == list(chunks)
+    return body_capture
+
+
+def test_body_multipart():
+    chunks = [MULTIPART[:40], MULTIPART[40:]]
+    body_capture = capture(f"multipart/form-data; boundary={BOUNDARY}", chunks)
+    assert body_capture.body == {
+        "size": len(MULTIPART),
+        "parts": PARTS,
+        "truncated": False,
+    }
+    assert body_capture.buffer == b""
+
+
+def test_body_json():
+    body = json.dumps({"a": [1, 2]}).encode()
+    body_capture = capture("application/json", [body[:3], body[3:]])
+    assert body_capture.body == {"a": [1, 2]}
+
+
+def test_body_form():
+    body_capture = capture("application/x-www-form-urlencoded", [b"a=1&b=", b"&c=x"])
+    assert body_capture.body == {"a": "1", "b": "", "c": "x"}
+
+
+def test_body_truncated():
+    body_capture = capture("text/plain", [b"abcdef", b"ghij"], max_bytes=8)
+    assert body_capture.truncated
+    assert body_capture.body == "abcdefgh… [truncated, 10 bytes in total]"
+
+
+def test_body_binary():
+    body_capture = capture("image/png", [b"\x89PNG", b"\x00" * 100])
+    assert body_capture.body == {
+        "content_type": "image/png",
+        "size": 104,
+        "sha256": hashlib.sha256(b"\x89PNG" + b"\x00" * 100).hexdigest(),
+    }
+    assert body_capture.buffer == b""
+
+
+def test_body_empty():
+    assert capture("application/json", [b""]).body is None
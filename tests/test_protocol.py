@@ -0,0 +1,129 @@
+import json
+
+import pytest
+
+from fastapi_xray.codec import JSON, MSGPACK
+from fastapi_xray.protocol import (
+    EVENT,
+    HEADER,
+    HEADER_V1,
+    LENGTH,
+    MAX_FRAME_SIZE,
+    PREAMBLE,
+    Batch,
+    FrameDecoder,
+    ProtocolError,
+    encode_batch,
+    encode_event,
+)
+
+EVENTS = [
+    json.dumps({"request_id": str(n), "path": "/x" * n}).encode() for n in range(4)
+]
+TAG = json.dumps({"id": "w1", "seq": 3}).encode()
+
+STREAM = b"".join(
+    [
+        PREAMBLE,
+        encode_event(EVENTS[0]),
+        encode_batch(EVENTS[1:3], MSGPACK),
+        HEADER_V1.pack(len(EVENTS[3]), 1, EVENT) + EVENTS[3],
+        encode_batch(EVENTS, JSON, tag=TAG),
+        encode_batch([], JSON, tag=TAG),
+    ]
+)
+BATCHES = [
+    Batch(JSON, EVENTS[:1]),
+    Batch(MSGPACK, EVENTS[1:3]),
+    Batch(JSON, EVENTS[3:]),
+    Batch(JSON, EVENTS, TAG),
+    Batch(JSON, [], TAG),
+]
+
+
+def feed_all(chunks):
+    decoder = FrameDecoder()
+    batches = []
+    for chunk in chunks:
+        batches += decoder.feed(chunk)
+    return batches + decoder.close()
+
+
+def events_of(batches):
+    return [event for batch in batches for event in batch.events]
+
+
+def test_frames():
+    assert feed_all([STREAM]) == BATCHES
+
+
+@pytest.mark.parametrize("split", range(len(STREAM) + 1))
+def test_frames_split(split):
+    assert feed_all([STREAM[:split], STREAM[split:]]) == BATCHES
+
+
+def test_frames_byte_by_byte():
+    assert feed_all(STREAM[i : i + 1] for i in range(len(STREAM))) == BATCHES
+
+
+def test_single_event_batch_is_an_event_frame():
+    assert encode_batch(EVENTS[:1]) == encode_event(EVENTS[0])
+
+
+LINES = b'{"a": 1}\n\n{"b": 2}\r\n{"c": 3}\n'
+
+
+@pytest.mark.parametrize("split", range(len(LINES) + 1))
+def test_legacy_lines_split(split):
+    batches = feed_all([LINES[:split], LINES[split:]])
+    assert all(batch.codec == JSON and batch.tag is None for batch in batches)
+    assert [json.loads(event) for event in events_of(batches)] == [
+        {"a": 1},
+        {"b": 2},
+        {"c": 3},
+    ]
+
+
+def test_legacy_document_terminated_by_close():
+    document = json.dumps({"request_id": "one-shot"}).encode()
+    decoder = FrameDecoder()
+    assert decoder.feed(document[:5]) == []
+    assert decoder.feed(document[5:]) == []
+    assert decoder.close() == [Batch(JSON, [document])]
+    assert decoder.framed is False
+
+
+def test_legacy_client_starting_like_the_preamble():
+    decoder = FrameDecoder()
+    assert decoder.feed(b"XR") == []
+    assert decoder.framed is None
+    assert decoder.feed(b"Y\n") == [Batch(JSON, [b"XRY"])]
+    assert decoder.framed is False
+
+
+def test_unsupported_version():
+    decoder = FrameDecoder()
+    with pytest.raises(ProtocolError):
+        decoder.feed(PREAMBLE + HEADER_V1.pack(1, 9, EVENT) + b"\x00x")
+
+
+def test_frame_size_limit():
+    decoder = FrameDecoder()
+    with pytest.raises(ProtocolError):
+        decoder.feed(PREAMBLE + HEADER_V1.pack(MAX_FRAME_SIZE + 1, 1, EVENT))
+
+
+def test_truncated_batch():
+    frame = encode_batch(EVENTS[:2])
+    # Claims one more event than the payload holds
+    start = HEADER.size
+    frame = frame[:start] + LENGTH.pack(3) + frame[start + LENGTH.size :]
+    with pytest.raises(ProtocolError):
+        FrameDecoder().feed(PREAMBLE + frame)
+
+
+def test_closed_mid_frame():
+    decoder = FrameDecoder()
+    decoder.feed(STREAM[:-3])
+    with pytest.raises(ProtocolError):
+        decoder.close()
@@ -0,0 +1,78 @@
+import math
+
+import pytest
+
+from fastapi_xray.ui.query import EPSILON, Query, QueryError, parse_range
+
+
+def test_parse():
+    query = Query.parse(
+        'GET path:/items/* status:5xx elapsed:>200 sql:>=3 header:X-Tenant body:"Out of stock"'
+    )
+    assert query.methods == {"GET"}
+    assert query.paths == ["/items/*"]
+    assert query.status == (500, 599)
+    assert query.elapsed == (200 + EPSILON, math.inf)
+    assert query.sql == (3, math.inf)
+    assert query.headers == ["x-tenant"]
+    assert query.bodies == ["out of stock"]
+    assert query.needs_scan
+
+
+def test_parse_bare_words():
+    query = Query.parse("post /items items method:put,DELETE route:/items/{id}")
+    assert query.methods == {"POST", "PUT", "DELETE"}
+    assert query.paths == ["/items*", "*items*"]
+    assert query.routes == ["/items/{id}"]
+    assert not query.needs_scan
+
+
+@pytest.mark.parametrize(
+    "term, bounds",
+    [
+        ("status:404", (404, 404)),
+        ("status:4XX", (400, 499)),
+        ("status:400-499", (400, 499)),
+        ("status:>=500", (500, math.inf)),
+        ("status:<300", (-math.inf, 300 - EPSILON)),
+    ],
+)
+def test_parse_status(term, bounds):
+    assert Query.parse(term).status == bounds
+
+
+@pytest.mark.parametrize(
+    "value, bounds",
+    [
+        ("200", (200, math.inf)),
+        ("200ms", (200, math.inf)),
+        ("<=10", (-math.inf, 10)),
+        ("10-50.5", (10, 50.5)),
+    ],
+)
+def test_parse_elapsed(value, bounds):
+    assert Query.parse(f"elapsed:{value}").elapsed == bounds
+
+
+def test_parse_intersects_terms():
+    assert Query.parse("elapsed:>=10 elapsed:<=50").elapsed == (10, 50)
+    assert Query.parse("status:4xx status:>=404").status == (404, 499)
+
+
+def test_parse_range_exact():
+    assert parse_range("3", at_least=False) == (3, 3)
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["status:abc", "method:FETCH", "elapsed:50-10", "status:", 'body:"unbalanced'],
+)
+def test_parse_errors(text):
+    with pytest.raises(QueryError):
+        Query.parse(text)
+
+
+def test_empty_query():
+    query = Query.parse("  ")
+    assert not query
+    assert not query.needs_scan
@@ -0,0 +1,156 @@
+import pytest
+
+from fastapi_xray.schemas import SQlQuery
+from fastapi_xray.sql import (
+    MAX_EXECUTEMANY_ROWS,
+    MAX_PARAMETER_LENGTH,
+    TRUNCATED,
+    capture_query,
+    fingerprint,
+    group_queries,
+    render_literal,
+    render_statement,
+)
+
+
+def test_capture_query():
+    query = capture_query(
+        "SELECT ?, ?", ["x" * 1000, b"\x00" * 3], False, "qmark", "sqlite"
+    )
+    assert query["statement"] == "SELECT ?, ?"
+    assert query["parameters"] == ["x" * MAX_PARAMETER_LENGTH + TRUNCATED, "<3 bytes>"]
+    assert query["paramstyle"] == "qmark"
+    assert not query["executemany"]
+
+
+def test_capture_executemany():
+    rows = [{"a": n} for n in range(MAX_EXECUTEMANY_ROWS + 5)]
+    query = capture_query("INSERT INTO t VALUES (:a)", rows, True, "named", None)
+    assert query["row_count"] == len(rows)
+    assert query["parameters"] == rows[:MAX_EXECUTEMANY_ROWS]
+
+
+def test_capture_without_parameters():
+    query = capture_query("SELECT ?", [1], False, "qmark", None, False)
+    assert "parameters" not in query
+
+
+@pytest.mark.parametrize(
+    "paramstyle, statement, parameters, rendered",
+    [
+        (
+            "qmark",
+            "SELECT \"a?\" FROM t WHERE a = ? AND b = '?' AND c = ? -- ?",
+            [1, "x'y"],
+            "SELECT \"a?\" FROM t WHERE a = 1 AND b = '?' AND c = 'x''y' -- ?",
+        ),
+        (
+            "numeric",
+            "SELECT :2, ':1', :1 /* :2 */",
+            ["a", 2],
+            "SELECT 2, ':1', 'a' /* :2 */",
+        ),
+        (
+            "named",
+            "SELECT * FROM t WHERE a = :name AND b = ':name' AND c::text = :other",
+            {"name": "n", "other": None},
+            "SELECT * FROM t WHERE a = 'n' AND b = ':name' AND c::text = NULL",
+        ),
+        (
+            "format",
+            "SELECT %s, '100%%', %s",
+            [1.5, "%s"],
+            "SELECT 1.5, '100%', '%s'",
+        ),
+        (
+            "pyformat",
+            "SELECT %(a)s, '%(a)s', 'x%%' FROM t WHERE b = %(b)s AND c LIKE 'y%%'",
+            {"a": 1, "b": "z"},
+            "SELECT 1, '%(a)s', 'x%' FROM t WHERE b = 'z' AND c LIKE 'y%'",
+        ),
+    ],
+)
+def test_render_statement(paramstyle, statement, parameters, rendered):
+    assert render_statement(statement, parameters, paramstyle) == rendered
+
+
+def test_render_statement_missing_parameters():
+    assert render_statement("SELECT ?, ?", [1], "qmark") == "SELECT 1, ?"
+    assert render_statement("SELECT :a, :b", {"a": 1}, "named") == "SELECT 1, :b"
+
+
+def test_render_statement_without_parameters():
+    assert render_statement("SELECT ?", None, "qmark") == "SELECT ?"
+    assert render_statement("SELECT ?", [1], None) == "SELECT ?"
+
+
+@pytest.mark.parametrize(
+    "value, dialect, literal",
+    [
+        (None, None, "NULL"),
+        (True, "postgresql", "TRUE"),
+        (False, "sqlite", "0"),
+        (3, None, "3"),
+        ([1, "a"], None, "(1, 'a')"),
+        ("it's", None, "'it''s'"),
+        ("a\\b", "mysql", "'a\\\\b'"),
+        ("a\\b", "postgresql", "'a\\b'"),
+    ],
+)
+def test_render_literal(value, dialect, literal):
+    assert render_literal(value, dialect) == literal
+
+
+@pytest.mark.parametrize(
+    "statements, expected",
+    [
+        (
+            [
+                "SELECT * FROM t WHERE id IN (1, 2, 3)",
+                "select *  from t\nwhere id in (?,?) -- by id",
+                "SELECT * FROM t WHERE id IN (%s, %s, %s, %s) /* batch */",
+                "SELECT * FROM t WHERE id IN (:a, :b)",
+            ],
+            "select * from t where id in (?+)",
+        ),
+        (
+            [
+                "INSERT INTO t (a, b) VALUES (1, 'x'), (2, 'y')",
+                "INSERT INTO t (a, b) VALUES (?, ?), (?, ?), (?, ?)",
+            ],
+            "insert into t (a,b) values (?+),...",
+        ),
+        (
+            [
+                "SELECT * FROM t WHERE a = 'what?' AND b = ':name' AND c = -1.5e3",
+                "SELECT * FROM t WHERE a = ? AND b = :b AND c = %(c)s",
+            ],
+            "select * from t where a=? and b=? and c=?",
+        ),
+    ],
+)
+def test_fingerprint(statements, expected):
+    assert {fingerprint(statement) for statement in statements} == {expected}
+
+
+def test_fingerprint_keeps_identifiers_and_names():
+    assert fingerprint('SELECT "t1".id2 FROM "t1"') == 'select "t1".id2 from "t1"'
+    assert fingerprint("SELECT a FROM t WHERE id = 1") != fingerprint(
+        "SELECT b FROM t WHERE id = 1"
+    )
+
+
+def test_group_queries():
+    queries = [
+        SQlQuery(statement=f"SELECT * FROM t WHERE id = {n}", execution_time=1.0)
+        for n in range(3)
+    ]
+    queries.append(SQlQuery(statement="SELECT * FROM u", execution_time=5.0))
+    groups = group_queries(queries)
+    assert [(group.fingerprint, group.count) for group in groups] == [
+        ("select * from u", 1),
+        ("select * from t where id=?", 3),
+    ]
+    assert groups[1].total_time == 3.0
+    assert groups[1].mean_time == 1.0
+    assert groups[1].statement == "SELECT * FROM t WHERE id = 0"
@@ -0,0 +1,122 @@
+import math
+import random
+
+import pytest
+
+from fastapi_xray.schemas import APIRequest
+from fastapi_xray.stats import NO_ROUTE, Histogram, RateCounter, StatsEngine
+
+
+def exact_percentile(values, quantile):
+    """The nearest rank percentile of the values."""
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(quantile / 100 * len(ordered))) - 1]
+
+
+def histogram_of(values):
+    histogram = Histogram()
+    for value in values:
+        histogram.record(value)
+    return histogram
+
+
+def test_histogram_uniform():
+    histogram = histogram_of(range(1, 10001))
+    p50, p99 = histogram.percentiles(50, 99)
+    assert p50 == pytest.approx(5000, rel=histogram.precision)
+    assert p99 == pytest.approx(9900, rel=histogram.precision)
+    assert histogram.count == 10000
+    assert histogram.mean == 5000.5
+    assert (histogram.min, histogram.max) == (1, 10000)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_histogram_lognormal(seed):
+    generator = random.Random(seed)
+    values = [generator.lognormvariate(3, 1.5) for _ in range(20000)]
+    histogram = histogram_of(values)
+    for quantile in (50, 90, 99, 99.9):
+        assert histogram.percentile(quantile) == pytest.approx(
+            exact_percentile(values, quantile), rel=histogram.precision
+        )
+    assert histogram.percentile(100) == pytest.approx(
+        max(values), rel=histogram.precision
+    )
+
+
+def test_histogram_out_of_range():
+    histogram = Histogram(lowest=1, highest=100)
+    for value in (0.5, 5000):
+        histogram.record(value)
+    p50, p100 = histogram.percentiles(50, 100)
+    # Within the exact min and the bucket of the values below the range
+    assert 0.5 <= p50 <= 1
+    assert p100 == 5000
+
+
+def test_histogram_empty():
+    assert Histogram().percentiles(50, 99) == [0.0, 0.0]
+
+
+def test_rate_counter():
+    counter = RateCounter(window=10)
+    for second in range(100, 120):
+        counter.add(second + 0.5)
+        counter.add(second + 0.7)
+    # Only the last 10 seconds count
+    assert counter.rate(now=119.9) == 2.0
+    assert counter.rate(now=125.0) == 0.8
+    assert counter.rate(now=200.0) == 0.0
+
+
+def make_request(method, route, elapsed, status=200, sql_time=None):
+    return APIRequest(
+        request_id=f"{method}{route}{elapsed}",
+        request={
+            "base_url": "/",
+            "query_params": {},
+            "path_params": {},
+            "path": "/items/1",
+            "status_code": status,
+            "method": method,
+            "cookies": {},
+            "headers": {},
+            "body": None,
+        },
+        response={"headers": {}},
+        sql=[]
+        if sql_time is None
+        else [{"statement": "SELECT 1", "execution_time": sql_time}],
+        elapsed_time=elapsed,
+        route=route,
+        schema_version=6,
+    )
+
+
+def test_stats_engine():
+    engine = StatsEngine()
+    engine.record_all(
+        [
+            make_request("GET", "/items/{id}", 10),
+            make_request("GET", "/items/{id}", 30, status=500, sql_time=2.5),
+            make_request("POST", "/items/{id}", 5),
+            make_request("GET", None, 100, status=404),
+        ]
+    )
+    assert engine.count == 4
+    summaries = engine.summaries("count")
+    assert [(s["method"], s["route"], s["count"]) for s in summaries][0] == (
+        "GET",
+        "/items/{id}",
+        2,
+    )
+    items = summaries[0]
+    assert items["errors"] == 1
+    assert items["total"] == 40
+    assert (items["sql_count"], items["sql_time"]) == (1, 2.5)
+    assert engine.summaries("total")[0]["route"] == NO_ROUTE
+
+    with pytest.raises(ValueError):
+        engine.summaries("nope")
+    engine.clear()
+    assert engine.summaries() == []
@@ -0,0 +1,142 @@
+import json
+import time
+
+import pytest
+
+from fastapi_xray.codec import JSON
+from fastapi_xray.storage import RECORD, CaptureStore
+from fastapi_xray.ui.store import RecordedRequestStore
+
+
+def make_event(number):
+    return {
+        "schema_version": 6,
+        "request_id": f"r{number}",
+        "request": {
+            "base_url": "http://test/",
+            "query_params": {},
+            "path_params": {},
+            "path": f"/items/{number}",
+            "status_code": 200,
+            "method": "GET",
+            "cookies": {},
+            "headers": {},
+            "body": "x" * 200,
+        },
+        "response": {"headers": {}},
+        "sql": [],
+        "elapsed_time": 1.0,
+        "route": "/items/{id}",
+    }
+
+
+def record(store, numbers, received_at=None):
+    payloads = {}
+    for number in numbers:
+        payload = json.dumps(make_event(number)).encode()
+        at = float(number) if received_at is None else received_at
+        assert store.append(at, JSON, payload)
+        payloads[f"r{number}"] = payload
+    store.flush()
+    return payloads
+
+
+@pytest.fixture
+def segment_size():
+    # Three events per segment
+    return 3 * (RECORD.size + len(json.dumps(make_event(10)).encode()))
+
+
+def test_append_and_read(tmp_path, segment_size):
+    store = CaptureStore(str(tmp_path), segment_size=segment_size)
+    payloads = record(store, range(10, 20))
+    assert store.segments() == [1, 2, 3, 4]
+    assert store.count() == 10
+    for request_id, payload in payloads.items():
+        assert store.read(request_id) == (JSON, payload)
+    assert [payload for _, payload in store.events()] == list(payloads.values())
+    assert store.page(0, 3) == [(10, "r19"), (9, "r18"), (8, "r17")]
+    assert store.position("r19") == 0
+    assert store.position("r10") == 9
+    assert store.seq("r12") == 3
+    assert store.read("nope") is None
+    store.close()
+
+    readonly = CaptureStore(str(tmp_path), readonly=True)
+    assert readonly.read("r15") == (JSON, payloads["r15"])
+    readonly.close()
+
+
+def test_append_undecodable(tmp_path):
+    store = CaptureStore(str(tmp_path))
+    assert not store.append(1.0, JSON, b"{not json")
+    assert not store.append(1.0, JSON, b'{"no": "request"}')
+    store.flush()
+    assert store.count() == 0
+    store.close()
+
+
+def test_readonly_without_recording(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        CaptureStore(str(tmp_path), readonly=True)
+
+
+def test_retention_by_size(tmp_path, segment_size):
+    store = CaptureStore(
+        str(tmp_path), max_bytes=2 * segment_size, segment_size=segment_size
+    )
+    payloads = record(store, range(10, 25))
+    store.enforce_retention()
+    segments = store.segments()
+    # The oldest segments went first, the one being written stays
+    assert segments == [4, 5]
+    assert store.size_bytes() <= 2 * segment_size
+    kept = {f"r{number}" for number in range(19, 25)}
+    assert store.count() == len(kept)
+    for request_id, payload in payloads.items():
+        expected = (JSON, payload) if request_id in kept else None
+        assert store.read(request_id) == expected
+    assert [payload for _, payload in store.events()] == [
+        payloads[f"r{number}"] for number in range(19, 25)
+    ]
+    store.close()
+
+
+def test_retention_by_age(tmp_path, segment_size):
+    # Starting a segment applies the retention as of now
+    now = time.time()
+    store = CaptureStore(str(tmp_path), max_age=60, segment_size=segment_size)
+    record(store, range(10, 13), received_at=now)
+    record(store, range(13, 16), received_at=now + 100)
+    record(store, range(16, 18), received_at=now + 200)
+    assert store.enforce_retention(now=now + 150) == [1]
+    # The segment being written is kept whatever its age
+    assert store.enforce_retention(now=now + 5000) == [2]
+    assert store.segments() == [3]
+    assert store.count() == 2
+    store.close()
+
+
+def test_recorded_session_after_retention(tmp_path, segment_size):
+    store = CaptureStore(
+        str(tmp_path), max_bytes=2 * segment_size, segment_size=segment_size
+    )
+    record(store, range(10, 25))
+    store.enforce_retention()
+
+    recorded = RecordedRequestStore(CaptureStore(str(tmp_path), readonly=True))
+    rows = recorded.rows()
+    assert list(rows) == [f"r{number}" for number in range(24, 18, -1)]
+    assert rows.index("r20") == 4
+    assert recorded.get("r20").request.path == "/items/20"
+    assert recorded.get("r10") is None
+    assert recorded.number("r24") == 15
+
+    # Dropped while the session is browsed
+    store.max_bytes = segment_size
+    record(store, range(25, 27))
+    store.enforce_retention()
+    recorded.reload()
+    assert "r19" not in recorded.rows()
+    store.close()
+    recorded.capture_store.close()
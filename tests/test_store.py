@@ -0,0 +1,163 @@
+import random
+
+import pytest
+
+from fastapi_xray.schemas import APIRequest
+from fastapi_xray.ui.query import Query
+from fastapi_xray.ui.store import RequestStore, latency_bucket, worker_id
+
+METHODS = ["GET", "POST", "DELETE"]
+STATUSES = [200, 201, 404, 500]
+ROUTES = ["/items/{id}", "/users/{id}", None]
+QUERIES = [
+    "",
+    "GET",
+    "status:5xx",
+    "status:4xx method:GET,POST",
+    "path:/items/*",
+    "route:/users/*",
+    "elapsed:>=50",
+    "elapsed:10-20",
+    "sql:>=2",
+    "POST elapsed:<5 status:200",
+    "header:tenant-3",
+    "body:needle",
+]
+
+
+def make_request(number, generator):
+    route = generator.choice(ROUTES)
+    path = route.replace("{id}", str(number)) if route else f"/missing/{number}"
+    return APIRequest(
+        request_id=f"r{number}",
+        request={
+            "base_url": "http://test/",
+            "query_params": {},
+            "path_params": {},
+            "path": path,
+            "status_code": generator.choice(STATUSES),
+            "method": generator.choice(METHODS),
+            "cookies": {},
+            "headers": {"x-tenant": f"tenant-{number % 5}"},
+            "body": {"text": "needle"} if number % 7 == 0 else None,
+        },
+        response={"headers": {}},
+        sql=[
+            {"statement": "SELECT 1", "execution_time": 0.1}
+            for _ in range(generator.randrange(4))
+        ],
+        # Integers too, so requests land on the bounds of the ranges
+        elapsed_time=generator.choice([10, 20, 50, generator.uniform(0, 100)]),
+        route=route,
+        schema_version=6,
+        worker={"id": f"w{number % 3}"},
+    )
+
+
+def expected_rows(store, query, worker=None):
+    return [
+        request_id
+        for request_id in reversed(list(store))
+        if query.matches(store.get(request_id))
+        and (worker is None or worker_id(store.get(request_id)) == worker)
+    ]
+
+
+def check_indexes(store):
+    """Every stored request is indexed under its values, and nothing else is."""
+    indexes = {
+        "method": (store._by_method, lambda request: request.request.method),
+        "status": (store._by_status, lambda request: request.request.status_code),
+        "path": (store._by_path, lambda request: request.request.path),
+        "worker": (store._by_worker, worker_id),
+        "latency": (
+            store._by_latency,
+            lambda request: latency_bucket(request.elapsed_time),
+        ),
+    }
+    for name, (index, key) in indexes.items():
+        expected = {}
+        for request_id in store:
+            expected.setdefault(key(store.get(request_id)), set()).add(request_id)
+        assert index == expected, name
+    assert set(store._sizes) == set(store._numbers) == set(store)
+
+
+@pytest.mark.parametrize("text", QUERIES)
+def test_rows_after_evictions(text):
+    generator = random.Random(text)
+    store = RequestStore(max_requests=50)
+    query = Query.parse(text)
+    for number in range(400):
+        store.add(make_request(number, generator), 100)
+        assert len(store) - len(store.pinned) <= 50
+        if generator.random() < 0.05:
+            store.toggle_pin(generator.choice(list(store)))
+        if number % 37 == 0:
+            # Listed from scratch, then kept up to date as requests come and go
+            store.query = query
+        rows = store.rows()
+        assert list(rows) == expected_rows(store, store.query)
+        for position, request_id in enumerate(rows):
+            assert rows.index(request_id) == position
+    assert store.evictions > 300
+    check_indexes(store)
+
+
+def test_worker_filter():
+    generator = random.Random(1)
+    store = RequestStore(max_requests=30)
+    store.worker = "w1"
+    store.query = Query.parse("GET")
+    for number in range(100):
+        store.add(make_request(number, generator), 10)
+        assert list(store.rows()) == expected_rows(store, store.query, "w1")
+    assert store.workers() == ["w0", "w1", "w2"]
+
+
+def test_rows_are_a_snapshot():
+    generator = random.Random(2)
+    store = RequestStore(max_requests=10)
+    for number in range(10):
+        store.add(make_request(number, generator), 10)
+    rows = store.rows()
+    before = list(rows)
+    for number in range(10, 40):
+        store.add(make_request(number, generator), 10)
+    assert list(rows) == before
+    assert rows[0] == "r9"
+    assert rows[-1] == "r0"
+    assert rows[1:3] == ["r8", "r7"]
+    with pytest.raises(IndexError):
+        rows[10]
+    with pytest.raises(ValueError):
+        store.rows().index("r0")
+
+
+def test_pinned_requests_are_kept():
+    generator = random.Random(3)
+    store = RequestStore(max_bytes=1000)
+    store.add(make_request(0, generator), 300)
+    assert store.toggle_pin("r0")
+    for number in range(1, 20):
+        evicted = store.add(make_request(number, generator), 300)
+        assert "r0" not in evicted
+    assert list(store) == ["r0", "r17", "r18", "r19"]
+    assert store.size_bytes == 900
+    assert list(store.rows()) == ["r19", "r18", "r17", "r0"]
+
+    assert not store.toggle_pin("r0")
+    assert store.add(make_request(20, generator), 300) == ["r0", "r17"]
+    check_indexes(store)
+
+
+def test_clear():
+    generator = random.Random(4)
+    store = RequestStore()
+    store.query = Query.parse("GET")
+    for number in range(5):
+        store.add(make_request(number, generator), 10)
+    store.clear()
+    assert len(store) == 0
+    assert list(store.rows()) == []
+    check_indexes(store)